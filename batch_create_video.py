@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from create_video import prepare_story, render_story
+from utils import TRACER
+
+
+def load_jobs(manifest_path):
+    """
+    读取批量任务清单，支持 JSON 数组或每行一个 JSON 对象（.jsonl），
+    每个任务包含 title、content 和 save_folder。
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        if manifest_path.endswith('.jsonl'):
+            jobs = [json.loads(line) for line in file if line.strip()]
+        else:
+            jobs = json.load(file)
+
+    for i, job in enumerate(jobs):
+        missing = [key for key in ("title", "content", "save_folder") if key not in job]
+        if missing:
+            raise ValueError(f"Job {i} in {manifest_path} is missing {missing}")
+    return jobs
+
+
+def run_batch(jobs, network_workers=2, cpu_workers=1, render_workers=None, trace_folder=".", profile=None,
+              single_encode=False, **prepare_kwargs):
+    """
+    批量生成多个故事的视频。
+
+    依赖网络的阶段（LLM、图片、语音合成）在 network_workers 个线程中并发执行，
+    某个故事准备好后立即交给渲染队列，由 cpu_workers 个渲染任务执行本地编码，
+    这样在渲染当前故事的同时，后续故事的网络阶段也在进行。
+
+    参数:
+    jobs : list
+        由 {"title", "content", "save_folder"} 组成的任务列表。
+    network_workers : int
+        同时进行网络阶段的故事数上限。
+    cpu_workers : int
+        同时进行渲染的故事数上限。
+    render_workers : int
+        每个故事渲染时的进程数，默认把 CPU 核数平均分给 cpu_workers 个渲染任务。
+    trace_folder : str
+        整个批次的 batch_trace.json 和 batch_trace.chrome.json 的输出目录，为 None 时不导出。
+    profile : str
+        渲染配置，例如 "preview"，见 render_story。
+    single_encode : bool
+        为 True 时每个故事的片头和正文一次渲染，见 render_story。
+    prepare_kwargs :
+        传给 prepare_story 的其他参数，如 tts_workers、image_workers。
+
+    返回:
+    list
+        与 jobs 顺序一致的状态列表。
+    """
+    render_workers = render_workers or max(1, (os.cpu_count() or 1) // max(1, cpu_workers))
+    statuses = [{"title": job["title"], "save_folder": job["save_folder"], "status": "pending"} for job in jobs]
+
+    def prepare(i):
+        job = jobs[i]
+        start = time.perf_counter()
+        statuses[i]["status"] = "preparing"
+        with TRACER.span("batch.prepare", "run", story=job["save_folder"]):
+            manifest = prepare_story(job["title"], job["content"], job["save_folder"], **prepare_kwargs)
+        statuses[i]["network_s"] = round(time.perf_counter() - start, 2)
+        statuses[i]["status"] = "queued for render"
+        return manifest
+
+    def render(i, manifest):
+        start = time.perf_counter()
+        statuses[i]["status"] = "rendering"
+        with TRACER.span("batch.render", "run", story=jobs[i]["save_folder"]):
+            output = render_story(jobs[i]["save_folder"], manifest, render_workers=render_workers, profile=profile,
+                                  single_encode=single_encode)
+        statuses[i]["render_s"] = round(time.perf_counter() - start, 2)
+        statuses[i]["status"] = "done"
+        statuses[i]["output"] = output
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, network_workers)) as network_pool, \
+            ThreadPoolExecutor(max_workers=max(1, cpu_workers)) as cpu_pool:
+        prepare_futures = {network_pool.submit(prepare, i): i for i in range(len(jobs))}
+        render_futures = {}
+        for future in as_completed(prepare_futures):
+            i = prepare_futures[future]
+            try:
+                manifest = future.result()
+            except Exception as e:
+                statuses[i]["status"] = "failed (prepare)"
+                statuses[i]["error"] = repr(e)
+                continue
+            render_futures[cpu_pool.submit(render, i, manifest)] = i
+
+        for future in as_completed(render_futures):
+            i = render_futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                statuses[i]["status"] = "failed (render)"
+                statuses[i]["error"] = repr(e)
+
+    print_summary(statuses, time.perf_counter() - start)
+    if trace_folder is not None:
+        json_path, chrome_path = TRACER.export(trace_folder, prefix="batch_trace")
+        print(f"trace written to {json_path} and {chrome_path}")
+    return statuses
+
+
+def print_summary(statuses, elapsed):
+    done = sum(1 for status in statuses if status["status"] == "done")
+    print(f"\nbatch finished: {done}/{len(statuses)} succeeded in {elapsed:.1f}s")
+    for status in statuses:
+        timing = f"network {status.get('network_s', '-')}s, render {status.get('render_s', '-')}s"
+        line = f"  {status['title']:<20} {status['status']:<18} {timing}  {status['save_folder']}"
+        if "error" in status:
+            line += f"\n    error: {status['error']}"
+        print(line)
+
+
+if __name__ == '__main__':
+    # 用法: python batch_create_video.py jobs.json [network_workers] [cpu_workers]
+    if len(sys.argv) < 2:
+        print("usage: python batch_create_video.py <jobs.json|jobs.jsonl> [network_workers] [cpu_workers]")
+        sys.exit(1)
+    jobs = load_jobs(sys.argv[1])
+    network_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    cpu_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    statuses = run_batch(jobs, network_workers=network_workers, cpu_workers=cpu_workers,
+                         trace_folder=os.path.dirname(os.path.abspath(sys.argv[1])))
+    sys.exit(0 if all(status["status"] == "done" for status in statuses) else 1)
@@ -0,0 +1,4 @@
+"""
+离线基准测试：用本地的 OpenAI 兼容服务和阿里云语音合成服务替身运行完整流水线，
+统计各阶段和端到端的耗时与吞吐量。用法见 benchmark/run_benchmark.py。
+"""
@@ -0,0 +1,283 @@
+import io
+import json
+import time
+import uuid
+import wave
+import base64
+import random
+import socket
+import struct
+import hashlib
+import threading
+import subprocess
+import socketserver
+
+import numpy as np
+from moviepy.config import get_setting
+
+# RFC 6455 握手使用的固定 GUID
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+PUNCTUATION = set("，。！？、；：,.!?;:")
+
+
+def synth_pcm(samples: int, sample_rate: int, seed: int = 0) -> bytes:
+    """
+    生成 16 位单声道的合成语音：带包络的正弦音节，响度和频谱大致接近人声。
+    """
+    t = np.arange(samples) / sample_rate
+    freq = 180 + 40 * np.sin(2 * np.pi * 0.7 * t + seed)
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+    signal = 0.3 * envelope * np.sin(2 * np.pi * np.cumsum(freq) / sample_rate)
+    return (signal * 32767).astype("<i2").tobytes()
+
+
+def subtitle_timestamps(text: str, duration: float) -> list:
+    """
+    按 enable_subtitle 的格式生成字级时间戳：每个字符（含标点）平均分配时长，标点的时间段作为停顿，不单独返回。
+    """
+    step = duration * 1000 / max(len(text), 1)
+    words = [{"text": text, "begin_time": 0, "end_time": int(duration * 1000), "begin_index": 0,
+              "end_index": len(text), "sentence": True, "phoneme_list": []}]
+    for i, char in enumerate(text):
+        if char in PUNCTUATION or char.isspace():
+            continue
+        words.append({"text": char, "begin_time": int(i * step), "end_time": int((i + 1) * step),
+                      "begin_index": i, "end_index": i + 1, "sentence": False, "phoneme_list": []})
+    return words
+
+
+def encode_audio(pcm: bytes, sample_rate: int, aformat: str) -> bytes:
+    if aformat == "pcm":
+        return pcm
+    if aformat == "wav":
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(2)
+            file.setframerate(sample_rate)
+            file.writeframes(pcm)
+        return buffer.getvalue()
+    # mp3 与真实服务一样由编码器生成，保证下游解码路径与线上一致
+    proc = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-hide_banner", "-loglevel", "error",
+         "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+         "-c:a", "libmp3lame", "-b:a", "48k", "-f", "mp3", "pipe:1"],
+        input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {proc.stderr.decode('utf-8', 'replace')}")
+    return proc.stdout
+
+
+class FakeNlsServer:
+    """
+    阿里云语音合成 websocket 接口的本地替身。
+
+    收到 StartSynthesis 后按文本长度生成合成音频，以二进制帧分块返回，最后发送 SynthesisCompleted；
+    请求中带 enable_subtitle 时先发送包含字级时间戳的 MetaInfo。
+    同一连接上可以连续处理多个请求，客户端发送关闭帧后断开。
+
+    参数:
+    first_byte_latency : float
+        收到请求到返回第一个音频帧之间的延迟（秒）。
+    realtime_factor : float
+        每秒音频额外需要的合成时间（秒），按块均匀分摊。
+    chars_per_second : float
+        语速，决定合成音频的时长。
+    fail_rate : float
+        以该概率返回 TaskFailed，用于测试重试逻辑。
+    requests_per_connection : int
+        每条连接处理这么多个请求后由服务端主动断开，模拟线上的空闲超时和连接回收；0 表示不限制。
+    close_frame : bool
+        达到 requests_per_connection 后先发送关闭帧并等待客户端回应（正常关闭），而不是直接断开 TCP 连接。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, first_byte_latency=0.1, realtime_factor=0.0,
+                 chars_per_second=4.0, fail_rate=0.0, chunk_size=8192, requests_per_connection=0,
+                 close_frame=False):
+        self.first_byte_latency = first_byte_latency
+        self.realtime_factor = realtime_factor
+        self.chars_per_second = chars_per_second
+        self.fail_rate = fail_rate
+        self.chunk_size = chunk_size
+        self.requests_per_connection = requests_per_connection
+        self.close_frame = close_frame
+        self.connections = 0
+        self.requests = 0
+        self._audio = {}
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                fake._serve(self.request)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate=False)
+        self._server.allow_reuse_address = True
+        self._server.daemon_threads = True
+        self._server.server_bind()
+        self._server.server_activate()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"ws://{host}:{port}/ws/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _audio_for(self, text: str, aformat: str, sample_rate: int):
+        # 相同长度的音频只生成一次，避免基准测试把时间花在替身的编码上
+        duration = round(max(len(text), 1) / self.chars_per_second, 1)
+        key = (duration, aformat, sample_rate)
+        with self._lock:
+            data = self._audio.get(key)
+        if data is None:
+            data = encode_audio(synth_pcm(int(duration * sample_rate), sample_rate), sample_rate, aformat)
+            with self._lock:
+                self._audio[key] = data
+        return data, duration
+
+    # ---- websocket 协议 ----
+
+    @staticmethod
+    def _recv_exact(sock, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("client closed the connection")
+            data += chunk
+        return data
+
+    def _recv_frame(self, sock):
+        head = self._recv_exact(sock, 2)
+        opcode = head[0] & 0x0F
+        masked = head[1] & 0x80
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", self._recv_exact(sock, 2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", self._recv_exact(sock, 8))[0]
+        mask = self._recv_exact(sock, 4) if masked else None
+        payload = self._recv_exact(sock, length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return opcode, payload
+
+    @staticmethod
+    def _send_frame(sock, opcode: int, payload: bytes = b"") -> None:
+        # 服务端发出的帧不加掩码
+        length = len(payload)
+        if length < 126:
+            head = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            head = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        sock.sendall(head + payload)
+
+    def _handshake(self, sock) -> bool:
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = sock.recv(4096)
+            if not chunk:
+                return False
+            request += chunk
+        headers = {}
+        for line in request.decode("latin-1").split("\r\n")[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                # SDK 在自动生成的 Sec-WebSocket-Key 之后又附加了一个固定值，客户端按第一个校验
+                headers.setdefault(name.strip().lower(), value.strip())
+        if not headers.get("x-nls-token"):
+            sock.sendall(b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n")
+            return False
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WS_GUID).encode()).digest()).decode()
+        sock.sendall(("HTTP/1.1 101 Switching Protocols\r\n"
+                      "Upgrade: websocket\r\n"
+                      "Connection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        return True
+
+    def _reply(self, sock, header: dict, name: str, status: int = 20000000, message: str = "GATEWAY|SUCCESS|Success.",
+               payload: dict = None) -> None:
+        body = {
+            "header": {
+                "message_id": uuid.uuid4().hex,
+                "task_id": header.get("task_id", ""),
+                "namespace": "SpeechSynthesizer",
+                "name": name,
+                "status": status,
+                "status_message": message,
+            },
+            "payload": payload or {},
+        }
+        self._send_frame(sock, OP_TEXT, json.dumps(body).encode("utf-8"))
+
+    def _synthesize(self, sock, request: dict) -> None:
+        header, payload = request.get("header", {}), request.get("payload", {})
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.first_byte_latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self._reply(sock, header, "TaskFailed", status=50000000, message="SERVER_ERROR|injected failure")
+            return
+
+        text = payload.get("text", "")
+        audio, duration = self._audio_for(text, payload.get("format", "mp3"), int(payload.get("sample_rate", 16000)))
+        if payload.get("enable_subtitle"):
+            self._reply(sock, header, "MetaInfo", payload={"subtitles": subtitle_timestamps(text, duration)})
+        chunks = max(1, -(-len(audio) // self.chunk_size))
+        for i in range(0, len(audio), self.chunk_size):
+            if self.realtime_factor:
+                time.sleep(duration * self.realtime_factor / chunks)
+            self._send_frame(sock, OP_BINARY, audio[i:i + self.chunk_size])
+        self._reply(sock, header, "SynthesisCompleted")
+
+    def _close(self, sock) -> None:
+        # 发送 1000（正常关闭）关闭帧，等客户端回应关闭帧后再断开；客户端可能先发来下一个请求，直接丢弃
+        self._send_frame(sock, OP_CLOSE, struct.pack(">H", 1000))
+        sock.settimeout(5.0)
+        while self._recv_frame(sock)[0] != OP_CLOSE:
+            pass
+
+    def _serve(self, sock) -> None:
+        with self._lock:
+            self.connections += 1
+        try:
+            if not self._handshake(sock):
+                return
+            served = 0
+            while not self.requests_per_connection or served < self.requests_per_connection:
+                opcode, payload = self._recv_frame(sock)
+                if opcode == OP_CLOSE:
+                    self._send_frame(sock, OP_CLOSE, payload[:2])
+                    return
+                if opcode == OP_PING:
+                    self._send_frame(sock, OP_PONG, payload)
+                elif opcode == OP_TEXT:
+                    request = json.loads(payload.decode("utf-8"))
+                    if request.get("header", {}).get("name") == "StartSynthesis":
+                        self._synthesize(sock, request)
+                        served += 1
+            # 达到请求数上限：默认像真实服务一样直接断开，不发送关闭帧；close_frame 时走正常的关闭握手
+            if self.close_frame:
+                self._close(sock)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
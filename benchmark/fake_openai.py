@@ -0,0 +1,205 @@
+import re
+import json
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+
+def make_png(seed: int, width: int = 1024, height: int = 1024) -> bytes:
+    """
+    生成一张占位 PNG：带噪声的渐变色块，压缩后的大小和编码难度接近真实插图，
+    不会像纯色图片那样让视频编码变得过于轻松。
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = rng.integers(0, 256, size=3)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = (base[0] + x // 4) % 256
+    image[..., 1] = (base[1] + y // 4) % 256
+    image[..., 2] = (base[2] + (x + y) // 8) % 256
+    # 8x8 的块噪声，模拟画面中的细节
+    noise = rng.integers(-24, 24, size=(height // 8 + 1, width // 8 + 1, 3))
+    image = np.clip(image + np.kron(noise, np.ones((8, 8, 1), dtype=int))[:height, :width], 0, 255).astype(np.uint8)
+
+    raw = b"".join(b"\x00" + image[row].tobytes() for row in range(height))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6))
+            + chunk(b"IEND", b""))
+
+
+def split_reply(content: str) -> str:
+    # 每个非空行作为一个段落，按 SPLIT_PROMPT 要求的格式返回
+    paragraphs = [line.strip() for line in content.splitlines() if line.strip()]
+    sentences = {f"sentence_{i}": text for i, text in enumerate(paragraphs, start=1)}
+    return "```json\n" + json.dumps([sentences], ensure_ascii=False, indent=4) + "\n```"
+
+
+def picture_prompt_reply(content: str) -> str:
+    # 为每个 sentence 生成一条互不相同的图片 prompt
+    indices = re.findall(r'"sentence_(\d+)"\s*:', content)
+    prompts = {f"picture_prompt_{i}": f"第{i}幅画面，古代人物在山林间交谈。3D卡通风格" for i in indices}
+    return "```json\n" + json.dumps([prompts], ensure_ascii=False, indent=4) + "\n```"
+
+
+class FakeOpenAIServer:
+    """
+    OpenAI 兼容接口的本地替身，支持 /v1/chat/completions、/v1/images/generations，
+    以及下载生成图片的 /files/<name>.png。
+
+    参数:
+    llm_latency : float
+        每次对话请求生成完整回复的耗时（秒）；stream=True 时按 stream_chunk 个字符一块均匀分摊，以 SSE 逐块返回。
+    image_latency : float
+        每次生成图片请求的固定延迟（秒）。
+    image_size : int
+        占位图片的边长（像素）。
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, llm_latency=0.5, image_latency=1.0, image_size=1024,
+                 stream_chunk=8):
+        self.llm_latency = llm_latency
+        self.stream_chunk = stream_chunk
+        self.image_latency = image_latency
+        self.image_size = image_size
+        self.requests = {"chat": 0, "images": 0, "files": 0}
+        self._images = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _image(self, name: str) -> bytes:
+        with self._lock:
+            data = self._images.get(name)
+        if data is None:
+            data = make_png(int(name[:8], 16), self.image_size, self.image_size)
+            with self._lock:
+                self._images[name] = data
+        return data
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.endswith("/chat/completions"):
+                    self._chat(request)
+                elif self.path.endswith("/images/generations"):
+                    self._images(request)
+                else:
+                    self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+            def do_GET(self):
+                match = re.fullmatch(r"/files/([0-9a-f]+)\.png", self.path)
+                if not match:
+                    self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                    return
+                fake._count("files")
+                self._send(200, fake._image(match.group(1)), "image/png")
+
+            def _stream(self, request, completion_id, reply):
+                # SSE 没有 Content-Length，发送完毕后关闭连接
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                pieces = [reply[i:i + fake.stream_chunk] for i in range(0, len(reply), fake.stream_chunk)]
+                for i, piece in enumerate(pieces + [None]):
+                    if piece is not None:
+                        time.sleep(fake.llm_latency / len(pieces))
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": request.get("model", "gpt-4o-all"),
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"role": "assistant", "content": piece} if piece is not None else {},
+                            "finish_reason": None if piece is not None else "stop",
+                        }],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def _chat(self, request):
+                fake._count("chat")
+                content = request["messages"][-1]["content"]
+                reply = picture_prompt_reply(content) if '"sentence_' in content else split_reply(content)
+                completion_id = f"chatcmpl-{hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]}"
+                if request.get("stream"):
+                    self._stream(request, completion_id, reply)
+                    return
+                time.sleep(fake.llm_latency)
+                self._send(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "gpt-4o-all"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": reply},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": len(content), "completion_tokens": len(reply),
+                              "total_tokens": len(content) + len(reply)},
+                })
+
+            def _images(self, request):
+                fake._count("images")
+                time.sleep(fake.image_latency)
+                name = hashlib.sha1(request.get("prompt", "").encode("utf-8")).hexdigest()
+                host, port = fake._server.server_address[:2]
+                self._send(200, {
+                    "created": int(time.time()),
+                    "data": [{"url": f"http://{host}:{port}/files/{name}.png",
+                              "revised_prompt": request.get("prompt", "")}],
+                })
+
+        return Handler
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+# 从项目根目录运行：python -m benchmark.run_benchmark
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from .fake_openai import FakeOpenAIServer
+from .fake_nls import FakeNlsServer
+
+SENTENCES = [
+    "山脚下的小村庄里住着一位勤劳的老木匠，他每天天不亮就起床干活。",
+    "一天，村口来了一位背着包袱的少年，说想拜老木匠为师学习手艺。",
+    "老木匠没有马上答应，而是让少年先去后山砍十根笔直的松木回来。",
+    "少年在山里转了整整三天，才找到十根又直又结实的松木。",
+    "老木匠看着满手是泡的少年，点了点头，说：“明天开始跟我学刨木头吧。”",
+    "日复一日，少年从刨木头学到打榫卯，手上的老茧越来越厚。",
+    "有一年村里的石桥被洪水冲垮了，大家都愁得吃不下饭。",
+    "少年和老木匠带着乡亲们连夜赶工，用木头搭起了一座新桥。",
+]
+
+RENDER_STAGES = ("frames", "render", "title_render", "body_render", "merge", "assemble")
+# 数据流模式下配音、图片和段落渲染交织在 dataflow 阶段中，单独的渲染耗时无从得出，只对整个阶段做回归比较
+DATAFLOW_STAGES = ("dataflow", "assemble")
+
+
+def make_story(paragraphs: int) -> str:
+    # 每个非空行是一个段落，替身大模型按行切分；首尾带上编号，保证每行字幕都不同，不会命中语音缓存
+    return "\n".join(f"第{i}段，{SENTENCES[(i - 1) % len(SENTENCES)]}（{i}）" for i in range(1, paragraphs + 1))
+
+
+def media_duration(path: str) -> float:
+    from moviepy.editor import VideoFileClip
+    clip = VideoFileClip(path)
+    try:
+        return clip.duration
+    finally:
+        clip.close()
+
+
+def run_one(create_video, tracer, paragraphs: int, args) -> dict:
+    """
+    从空目录开始为一个 paragraphs 段的故事运行完整流水线，返回各阶段耗时和吞吐量。
+    """
+    from utils.resources import resource_usage
+
+    save_folder = os.path.join("output_video", f"benchmark-{paragraphs}")
+    shutil.rmtree(save_folder, ignore_errors=True)
+
+    start = time.perf_counter()
+    create_video.main(title=f"《基准测试{paragraphs}段》", content=make_story(paragraphs), save_folder=save_folder,
+                      tts_workers=args.tts_workers, image_workers=args.image_workers,
+                      render_workers=args.render_workers, dataflow=args.dataflow, profile=args.profile,
+                      still_frames=not args.streaming, streaming=args.streaming, single_encode=args.single_encode)
+    wall_s = time.perf_counter() - start
+
+    summary = tracer.summary()
+    stages = {name[len("stage."):]: round(item["total_s"], 3)
+              for name, item in summary.items() if name.startswith("stage.")}
+    suffix = "" if args.profile == "final" else f"_{args.profile}"
+    video_s = media_duration(os.path.join(save_folder, f"merged_video{suffix}.mp4"))
+    # 数据流模式只有 dataflow 和流复制的 assemble 阶段，不报告渲染速度
+    render_s = 0.0 if args.dataflow else sum(stages.get(name if name == "frames" else name + suffix, 0.0)
+                                              for name in RENDER_STAGES)
+    tts = summary.get("tts.job", {})
+    segments = summary.get("render.segment", {})
+    return {
+        "paragraphs": paragraphs,
+        "wall_s": round(wall_s, 3),
+        "video_s": round(video_s, 3),
+        "stages": stages,
+        "tts_jobs": tts.get("count", 0),
+        "paragraphs_per_s": round(paragraphs / wall_s, 3),
+        # 每秒墙钟时间能产出多少秒成片，大于 1 表示快于实时
+        "render_speed": round(video_s / render_s, 3) if render_s else None,
+        "end_to_end_speed": round(video_s / wall_s, 3),
+        # 进程启动以来的峰值内存，多个故事依次运行时取到目前为止的最大值
+        "peak_rss_mb": resource_usage()["peak_rss_mb"],
+        "segment_max_open_fds": segments.get("max_open_fds"),
+        "trace": os.path.join(save_folder, "trace.json"),
+    }
+
+
+def print_report(results) -> None:
+    stage_names = []
+    for result in results:
+        stage_names += [name for name in result["stages"] if name not in stage_names]
+    print("\nbenchmark results (seconds)")
+    header = f"{'paragraphs':>10} {'wall':>8} {'video':>8} " + " ".join(f"{name:>15}" for name in stage_names)
+    print(header + f" {'para/s':>8} {'render x':>9} {'e2e x':>7}")
+    for result in results:
+        row = f"{result['paragraphs']:>10} {result['wall_s']:>8.2f} {result['video_s']:>8.2f} "
+        row += " ".join(f"{result['stages'].get(name, 0.0):>15.2f}" for name in stage_names)
+        render_speed = f"{result['render_speed']:>9.2f}" if result["render_speed"] else f"{'n/a':>9}"
+        row += f" {result['paragraphs_per_s']:>8.2f} {render_speed} {result['end_to_end_speed']:>7.2f}"
+        print(row)
+
+
+def compare(results, baseline_path: str, tolerance: float) -> list:
+    """
+    与上一次保存的结果比较，返回端到端或渲染阶段变慢超过 tolerance 的条目。
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as file:
+        baseline = {item["paragraphs"]: item for item in json.load(file)["results"]}
+
+    regressions = []
+    print(f"\ncompared with {baseline_path}")
+    for result in results:
+        old = baseline.get(result["paragraphs"])
+        if old is None:
+            continue
+        checks = [("wall", old["wall_s"], result["wall_s"])]
+        checks += [(name, old["stages"].get(name), result["stages"].get(name))
+                   for name in dict.fromkeys(RENDER_STAGES + DATAFLOW_STAGES)]
+        for name, before, after in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            flag = "  REGRESSION" if change > tolerance else ""
+            print(f"  {result['paragraphs']:>4} paragraphs {name:<13} {before:8.2f}s -> {after:8.2f}s "
+                  f"({change:+.0%}){flag}")
+            if flag:
+                regressions.append((result["paragraphs"], name, before, after))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against local service stand-ins.")
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[6, 20, 100])
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per chat completion")
+    parser.add_argument("--dataflow", action="store_true", help="run each story as a per-paragraph dataflow")
+    parser.add_argument("--profile", default="final", help="render profile, e.g. preview")
+    parser.add_argument("--single-encode", action="store_true",
+                        help="render title and body as one encode (render_story single_encode=True)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="render the body with moviepy one paragraph at a time (still_frames=False)")
+    parser.add_argument("--no-stream", action="store_true", help="wait for complete LLM replies (LLM_STREAM=0)")
+    parser.add_argument("--image-latency", type=float, default=1.0, help="seconds per images.generate call")
+    parser.add_argument("--tts-latency", type=float, default=0.1, help="seconds to the first audio frame")
+    parser.add_argument("--tts-rtf", type=float, default=0.0, help="synthesis seconds per second of audio")
+    parser.add_argument("--tts-fail-rate", type=float, default=0.0, help="probability of an injected TaskFailed")
+    parser.add_argument("--tts-requests-per-connection", type=int, default=0,
+                        help="close each TTS connection after this many requests, 0 for never")
+    parser.add_argument("--tts-close-frame", action="store_true",
+                        help="close recycled TTS connections with a websocket close frame instead of dropping TCP")
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--tts-workers", type=int, default=4)
+    parser.add_argument("--image-workers", type=int, default=4)
+    parser.add_argument("--render-workers", type=int, default=None)
+    parser.add_argument("--cache-dir", default=None, help="cache directory, defaults to a fresh temporary one")
+    parser.add_argument("--output", default=os.path.join("output_video", "benchmark.json"))
+    parser.add_argument("--baseline", default=None, help="previous results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging, e.g. 0.2")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    openai_server = FakeOpenAIServer(llm_latency=args.llm_latency, image_latency=args.image_latency,
+                                     image_size=args.image_size).start()
+    nls_server = FakeNlsServer(first_byte_latency=args.tts_latency, realtime_factor=args.tts_rtf,
+                               fail_rate=args.tts_fail_rate,
+                               requests_per_connection=args.tts_requests_per_connection,
+                               close_frame=args.tts_close_frame).start()
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="video-bench-cache-")
+
+    # 环境变量必须在导入 create_video/utils 之前设置：服务地址和缓存目录在导入时读取
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_API_BASE": openai_server.base_url,
+        "ALI_AUDIO_URL": nls_server.url,
+        "ALI_AUDIO_TOKEN": "benchmark-token",
+        "ALI_AUDIO_APPKEY": "benchmark-appkey",
+        "VIDEO_CACHE_DIR": cache_dir,
+        "LLM_STREAM": "0" if args.no_stream else "1",
+    })
+    import create_video
+    from utils import TRACER
+
+    results = []
+    try:
+        for paragraphs in args.paragraphs:
+            print(f"\n=== {paragraphs} paragraphs ===")
+            results.append(run_one(create_video, TRACER, paragraphs, args))
+    finally:
+        openai_server.stop()
+        nls_server.stop()
+        if args.cache_dir is None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print_report(results)
+    print(f"service calls: openai {openai_server.requests}, "
+          f"nls {nls_server.requests} requests over {nls_server.connections} connections")
+
+    regressions = compare(results, args.baseline, args.tolerance) if args.baseline else []
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump({
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count()},
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "results": results,
+        }, file, ensure_ascii=False, indent=2)
+    print(f"results written to {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,39 @@
 import os
+import time
+import random
+import threading
 import autogen
+from dotenv import load_dotenv
+
+# utils 中的缓存目录和容量等设置在导入时读取，.env 需要在导入 utils 之前加载
+_ = load_dotenv('./.env')
+
 from utils import MyTTS
 from prompt import WRITER_PROMPT, MUSIC_PROMPT, SPLIT_PROMPT, PICTURE_PROMPT
 from utils import parse_json_from_response
+from utils import cached_generate_reply
+from utils import stream_generate_reply
 from utils import create_text_files
+from utils import clean_subtitle_text
+from utils import process_and_write_text
 from utils import create_picture_prompt_text_files
 from moviepy.editor import AudioFileClip, concatenate_audioclips
 from utils import generate_and_save_image, create_video_for_title, create_video_from_images_audio, merge_videos
-
-from dotenv import load_dotenv
-
-_ = load_dotenv('./.env')
+from utils import render_video
+from utils import IMAGE_CACHE
+from utils import RunManifest
+from utils import SegmentIndex
+from utils import title_audio_path
+from utils import probe_duration
+from utils import render_segment, concat_copy
+from utils import process_pool
+from utils import render_profile
+from utils import prepare_frames
+from utils import bgm_duck, subtitle_font
+from utils import DataflowStage, run_dataflow
+from utils import TRACER
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 获取阿里云语音合成服务所需的 URL、TOKEN 和 APPKEY
 URL = os.getenv("ALI_AUDIO_URL")
@@ -39,75 +62,131 @@ def concatenate_audio_files(data_folder, title_audio='title.mp3', bling_audio='b
 #     concatenate_audio_files(data_folder)
 
 
-def check_and_generate_missing_images(prompts_dir, generated_images):
-    while True:
-        missing_images = set()
-
-        for filename in os.listdir(prompts_dir):
-            if filename.endswith("_picture_prompt.txt"):
-                base_name = os.path.splitext(filename)[0]
-                expected_image = f"{base_name}.png"
-
-                if expected_image not in generated_images:
-                    missing_images.add(expected_image)
-
-        if not missing_images:
-            print("All images have been generated successfully.")
-            break
-
-        for missing_image in missing_images:
-            prompt_file = f"{os.path.splitext(missing_image)[0]}_picture_prompt.txt"
-            prompt_path = os.path.join(prompts_dir, prompt_file)
-
-            if os.path.exists(prompt_path):
-                # 读取文件中的prompt
-                with open(prompt_path, 'r', encoding='utf-8') as file:
-                    prompt = file.read().strip()
-
-                # 生成并保存图像
-                generate_and_save_image(prompt, missing_image, prompts_dir)
-                generated_images.add(missing_image)
-                print(f"Re-generated image for '{prompt}' and saved as '{missing_image}'.")
+def generate_image_with_retry(prompt, filename, save_folder, max_retries=3, backoff=2.0):
+    """
+    生成单张图片，失败时按指数退避重试。
 
+    参数:
+    max_retries : int
+        首次尝试之外的最大重试次数。
+    backoff : float
+        第一次重试前的等待秒数，之后每次翻倍，并附加少量随机抖动。
 
-def generate_images(prompts_dir):
-    # 指定读取文件的目录
-    generated_images = set()
+    返回:
+    str
+        成功时返回图片路径，重试耗尽后抛出最后一次的异常。
+    """
+    last_error = None
+    with TRACER.span("image.job", "image", file=filename, retries=0) as span:
+        for attempt in range(max_retries + 1):
+            span["retries"] = attempt
+            try:
+                file_path = generate_and_save_image(query=prompt, filename=filename, save_folder=save_folder)
+                if file_path and os.path.exists(file_path):
+                    return file_path
+                last_error = RuntimeError(f"no image returned for '{filename}'")
+            except Exception as e:
+                last_error = e
+
+            print(f"Image attempt {attempt + 1}/{max_retries + 1} failed for '{filename}': {last_error}")
+            if attempt < max_retries:
+                time.sleep(backoff * (2 ** attempt) + random.uniform(0, 1))
+
+        raise last_error
+
+
+def generate_images(prompts_dir, max_workers=4, max_retries=3, backoff=2.0, overwrite=False, exclude=()):
+    """
+    并发生成目录中所有 picture prompt 对应的图片，overwrite 为 False 时已存在的图片会被跳过，
+    exclude 中的图片文件名（已由其他任务生成）也会被跳过。
 
-    # 遍历目录中的所有文件生成图片
-    for filename in os.listdir(prompts_dir):
+    每个任务在生成完成后立即下载保存图片，单张图片的失败只会按退避策略重试自身，
+    不会阻塞其他图片。所有任务结束后打印失败报告，仍有缺失的图片时抛出 RuntimeError。
+    """
+    # 收集需要生成的图片及其 prompt
+    tasks = {}
+    for filename in sorted(os.listdir(prompts_dir)):
         if filename.endswith("_picture_prompt.txt"):
             # 去掉文件扩展名，添加新的扩展名
             base_name = os.path.splitext(filename)[0]
             new_filename = f"{base_name}.png"
-            new_filepath = os.path.join(prompts_dir, new_filename)
 
-            if os.path.exists(new_filepath):
-                generated_images.add(new_filename)
+            if new_filename in exclude:
+                continue
+            if not overwrite and os.path.exists(os.path.join(prompts_dir, new_filename)):
                 continue
 
             # 读取文件中的prompt
             with open(os.path.join(prompts_dir, filename), 'r', encoding='utf-8') as file:
-                prompt = file.read().strip()
+                tasks[new_filename] = file.read().strip()
 
-            # 生成并保存图像
-            generate_and_save_image(query=prompt, filename=new_filename, save_folder=prompts_dir)
-            generated_images.add(new_filename)
-            print(f"Generated image for '{prompt}' and saved as '{new_filename}'.")
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(generate_image_with_retry, prompt, new_filename, prompts_dir, max_retries, backoff): new_filename
+            for new_filename, prompt in tasks.items()
+        }
+        for future in as_completed(futures):
+            new_filename = futures[future]
+            try:
+                future.result()
+                print(f"Generated image for '{tasks[new_filename]}' and saved as '{new_filename}'.")
+            except Exception as e:
+                failures[new_filename] = e
 
-    # 检查目录中的图片文件是否都生成成功
-    check_and_generate_missing_images(prompts_dir, generated_images)
+    print(f"Image cache stats: {IMAGE_CACHE.stats()}")
 
+    # 输出失败报告
+    if failures:
+        print(f"Image generation failed for {len(failures)}/{len(tasks)} images:")
+        for new_filename, error in sorted(failures.items()):
+            print(f"  {new_filename}: prompt='{tasks[new_filename]}' error={error!r}")
+        raise RuntimeError(f"Image generation failed for: {sorted(failures)}")
 
-def main(title: str, content: str, save_folder: str) -> None:
+    print("All images have been generated successfully.")
 
-    if not os.path.exists(save_folder):
-        os.makedirs(save_folder)
 
+# 旁白的音色参数
+# 以 PCM 合成后保存为无损 WAV，有损编码只在最终成片时进行一次
+TTS_PARAMS = dict(voice="zhiyuan", speech_rate=-500, pitch_rate=0, volume=100, sample_rate=16000, aformat="wav")
+
+# 语音合成方式：paragraph 每段只请求一次，按字级时间戳切出每行字幕的配音；line 每行字幕单独请求
+TTS_MODE = os.getenv("TTS_MODE", "paragraph")
+# 单次合成请求的文本长度上限，超过的段落按行合成
+PARAGRAPH_MAX_CHARS = 300
+
+# 流式接收 LLM 回复，解析出一个段落就开始合成配音、解析出一条图片prompt就开始生成图片；LLM_STREAM=0 时等完整回复
+LLM_STREAM = os.getenv("LLM_STREAM", "1") != "0"
+
+
+def list_files(save_folder, predicate):
+    # 按文件名排序返回目录中满足条件的文件路径
+    return [os.path.join(save_folder, f) for f in sorted(os.listdir(save_folder)) if predicate(f)]
+
+
+def is_subtitle_text(filename):
+    return "_subtitle_" in filename and filename.endswith('.txt')
+
+
+def is_subtitle_audio(filename):
+    return "_subtitle_" in filename and filename.endswith(('.mp3', '.wav'))
+
+
+def is_picture_prompt(filename):
+    return filename.endswith("_picture_prompt.txt")
+
+
+def is_picture(filename):
+    return filename.endswith("_picture_prompt.png")
+
+
+def make_llm_config():
     llm_config = {
         'model': "gpt-4o-all",
         "api_key": os.getenv("OPENAI_API_KEY"),
         "base_url": os.getenv("OPENAI_API_BASE"),
+        # 回复由 cached_generate_reply 缓存，关闭 autogen 自带的 .cache，否则 refresh_llm 和 TTL 不起作用
+        "cache_seed": None,
     }
     # print(os.getenv("OPENAI_API_KEY"))
     # print(os.getenv("OPENAI_API_BASE"))
@@ -126,27 +205,72 @@ def main(title: str, content: str, save_folder: str) -> None:
     # print(llm_config['base_url'])
     # print(llm_config['model'])
 
-    llm_config_music = {
-        'model': "chirp-v2-xxl-alpha",
-        "api_key": os.getenv("OPENAI_API_KEY"),
-        "base_url": os.getenv("OPENAI_API_BASE"),
-    }
+    # llm_config_music = {
+    #     'model': "chirp-v2-xxl-alpha",
+    #     "api_key": os.getenv("OPENAI_API_KEY"),
+    #     "base_url": os.getenv("OPENAI_API_BASE"),
+    # }
+    return llm_config
+
 
+def split_stage(content, save_folder, llm_config, refresh_llm=False, prefetch=None):
+    """
+    对故事内容进行段落切分，并把每段切割成字幕行写入 txt，返回产出的文件。
+
+    传入 prefetch 时流式接收回复，每解析出一个完整段落就写出字幕并提交该段的配音任务。
+    """
     split_agent = autogen.ConversableAgent(
         name="split_agent",
         llm_config=llm_config,
         system_message=SPLIT_PROMPT,
     )
 
+    # 删除上一次运行留下的字幕和配音，避免段落数变化后残留旧文件
+    for path in list_files(save_folder, lambda f: is_subtitle_text(f) or is_subtitle_audio(f)):
+        os.remove(path)
+
     # 对故事内容进行段落切分，切分成6-20段。
-    reply_split_agent = split_agent.generate_reply(messages=[{"content": content, "role": "user"}])
+    messages = [{"content": content, "role": "user"}]
+    streamed = []
+    if prefetch is not None:
+        def on_sentence(paragraph, key, value):
+            streamed.append(value)
+            lines = process_and_write_text(None, value, f"0{paragraph:02d}_subtitle", save_folder)
+            prefetch.submit_paragraph(save_folder, paragraph, lines, clean_subtitle_text(value).strip())
+
+        reply_split_agent = stream_generate_reply(split_agent, messages, on_sentence, "sentence_",
+                                                  refresh=refresh_llm)
+    else:
+        reply_split_agent = cached_generate_reply(split_agent, messages, refresh=refresh_llm)
     print(reply_split_agent)
 
+    # 保存原始回复，供生成图片prompt的阶段使用
+    reply_path = os.path.join(save_folder, "split_reply.txt")
+    with open(reply_path, "w", encoding="utf-8") as file:
+        file.write(reply_split_agent)
+
     # 从生成的内容中提取处字典格式包裹的故事分段
     parse_result = parse_json_from_response(reply_split_agent)[0]
+    if prefetch is not None and streamed != list(parse_result.values()):
+        # 增量解析与完整回复不一致时放弃提前合成的配音，由 tts 阶段按最终结果重新合成
+        print("streamed sentences differ from the final reply, discarding prefetched speech")
+        prefetch.discard_tts()
+
+    # 将生成的sentence切割成字幕存入不同的txt中，并建立字幕行索引 segments.json，后续阶段直接使用
+    paragraphs = create_text_files(parse_result, save_folder)
+    texts = {i: clean_subtitle_text(value).strip() for i, value in enumerate(parse_result.values(), start=1)}
+    SegmentIndex.from_lines(save_folder, paragraphs, texts=texts).save()
+    return [reply_path] + list_files(save_folder, is_subtitle_text)
 
-    # 将生成的sentence切割成字幕存入不同的txt中
-    create_text_files(parse_result, save_folder)
+
+def picture_prompt_stage(save_folder, llm_config, refresh_llm=False, prefetch=None):
+    """
+    根据切分好的段落生成每段的图片prompt并写入 txt，返回产出的文件。
+
+    传入 prefetch 时流式接收回复，每解析出一条完整的图片prompt就写出 txt 并提交图片生成任务。
+    """
+    with open(os.path.join(save_folder, "split_reply.txt"), "r", encoding="utf-8") as file:
+        reply_split_agent = file.read()
 
     picture_prompt_agent = autogen.ConversableAgent(
 
@@ -155,84 +279,497 @@ def main(title: str, content: str, save_folder: str) -> None:
         system_message=PICTURE_PROMPT,
     )
 
+    for path in list_files(save_folder, is_picture_prompt):
+        os.remove(path)
+
     # 生成每个段落的图片prompt
-    reply_picture_prompt_agent = picture_prompt_agent.generate_reply(
-        messages=[{"content": reply_split_agent, "role": "user"}])
+    messages = [{"content": reply_split_agent, "role": "user"}]
+    streamed = []
+    if prefetch is not None:
+        def on_prompt(paragraph, key, value):
+            streamed.append(value)
+            name = f"0{paragraph:02d}_picture_prompt"
+            with open(os.path.join(save_folder, f"{name}.txt"), 'w', encoding='utf-8') as file:
+                file.write(value)
+            prefetch.submit_image(save_folder, f"{name}.png", value)
+
+        reply_picture_prompt_agent = stream_generate_reply(picture_prompt_agent, messages, on_prompt,
+                                                           "picture_prompt_", refresh=refresh_llm)
+    else:
+        reply_picture_prompt_agent = cached_generate_reply(picture_prompt_agent, messages, refresh=refresh_llm)
     print(reply_picture_prompt_agent)
 
     # 从生成的内容中提取处字典格式包裹的图片prompt
     parse_result = parse_json_from_response(reply_picture_prompt_agent)[0]
+    if prefetch is not None and streamed != list(parse_result.values()):
+        print("streamed picture prompts differ from the final reply, discarding prefetched images")
+        prefetch.discard_images()
     # 将生成的图片prompt存入不同的txt中
     create_picture_prompt_text_files(parse_result, save_folder)
+    return list_files(save_folder, is_picture_prompt)
+
 
-    # 遍历目录中的所有文件生成图片
-    generate_images(save_folder)
-
-    # 创建 MyTTS 类的实例
-    synthesizer = MyTTS(url=URL, token=TOKEN, appkey=APPKEY)
-
-    # 遍历目录中的所有文件
-    for filename in os.listdir(save_folder):
-        # 检查文件名是否符合要求：以数字开头并包含"subtitle"
-        if "_subtitle_" in filename and filename.endswith('.txt'):
-            # 构建完整的文件路径
-            filepath = os.path.join(save_folder, filename)
-
-            # 读取文本文件
-            with open(filepath, 'r', encoding='utf-8') as file:
-                lines = file.readlines()
-
-            # 针对每行文本生成语音文件
-            for i, line in enumerate(lines):
-                # 跳过空行
-                if not line.strip():
-                    continue
-
-                # 构建输出文件名
-                mp3_filename = f"{filename[:-4]}.mp3"
-                output_path = os.path.join(save_folder, mp3_filename)
-
-                # 使用指定参数进行语音合成
-                synthesizer.run(
-                    text=line.strip(),
-                    file=output_path,
-                    voice="zhiyuan",
-                    speech_rate=-500,
-                    pitch_rate=0,
-                    volume=100,
-                    sample_rate=16000
-                )
+def images_stage(save_folder, image_workers=4, image_retries=3, prefetched=None):
+    """
+    为每个图片prompt生成图片。prompt 有变化时该阶段会整体重跑，未变化的图片由图片缓存直接提供。
+    prefetched 为图片prompt阶段已经提交的任务 {图片文件名: Future}，成功的不再重复生成，失败的在这里重试。
+    """
+    # 删除已经没有对应 prompt 的旧图片
+    prompts = {os.path.splitext(p)[0] for p in list_files(save_folder, is_picture_prompt)}
+    for path in list_files(save_folder, is_picture):
+        if os.path.splitext(path)[0] not in prompts:
+            os.remove(path)
+
+    done = set()
+    for filename, future in (prefetched or {}).items():
+        if future.exception() is None:
+            done.add(filename)
+        else:
+            print(f"prefetched image {filename} failed: {future.exception()!r}")
+    generate_images(save_folder, max_workers=image_workers, max_retries=image_retries, overwrite=True, exclude=done)
+    return list_files(save_folder, is_picture)
+
+
+def plan_tts_jobs(index, mode=TTS_MODE, skip=()):
+    """
+    把索引中的字幕行分成按行合成的 (text, file) 任务和按段落合成的 (段落文本, [(text, file), ...]) 任务，
+    跳过 skip 中的段落。mode 为 "paragraph" 时不超过 PARAGRAPH_MAX_CHARS 的段落按段落合成。
+    """
+    line_jobs = []
+    paragraph_jobs = []
+    for paragraph, segments in index.paragraphs().items():
+        if paragraph in skip:
+            continue
+        text = index.paragraph_text(paragraph)
+        if mode == "paragraph" and len(text) <= PARAGRAPH_MAX_CHARS:
+            paragraph_jobs.append((text, [(seg.text, seg.audio_path) for seg in segments]))
+        else:
+            line_jobs += [(seg.text, seg.audio_path) for seg in segments]
+    return line_jobs, paragraph_jobs
+
+
+def synthesize_jobs(synthesizer, line_jobs, paragraph_jobs, tts_workers=4, tts_retries=2):
+    """
+    执行 plan_tts_jobs 规划的任务，返回失败的任务（输出文件或段落开头的文字）列表。
+    """
+    results = synthesizer.run_batch(line_jobs, max_workers=tts_workers, retries=tts_retries,
+                                    **TTS_PARAMS) if line_jobs else []
+    paragraph_results = synthesizer.run_paragraphs(paragraph_jobs, max_workers=tts_workers, retries=tts_retries,
+                                                   **TTS_PARAMS) if paragraph_jobs else []
+    failed = [output for (_, output), result in zip(line_jobs, results) if result is None]
+    failed += [text[:20] for (text, _), result in zip(paragraph_jobs, paragraph_results) if result is None]
+    return failed
+
+
+def tts_stage(title, save_folder, index, tts_workers=4, tts_retries=2, mode=TTS_MODE, prefetched=None):
+    """
+    为索引中的每行字幕和标题合成配音，记录每行配音的时长，并把标题写入 title.txt，返回产出的文件。
+
+    mode 为 "paragraph" 时每段只合成一次，再按时间戳切成每行的配音；过长的段落和标题仍按行合成。
+    prefetched 为切分阶段已经提交的段落配音任务 {段落编号: Future}，这里只等待其完成。
+    """
+    prefetched = prefetched or {}
+    # 创建 MyTTS 类的实例，每个并发任务复用一条 websocket 连接
+    synthesizer = MyTTS(url=URL, token=TOKEN, appkey=APPKEY, pool_size=tts_workers)
+
+    index.set_audio_format(TTS_PARAMS["aformat"])
+    line_jobs, paragraph_jobs = plan_tts_jobs(index, mode, skip=prefetched)
 
     # 根据传入的title进行语音合成
-    synthesizer.run(
-        text=title,
-        file=f"./{save_folder}/title.mp3",
-        voice="zhiyuan",
-        speech_rate=-500,
-        pitch_rate=0,
-        volume=100,
-        sample_rate=16000
-    )
+    title_path = os.path.join(save_folder, f"title.{TTS_PARAMS['aformat']}")
+    line_jobs.append((title, title_path))
+
+    # 使用指定参数并发进行语音合成
+    try:
+        failed = synthesize_jobs(synthesizer, line_jobs, paragraph_jobs, tts_workers, tts_retries)
+    finally:
+        synthesizer.close()
+    for future in prefetched.values():
+        failed += future.result()
+    if failed:
+        raise RuntimeError(f"Speech synthesis failed for: {failed}")
+
+    # 配音可能来自缓存或重新合成，重新读取时长（WAV 直接读文件头）并保存索引，渲染阶段不再逐个读取
+    index.ensure_durations()
 
     # 把title写入title.txt中
     # 指定文件路径
-    file_path = os.path.join(f"./{save_folder}", "title.txt")
+    file_path = os.path.join(save_folder, "title.txt")
     # 使用 'w' 模式打开文件，这将创建新文件或覆盖现有文件
     with open(file_path, "w", encoding="utf-8") as file:
         # 写入标题
         file.write(title)
 
+    return [seg.audio_path for seg in index] + [title_path, file_path]
+
+
+class Prefetch:
+    """
+    流式解析 LLM 回复时提前提交的配音和图片任务。
+
+    切分阶段每解析出一个完整段落就提交该段的配音，图片prompt阶段每解析出一条 prompt 就提交图片生成，
+    与模型继续生成回复的时间重叠；之后的 images 和 tts 阶段只等待这些任务，并补做没有提前提交的部分。
+    """
+
+    def __init__(self, tts_workers=4, tts_retries=2, image_workers=4, image_retries=3):
+        self.tts_workers = tts_workers
+        self.tts_retries = tts_retries
+        self.image_retries = image_retries
+        self.synthesizer = MyTTS(url=URL, token=TOKEN, appkey=APPKEY, pool_size=tts_workers)
+        self._tts_executor = ThreadPoolExecutor(max_workers=max(1, tts_workers))
+        self._image_executor = ThreadPoolExecutor(max_workers=max(1, image_workers))
+        # 段落编号 -> Future（结果为失败任务列表），图片文件名 -> Future
+        self.tts = {}
+        self.images = {}
+
+    def submit_paragraph(self, save_folder, paragraph, lines, text):
+        index = SegmentIndex.from_lines(save_folder, {paragraph: lines}, TTS_PARAMS["aformat"], {paragraph: text})
+        line_jobs, paragraph_jobs = plan_tts_jobs(index)
+        self.tts[paragraph] = self._tts_executor.submit(
+            synthesize_jobs, self.synthesizer, line_jobs, paragraph_jobs, 1, self.tts_retries)
+
+    def submit_image(self, save_folder, filename, prompt):
+        self.images[filename] = self._image_executor.submit(
+            generate_image_with_retry, prompt, filename, save_folder, self.image_retries)
+
+    @staticmethod
+    def _discard(futures):
+        # 等待已提交的任务结束再丢弃，避免与重新执行的任务同时写同一个文件
+        for future in futures.values():
+            future.exception()
+        futures.clear()
+
+    def discard_tts(self):
+        self._discard(self.tts)
+
+    def discard_images(self):
+        self._discard(self.images)
+
+    def close(self):
+        self._tts_executor.shutdown(wait=True)
+        self._image_executor.shutdown(wait=True)
+        self.synthesizer.close()
+
+
+def prepare_story(title, content, save_folder, manifest=None, tts_workers=4, tts_retries=2, image_workers=4,
+                  image_retries=3, refresh_llm=False, stream=LLM_STREAM):
+    """
+    运行依赖网络服务的阶段：段落切分、图片prompt、图片生成和语音合成。
+
+    stream 为 True 时流式接收 LLM 回复，配音和图片在解析出对应条目后立即开始（见 Prefetch）。
+    """
+    if not os.path.exists(save_folder):
+        os.makedirs(save_folder)
+    manifest = manifest or RunManifest(save_folder)
+    llm_config = make_llm_config()
+    model = llm_config["model"]
+
+    prefetch = Prefetch(tts_workers, tts_retries, image_workers, image_retries) if stream else None
+    try:
+        manifest.run_stage(
+            "split", lambda: split_stage(content, save_folder, llm_config, refresh_llm, prefetch),
+            values={"content": content, "prompt": SPLIT_PROMPT, "model": model}, force=refresh_llm)
+        manifest.run_stage(
+            "picture_prompts", lambda: picture_prompt_stage(save_folder, llm_config, refresh_llm, prefetch),
+            values={"prompt": PICTURE_PROMPT, "model": model},
+            files=[os.path.join(save_folder, "split_reply.txt")], force=refresh_llm)
+        index = SegmentIndex.load(save_folder)
+        manifest.run_stage(
+            "images", lambda: images_stage(save_folder, image_workers, image_retries,
+                                           prefetch.images if prefetch else None),
+            values={"model": "dall-e-3", "size": "1024x1024"},
+            files=list_files(save_folder, is_picture_prompt))
+        manifest.run_stage(
+            "tts", lambda: tts_stage(title, save_folder, index, tts_workers, tts_retries,
+                                     prefetched=prefetch.tts if prefetch else None),
+            values={"title": title, "lines": [seg.text for seg in index], "mode": TTS_MODE, **TTS_PARAMS})
+    finally:
+        # 等待所有提前提交的任务结束，阶段被跳过或失败时也不留下仍在写文件的线程
+        if prefetch is not None:
+            prefetch.close()
+    return manifest
+
+
+def render_story(save_folder, manifest=None, still_frames=True, render_workers=None, profile=None, streaming=False,
+                 single_encode=False):
+    """
+    运行本地渲染阶段：片头、正文，以及流复制合并为 merged_video.mp4。
+
+    profile 为 preview 时以预览配置渲染 merged_video_preview.mp4，阶段名带 _preview 后缀，
+    与正式成片分别记录在 manifest 中，互不覆盖（见 render_profile）。
+    still_frames 为 False 时用 moviepy 渲染正文，streaming 为 True 则逐段落写出并释放 clips，内存不随段落数增长。
+    single_encode 为 True 时片头和正文在同一条时间线上一次渲染出 merged_video.mp4（见 render_video），
+    作为一个 render 阶段记录在 manifest 中，不再生成 title_video.mp4 和 main_video.mp4。
+    """
+    manifest = manifest or RunManifest(save_folder)
+    profile = render_profile(profile)
+    index = SegmentIndex.load(save_folder)
+    # render_workers 默认为 CPU 核数，按段落并行编码
+    workers = render_workers or os.cpu_count() or 1
+    music_folder = os.path.join(save_folder, "../../music")
+    title_video = os.path.join(save_folder, profile.output_name("title_video.mp4"))
+    main_video = os.path.join(save_folder, profile.output_name("main_video.mp4"))
+    output_path = os.path.join(save_folder, profile.output_name("merged_video.mp4"))
+
+    # 每张配图按各渲染配置的分辨率解码、缩放一次，之后的渲染直接读取内存映射的原始帧
+    manifest.run_stage("frames", lambda: prepare_frames(save_folder), files=index.images())
+
+    title_values = {"still_frames": still_frames, "subtitle_font": subtitle_font()}
+    title_files = ([os.path.join(save_folder, name) for name in ("001_picture_prompt.png", "title.txt")]
+                   + [title_audio_path(save_folder), os.path.join(music_folder, "bling.mp3")])
+    body_values = {"still_frames": still_frames, "streaming": streaming, "lines": [seg.text for seg in index],
+                   "subtitle_font": subtitle_font(), "bgm_duck": bgm_duck()}
+    body_files = index.images() + index.audio_files() + [os.path.join(music_folder, "background_music.mp3")]
+
+    if single_encode:
+        # 片头和正文一次渲染，输入为两者之和
+        manifest.run_stage(
+            f"render{profile.suffix}",
+            lambda: [render_video(save_folder, single_encode=True, still_frames=still_frames, workers=workers,
+                                  profile=profile, streaming=streaming)],
+            values={"title": title_values, "body": body_values}, files=title_files + body_files)
+        return output_path
+
     # 利用图片，配音，title以及bling.mp3生成开头的视频
-    create_video_for_title(save_folder)
+    manifest.run_stage(
+        f"title_render{profile.suffix}",
+        lambda: [create_video_for_title(save_folder, still_frames=still_frames, profile=profile)],
+        values=title_values, files=title_files)
 
     # 生成main_video.mp4
-    create_video_from_images_audio(save_folder)
+    manifest.run_stage(
+        f"body_render{profile.suffix}",
+        lambda: [create_video_from_images_audio(save_folder, still_frames=still_frames, workers=workers,
+                                                profile=profile, streaming=streaming)],
+        values=body_values, files=body_files)
 
-    # 合并视频
-    video1_path = f"./{save_folder}/title_video.mp4"
-    video2_path = f"./{save_folder}/main_video.mp4"
-    output_path = f"./{save_folder}/merged_video.mp4"
-    merge_videos(video1_path, video2_path, output_path)
+    # 合并视频，流复制拼接，不重新编码
+    manifest.run_stage(
+        f"merge{profile.suffix}", lambda: [merge_videos(title_video, main_video, output_path)],
+        files=[title_video, main_video])
+    return output_path
+
+
+class _Timeline:
+    """
+    数据流中各段落配音时长的登记表。段落渲染时需要知道它在正文中的起始时间来截取背景音乐，
+    因此要等排在它前面的所有段落都完成配音；前面的段落失败时等待方抛出异常，不会一直阻塞。
+    """
+
+    def __init__(self, paragraphs):
+        self.order = list(paragraphs)
+        self.durations = {}
+        self._failed = {}
+        self._cond = threading.Condition()
+
+    def set(self, paragraph, duration):
+        with self._cond:
+            self.durations[paragraph] = duration
+            self._failed.pop(paragraph, None)
+            self._cond.notify_all()
+
+    def fail(self, paragraph, error):
+        with self._cond:
+            self._failed[paragraph] = error
+            self._cond.notify_all()
+
+    def offset(self, paragraph) -> float:
+        earlier = self.order[:self.order.index(paragraph)]
+        with self._cond:
+            self._cond.wait_for(lambda: all(p in self.durations or p in self._failed for p in earlier))
+            failed = [p for p in earlier if p not in self.durations]
+            if failed:
+                raise RuntimeError(f"paragraphs {failed} before {paragraph} have no narration")
+            return sum(self.durations[p] for p in earlier)
+
+
+def dataflow_story(title, content, save_folder, manifest=None, tts_workers=4, tts_retries=2, image_workers=4,
+                   image_retries=3, render_workers=None, refresh_llm=False, queue_size=2, profile=None):
+    """
+    按段落的数据流生成视频：每个段落独立地经过 配音 -> 图片 -> 片段渲染，最后按段落顺序流复制拼接。
+
+    与 prepare_story + render_story 逐阶段整批执行不同，一张图片慢只会推迟它所在的段落，其他段落的配音和渲染照常进行，
+    端到端耗时接近最慢的单个段落。切分和图片prompt两个 LLM 阶段仍记录在 manifest 中，图片prompt流式解析出一条
+    就进入数据流；切分阶段提前提交的配音（见 Prefetch）在数据流的配音阶段直接等待。
+    配音放在图片之前：段落渲染需要前面所有段落的配音时长来确定背景音乐的位置。
+
+    参数:
+    queue_size : int
+        各阶段输入队列的容量，下游处理不过来时上游等待。
+    profile : RenderProfile
+        片段的渲染配置，见 render_profile。
+    """
+    if not os.path.exists(save_folder):
+        os.makedirs(save_folder)
+    manifest = manifest or RunManifest(save_folder)
+    llm_config = make_llm_config()
+    model = llm_config["model"]
+    workers = render_workers or os.cpu_count() or 1
+    profile = render_profile(profile)
+    segments_dir = os.path.join(save_folder, f"segments{profile.suffix}")
+    os.makedirs(segments_dir, exist_ok=True)
+
+    prefetch = Prefetch(tts_workers, tts_retries, image_workers, image_retries)
+    render_pool = process_pool(workers)
+    side_tasks = ThreadPoolExecutor(max_workers=2)
+    try:
+        manifest.run_stage(
+            "split", lambda: split_stage(content, save_folder, llm_config, refresh_llm, prefetch),
+            values={"content": content, "prompt": SPLIT_PROMPT, "model": model}, force=refresh_llm)
+        index = SegmentIndex.load(save_folder)
+        index.set_audio_format(TTS_PARAMS["aformat"])
+        groups = index.paragraphs()
+        timeline = _Timeline(groups)
+
+        # 标题配音与数据流并行，片头在第一张图片生成后渲染
+        title_path = os.path.join(save_folder, f"title.{TTS_PARAMS['aformat']}")
+        with open(os.path.join(save_folder, "title.txt"), "w", encoding="utf-8") as file:
+            file.write(title)
+        title_tts = side_tasks.submit(prefetch.synthesizer.run_batch, [(title, title_path)], 1, tts_retries,
+                                      **TTS_PARAMS)
+        title_segment = os.path.join(segments_dir, "000_title.mp4")
+        title_render = []
+
+        def render_title():
+            if title_tts.result()[0] is None:
+                raise RuntimeError(f"Speech synthesis failed for: {title_path}")
+            return render_segment(render_pool, save_folder, title_segment, profile=profile)
+
+        def tts(paragraph, item):
+            segments = groups[paragraph]
+            try:
+                future = prefetch.tts.get(paragraph)
+                if future is not None:
+                    failed = future.result()
+                else:
+                    sub_index = SegmentIndex(save_folder, segments, {paragraph: index.paragraph_text(paragraph)})
+                    failed = synthesize_jobs(prefetch.synthesizer, *plan_tts_jobs(sub_index), 1, tts_retries)
+                if failed:
+                    raise RuntimeError(f"Speech synthesis failed for: {failed}")
+                for seg in segments:
+                    seg.duration = probe_duration(seg.audio_path)
+            except Exception as e:
+                timeline.fail(paragraph, e)
+                raise
+            timeline.set(paragraph, sum(seg.duration for seg in segments))
+            return item
+
+        def image(paragraph, item):
+            item["image"] = generate_image_with_retry(item["prompt"], f"0{paragraph:02d}_picture_prompt.png",
+                                                      save_folder, image_retries)
+            if paragraph == timeline.order[0] and not title_render:
+                title_render.append(side_tasks.submit(render_title))
+            return item
+
+        def render(paragraph, item):
+            lines = [(seg.text, seg.audio_path) for seg in groups[paragraph]]
+            item["segment"] = os.path.join(segments_dir, f"{paragraph:03d}.mp4")
+            render_segment(render_pool, save_folder, item["segment"], item["image"], lines,
+                           timeline.offset(paragraph), profile)
+            return item
+
+        class _Feed:
+            # 代替 Prefetch 传给 picture_prompt_stage：解析出的每条图片prompt直接进入数据流
+            def __init__(self, emit):
+                self.emit = emit
+                self.emitted = set()
+
+            def submit_image(self, save_folder, filename, prompt):
+                paragraph = int(filename.split("_")[0])
+                if paragraph in groups and paragraph not in self.emitted:
+                    self.emitted.add(paragraph)
+                    self.emit(paragraph, {"prompt": prompt})
+
+            def discard_images(self):
+                # 与完整回复不一致的条目在数据流结束后按最终的 prompt 重新处理
+                pass
+
+        def produce(emit):
+            feed = _Feed(emit)
+            manifest.run_stage(
+                "picture_prompts", lambda: picture_prompt_stage(save_folder, llm_config, refresh_llm, feed),
+                values={"prompt": PICTURE_PROMPT, "model": model},
+                files=[os.path.join(save_folder, "split_reply.txt")], force=refresh_llm)
+            # 阶段被跳过，或流式解析漏掉的段落，从 prompt 文件补上
+            for paragraph in timeline.order:
+                if paragraph not in feed.emitted:
+                    feed.submit_image(save_folder, f"0{paragraph:02d}_picture_prompt.png", read_prompt(paragraph))
+
+        def read_prompt(paragraph):
+            path = os.path.join(save_folder, f"0{paragraph:02d}_picture_prompt.txt")
+            if not os.path.exists(path):
+                raise RuntimeError(f"missing picture prompt {path}")
+            with open(path, "r", encoding="utf-8") as file:
+                return file.read().strip()
+
+        stages = [DataflowStage("tts", tts, tts_workers), DataflowStage("image", image, image_workers),
+                  DataflowStage("render", render, workers)]
+        with TRACER.span("stage.dataflow", "stage", story=save_folder, paragraphs=len(groups)) as span:
+            results, errors = run_dataflow(produce, stages, queue_size)
+
+            # 失败的段落，以及图片prompt与最终回复不一致的段落，按顺序重新处理一次
+            redo = [p for p in timeline.order if p not in results or results[p]["prompt"] != read_prompt(p)]
+            span["redo"] = len(redo)
+            for paragraph in redo:
+                print(f"dataflow: reprocessing paragraph {paragraph} ({errors.get(paragraph, 'prompt changed')})")
+                prefetch.tts.pop(paragraph, None)
+                item = tts(paragraph, {"prompt": read_prompt(paragraph)})
+                results[paragraph] = render(paragraph, image(paragraph, item))
+
+        index.save()
+        if not title_render:
+            title_render.append(side_tasks.submit(render_title))
+        title_render[0].result()
+
+        # 按段落顺序组装，流复制拼接，不重新编码
+        output_path = os.path.join(save_folder, profile.output_name("merged_video.mp4"))
+        with TRACER.span("stage.assemble", "stage", story=save_folder):
+            concat_copy([title_segment] + [results[p]["segment"] for p in timeline.order], output_path)
+        print(f"{output_path} has been generated!")
+        return output_path
+    finally:
+        side_tasks.shutdown(wait=True)
+        render_pool.shutdown(wait=True)
+        prefetch.close()
+
+
+def main(title: str, content: str, save_folder: str, tts_workers: int = 4, tts_retries: int = 2,
+         image_workers: int = 4, image_retries: int = 3, refresh_llm: bool = False,
+         still_frames: bool = True, render_workers: int = None, dataflow: bool = False, profile: str = None,
+         streaming: bool = False, single_encode: bool = False) -> None:
+    """
+    生成完整视频。各阶段的输入输出哈希记录在 save_folder/manifest.json 中，
+    重新运行时跳过输入未变化的阶段，从第一个过期或失败的阶段继续。
+    各阶段和外部调用的计时写入 save_folder/trace.json 和 trace.chrome.json。
+
+    dataflow 为 True 时按段落的数据流生成（见 dataflow_story），图片和配音阶段依靠缓存避免重复请求。
+    数据流总是以静态画面逐段落渲染，不能与 still_frames=False、streaming 或 single_encode 同时使用，否则抛出 ValueError。
+    profile 选择渲染配置："preview" 以低分辨率快速渲染 merged_video_preview.mp4，
+    确认后以默认的 "final" 重新运行，只会重新执行渲染阶段；为 None 时读取环境变量 RENDER_PROFILE。
+    streaming 为 True 且 still_frames 为 False 时，正文用 moviepy 逐段落渲染，见 render_video_streaming。
+    single_encode 为 True 时片头和正文一次渲染，不生成单独的 title_video.mp4 和 main_video.mp4，见 render_story。
+    """
+    if dataflow and (not still_frames or streaming or single_encode):
+        raise ValueError("dataflow renders still-frame segments per paragraph and cannot be combined with "
+                         "still_frames=False, streaming or single_encode")
+    TRACER.reset()
+    try:
+        with TRACER.span("main", "run", story=save_folder):
+            if dataflow:
+                dataflow_story(title, content, save_folder, tts_workers=tts_workers, tts_retries=tts_retries,
+                               image_workers=image_workers, image_retries=image_retries,
+                               render_workers=render_workers, refresh_llm=refresh_llm, profile=profile)
+                return
+            manifest = prepare_story(title, content, save_folder, tts_workers=tts_workers, tts_retries=tts_retries,
+                                     image_workers=image_workers, image_retries=image_retries,
+                                     refresh_llm=refresh_llm)
+            render_story(save_folder, manifest, still_frames=still_frames, render_workers=render_workers,
+                         profile=profile, streaming=streaming, single_encode=single_encode)
+    finally:
+        # 无论成功与否都导出本次运行的计时数据
+        if os.path.isdir(save_folder):
+            json_path, chrome_path = TRACER.export(save_folder)
+            print(f"trace written to {json_path} and {chrome_path}")
 
 
 if __name__ == '__main__':
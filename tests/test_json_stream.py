@@ -0,0 +1,65 @@
+import json
+
+from utils.json_stream import JsonEntryStream
+
+REPLY = """```json
+[
+    {
+        "sentence_1": "很久以前，森林里住着一只老虎。",
+        "sentence_2": "狐狸说：\\"我是百兽之王！\\"",
+        "sentence_3": "路径 C:\\\\music\\\\ 和\\n换行，\\u4f60\\u597d"
+    }
+]
+```"""
+
+EXPECTED = [
+    ("sentence_1", "很久以前，森林里住着一只老虎。"),
+    ("sentence_2", "狐狸说：\"我是百兽之王！\""),
+    ("sentence_3", "路径 C:\\music\\ 和\n换行，你好"),
+]
+
+
+def test_whole_reply():
+    assert JsonEntryStream("sentence_").feed(REPLY) == EXPECTED
+
+
+def test_reply_fed_one_character_at_a_time():
+    stream = JsonEntryStream("sentence_")
+    found = []
+    for char in REPLY:
+        found += stream.feed(char)
+    # 转义的引号和反斜杠可能被切在两段之间，条目只在结束引号到达后出现一次
+    assert found == EXPECTED
+    assert stream.entries == dict(EXPECTED)
+
+
+def test_entry_waits_for_closing_quote():
+    stream = JsonEntryStream("sentence_")
+    assert stream.feed('{"sentence_1": "第一句') == []
+    assert stream.feed('还没完\\"') == []
+    assert stream.feed('"') == [("sentence_1", "第一句还没完\"")]
+    assert stream.feed(', "sentence_2": "第二句"') == [("sentence_2", "第二句")]
+
+
+def test_split_inside_escaped_backslash():
+    stream = JsonEntryStream("sentence_")
+    # 值以反斜杠结尾：\\ 之后的引号才是结束引号
+    assert stream.feed('"sentence_1": "a\\') == []
+    assert stream.feed('\\"') == [("sentence_1", "a\\")]
+
+
+def test_other_keys_are_ignored():
+    stream = JsonEntryStream("picture_prompt_")
+    reply = '{"sentence_1": "不要", "picture_prompt_1": "森林", "picture_prompt_x": "不是编号"}'
+    assert stream.feed(reply) == [("picture_prompt_1", "森林")]
+
+
+def test_invalid_escape_keeps_raw_text():
+    stream = JsonEntryStream("sentence_")
+    # 模型偶尔输出非法的转义，保留原文而不是丢掉条目
+    assert stream.feed('"sentence_1": "a\\qb"') == [("sentence_1", "a\\qb")]
+
+
+def test_matches_json_parse():
+    body = REPLY.split("```json")[1].split("```")[0]
+    assert dict(EXPECTED) == json.loads(body)[0]
@@ -0,0 +1,83 @@
+import os
+import struct
+import subprocess
+
+import pytest
+
+from utils.probe import mp3_duration, probe_duration, wav_duration
+
+imageio_ffmpeg = pytest.importorskip("imageio_ffmpeg")
+
+
+def encode(path, seconds, *args):
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error", "-f", "lavfi",
+                    "-i", f"sine=frequency=440:duration={seconds}", *args, path], check=True)
+    return path
+
+
+def decoded_duration(path):
+    from utils.audio import decode, MIX_RATE
+    return len(decode(path)) / MIX_RATE
+
+
+@pytest.mark.parametrize("args", [
+    ("-ar", "44100", "-b:a", "128k"),
+    ("-ar", "22050", "-q:a", "4"),
+    ("-ar", "16000", "-ac", "1", "-b:a", "32k"),
+    ("-ar", "48000", "-write_xing", "0"),
+])
+def test_mp3_matches_decoded_duration(tmp_path, args):
+    # Xing 帧数包含编码器延迟和尾部填充，ffmpeg 解码时会去掉，探测结果必须与解码结果一致
+    path = encode(str(tmp_path / "line.mp3"), 1.37, *args)
+    assert probe_duration(path) == pytest.approx(decoded_duration(path), abs=0.002)
+
+
+def test_mp3_skips_large_id3_tag(tmp_path):
+    path = encode(str(tmp_path / "plain.mp3"), 2.0, "-ar", "22050")
+    frame = b"PRIV" + struct.pack(">I", 100000) + b"\x00\x00" + os.urandom(100000)
+    size = len(frame)
+    tag = b"ID3\x03\x00\x00" + bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    tagged = tmp_path / "tagged.mp3"
+    tagged.write_bytes(tag + frame + open(path, 'rb').read())
+    assert probe_duration(str(tagged)) == pytest.approx(probe_duration(path))
+
+
+def test_mp3_partial_data_without_xing_header(tmp_path):
+    path = encode(str(tmp_path / "cbr.mp3"), 3.0, "-ar", "44100", "-write_xing", "0")
+    data = open(path, 'rb').read()
+    # 只有文件开头且没有 Xing/VBRI 头时无法得出时长，整个文件则逐帧累加
+    assert mp3_duration(data[:4096], complete=False) is None
+    assert mp3_duration(data) == pytest.approx(decoded_duration(path), abs=0.002)
+
+
+def test_mp3_rejects_garbage():
+    assert mp3_duration(b"\x00" * 1024) is None
+
+
+def wav_header(data_size, byte_rate=32000, extra=b""):
+    fmt = struct.pack("<HHIIHH", 1, 1, byte_rate // 2, byte_rate, 2, 16)
+    riff_size = min(36 + len(extra) + data_size, 0xFFFFFFFF)
+    return (b"RIFF" + struct.pack("<I", riff_size) + b"WAVE" + b"fmt " + struct.pack("<I", 16) + fmt + extra
+            + b"data" + struct.pack("<I", data_size))
+
+
+def test_wav_duration_from_header_and_file_size():
+    header = wav_header(64000, extra=b"LIST" + struct.pack("<I", 5) + b"hello\x00")
+    # 只给文件头时以 file_size 计算 data 块实际可用的长度
+    assert wav_duration(header, file_size=len(header) + 64000) == pytest.approx(2.0)
+    assert wav_duration(header + b"\x00" * 64000) == pytest.approx(2.0)
+
+
+def test_wav_duration_with_unfinished_data_size():
+    # 流式写出时 data 块长度未回填，以文件实际长度为准
+    header = wav_header(0xFFFFFFFF)
+    assert wav_duration(header, file_size=len(header) + 16000) == pytest.approx(0.5)
+
+
+def test_wav_matches_decoded_duration(tmp_path):
+    path = encode(str(tmp_path / "line.wav"), 2.5, "-ar", "16000", "-c:a", "pcm_s24le", "-metadata", "title=x")
+    assert probe_duration(path) == pytest.approx(decoded_duration(path), abs=0.001)
+
+
+def test_wav_rejects_other_formats():
+    assert wav_duration(b"OggS" + b"\x00" * 100) is None
@@ -0,0 +1,55 @@
+import pytest
+
+from utils.segments import line_intervals
+
+
+def words(text, timings):
+    # timings: {字符位置: (开始毫秒, 结束毫秒)}，生成 MetaInfo 中的字级时间戳
+    return [{"text": text[i], "begin_index": i, "end_index": i + 1, "begin_time": begin, "end_time": end}
+            for i, (begin, end) in sorted(timings.items())]
+
+
+def test_splits_at_pause_midpoint():
+    text = "春风吹，花开了。"
+    subtitles = words(text, {0: (0, 100), 1: (100, 200), 2: (200, 300), 4: (700, 800), 5: (800, 900), 6: (900, 1000)})
+    intervals = line_intervals(text, ["春风吹", "花开了"], subtitles, 1.2)
+    # 第一行在 0.3 秒结束，第二行在 0.7 秒开始，从停顿中点 0.5 秒切开；首尾覆盖整段配音
+    assert intervals == [(0.0, pytest.approx(0.5)), (pytest.approx(0.5), 1.2)]
+
+
+def test_sentence_entries_are_ignored():
+    text = "春风吹，花开了。"
+    subtitles = words(text, {0: (0, 300), 4: (700, 1000)})
+    subtitles.append({"text": text, "sentence": True, "begin_index": 0, "end_index": 8, "begin_time": 0,
+                      "end_time": 1000})
+    assert line_intervals(text, ["春风吹", "花开了"], subtitles, 1.0)[0][1] == pytest.approx(0.5)
+
+
+def test_proportional_fallback_without_timestamps():
+    intervals = line_intervals("一二三，四。", ["一二三", "四"], [], 2.0)
+    assert intervals == [(0.0, pytest.approx(1.5)), (pytest.approx(1.5), 2.0)]
+
+
+def test_proportional_fallback_when_line_not_in_text():
+    text = "春风吹，花开了。"
+    subtitles = words(text, {0: (0, 300), 4: (700, 1000)})
+    # 清洗后的字幕行与提交的文本对不上时，不使用时间戳
+    intervals = line_intervals(text, ["春风吹", "花儿开"], subtitles, 1.2)
+    assert intervals == [(0.0, pytest.approx(0.6)), (pytest.approx(0.6), 1.2)]
+
+
+def test_proportional_fallback_when_a_line_has_no_words():
+    text = "春风吹，花开了。"
+    subtitles = words(text, {0: (0, 300)})
+    intervals = line_intervals(text, ["春风吹", "花开了"], subtitles, 1.2)
+    assert intervals == [(0.0, pytest.approx(0.6)), (pytest.approx(0.6), 1.2)]
+
+
+def test_timestamps_are_clamped_to_duration():
+    text = "春风吹，花开了，草绿了。"
+    # 时间戳超出实际音频长度
+    subtitles = words(text, {0: (0, 900), 4: (1100, 1500), 8: (1700, 2000)})
+    intervals = line_intervals(text, ["春风吹", "花开了", "草绿了"], subtitles, 1.0)
+    assert intervals == [(0.0, 1.0), (1.0, 1.0), (1.0, 1.0)]
+    for (_, end), (start, _) in zip(intervals, intervals[1:]):
+        assert end == start
@@ -1,8 +1,47 @@
 from .skills import parse_json_from_response
 from .skills import create_text_files
+from .skills import clean_subtitle_text
+from .skills import process_and_write_text
 from .skills import create_picture_prompt_text_files
 from .skills import MyTTS
 from .skills import generate_and_save_image
+from .skills import get_openai_client
+from .skills import get_http_session
 from .skills import create_video_for_title
 from .skills import create_video_from_images_audio
 from .skills import merge_videos
+from .skills import render_video
+from .skills import render_segment
+from .skills import process_pool
+from .skills import render_video_streaming
+from .skills import close_clip
+from .skills import prepare_frames
+from .skills import title_audio_path
+from .skills import cached_generate_reply
+from .skills import stream_generate_reply
+from .skills import invalidate_cached_reply
+from .cache import DiskCache
+from .cache import IMAGE_CACHE
+from .cache import AUDIO_CACHE
+from .cache import LLM_CACHE
+from .audio import PcmAudio
+from .audio import bgm_duck
+from .nls_session import NlsSession
+from .nls_session import NlsSessionPool
+from .json_stream import JsonEntryStream
+from .ffmpeg import concat_copy
+from .ffmpeg import RenderProfile
+from .ffmpeg import render_profile
+from .subtitles import SubtitleTrack
+from .subtitles import subtitle_font
+from .frame_store import FrameStore
+from .dataflow import DataflowStage
+from .dataflow import run_dataflow
+from .pipeline import RunManifest
+from .segments import Segment
+from .segments import SegmentIndex
+from .segments import Timeline
+from .probe import probe_duration
+from .resources import resource_usage
+from .tracing import TRACER
+from .tracing import Tracer
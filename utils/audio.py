@@ -0,0 +1,265 @@
+import os
+import wave
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .ffmpeg import ffmpeg_binary
+from .tracing import TRACER
+
+# 混音使用的采样率和声道数，与 moviepy 导出音频时的默认值一致
+MIX_RATE = 44100
+MIX_CHANNELS = 2
+
+# 背景音乐的音量
+BGM_GAIN = 0.5
+
+
+def bgm_duck():
+    """
+    有人声时背景音乐的闪避系数，读取环境变量 BGM_DUCK（例如 0.4），不设置时返回 None（不闪避）。
+    每次调用时读取，.env 在导入本模块之后才加载也能生效。
+    """
+    value = os.getenv("BGM_DUCK")
+    return float(value) if value else None
+
+
+class PcmAudio:
+    """
+    内存中的 16 位小端 PCM 音频，时长由采样数精确计算，不需要再解码或探测。
+    """
+    __slots__ = ("data", "sample_rate", "channels")
+
+    def __init__(self, data: bytes, sample_rate: int, channels: int = 1):
+        self.data = data
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    @property
+    def samples(self) -> int:
+        return len(self.data) // (2 * self.channels)
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+    def to_array(self) -> np.ndarray:
+        """
+        转换为 float32 PCM，形状为 (采样数, 声道数)。
+        """
+        pcm = np.frombuffer(self.data[:self.samples * 2 * self.channels], dtype="<i2")
+        return (pcm.astype(np.float32) / 32768.0).reshape(-1, self.channels)
+
+    def save_wav(self, path) -> str:
+        """
+        写成 WAV 文件（先写临时文件再重命名），返回 path。
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with wave.open(tmp_path, 'wb') as file:
+            file.setnchannels(self.channels)
+            file.setsampwidth(2)
+            file.setframerate(self.sample_rate)
+            file.writeframes(self.data)
+        os.replace(tmp_path, path)
+        return path
+
+
+def read_wav(path):
+    """
+    直接读取 16 位 PCM 的 WAV 文件，返回 (float32 PCM, 采样率)；格式不支持时返回 None，交给 ffmpeg 解码。
+    """
+    try:
+        with wave.open(path, 'rb') as file:
+            if file.getsampwidth() != 2:
+                return None
+            channels = file.getnchannels()
+            sample_rate = file.getframerate()
+            data = file.readframes(file.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    return PcmAudio(data, sample_rate, channels).to_array(), sample_rate
+
+
+def _to_channels(pcm, channels):
+    if pcm.shape[1] == channels:
+        return pcm
+    if pcm.shape[1] == 1:
+        return np.repeat(pcm, channels, axis=1)
+    return pcm.mean(axis=1, keepdims=True).repeat(channels, axis=1)
+
+
+def resample(pcm, source_rate, sample_rate=MIX_RATE) -> np.ndarray:
+    """
+    通过一个 ffmpeg 管道把 float32 PCM 从 source_rate 重采样到 sample_rate。
+    """
+    if source_rate == sample_rate or not len(pcm):
+        return pcm
+    channels = pcm.shape[1]
+    proc = subprocess.run(
+        [ffmpeg_binary(), "-hide_banner", "-loglevel", "error",
+         "-f", "f32le", "-ar", str(source_rate), "-ac", str(channels), "-i", "pipe:0",
+         "-f", "f32le", "-acodec", "pcm_f32le", "-ar", str(sample_rate), "-ac", str(channels), "pipe:1"],
+        input=np.ascontiguousarray(pcm, dtype="<f4").tobytes(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to resample: {proc.stderr.decode('utf-8', 'replace')}")
+    return np.frombuffer(proc.stdout, dtype="<f4").reshape(-1, channels)
+
+
+def decode(path, sample_rate=MIX_RATE, channels=MIX_CHANNELS, offset=0.0, duration=None, loop=False) -> np.ndarray:
+    """
+    把音频文件解码为 float32 PCM，形状为 (采样数, 声道数)，取值范围 [-1, 1]。
+
+    参数:
+    offset, duration : float
+        只解码从 offset 秒开始、长 duration 秒的部分。
+    loop : bool
+        为 True 时循环输入，用于比音频本身更长的背景音乐。
+    """
+    if path.endswith('.wav') and not offset and duration is None and not loop:
+        wav = read_wav(path)
+        if wav is not None:
+            return _to_channels(resample(wav[0], wav[1], sample_rate), channels)
+
+    args = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error"]
+    if loop:
+        args += ["-stream_loop", "-1"]
+    args += ["-i", path]
+    if offset:
+        args += ["-ss", f"{offset:.6f}"]
+    if duration is not None:
+        args += ["-t", f"{duration:.6f}"]
+    args += ["-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(channels), "-ar", str(sample_rate), "pipe:1"]
+    proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {proc.stderr.decode('utf-8', 'replace')}")
+    return np.frombuffer(proc.stdout, dtype="<f4").reshape(-1, channels)
+
+
+def decode_many(paths, sample_rate=MIX_RATE, channels=MIX_CHANNELS, workers=4) -> list:
+    """
+    解码多个音频文件，返回与 paths 顺序一致的 PCM 列表。
+
+    WAV 文件在进程内直接读取，采样率相同的 WAV 拼接后只重采样一次再按比例切回各段；
+    其他格式每个文件启动一个 ffmpeg 进程，并发解码。
+    """
+    arrays = [None] * len(paths)
+    with TRACER.span("audio.decode", "audio", files=len(paths), subprocesses=0) as span:
+        groups = {}
+        for i, path in enumerate(paths):
+            wav = read_wav(path) if path.endswith('.wav') else None
+            if wav is not None:
+                groups.setdefault(wav[1], []).append((i, _to_channels(wav[0], channels)))
+
+        for source_rate, items in groups.items():
+            if source_rate == sample_rate:
+                for i, pcm in items:
+                    arrays[i] = pcm
+                continue
+            joined = concat_pcm([pcm for _, pcm in items], channels)
+            out = resample(joined, source_rate, sample_rate)
+            span["subprocesses"] += 1
+            # 重采样后的总长度可能与理论值差几个采样，按比例计算各段边界
+            scale = len(out) / len(joined) if len(joined) else 0
+            bounds = np.round(np.cumsum([len(pcm) for _, pcm in items]) * scale).astype(int)
+            for (i, _), pcm in zip(items, np.split(out, bounds[:-1])):
+                arrays[i] = pcm
+
+        rest = [i for i, pcm in enumerate(arrays) if pcm is None]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for i, pcm in zip(rest, executor.map(lambda i: decode(paths[i], sample_rate, channels), rest)):
+                arrays[i] = pcm
+        span["subprocesses"] += len(rest)
+        span["audio_s"] = sum(len(pcm) for pcm in arrays) / sample_rate
+    return arrays
+
+
+def concat_pcm(arrays, channels=MIX_CHANNELS) -> np.ndarray:
+    """
+    把多段 PCM 拼接到一块预先分配好的缓冲区中。
+    """
+    total = sum(len(pcm) for pcm in arrays)
+    out = np.empty((total, channels), dtype=np.float32)
+    position = 0
+    for pcm in arrays:
+        out[position:position + len(pcm)] = pcm
+        position += len(pcm)
+    return out
+
+
+def duration_of(pcm, sample_rate=MIX_RATE) -> float:
+    return len(pcm) / sample_rate
+
+
+def ducking_gain(voice, sample_rate=MIX_RATE, gain=0.5, duck=0.4, threshold=0.02, window=0.05,
+                 smoothing=0.2) -> np.ndarray:
+    """
+    根据旁白的响度计算背景音乐的逐采样增益：有人声的窗口把增益乘以 duck，并做平滑，避免突变。
+
+    参数:
+    gain : float
+        无人声时背景音乐的增益。
+    duck : float
+        有人声时在 gain 基础上再乘的系数。
+    threshold : float
+        判定为人声的 RMS 阈值。
+    window : float
+        计算 RMS 的窗口长度（秒）。
+    smoothing : float
+        增益曲线的平滑时长（秒）。
+    """
+    hop = max(1, int(window * sample_rate))
+    frames = -(-len(voice) // hop)
+    padded = np.zeros((frames * hop,), dtype=np.float32)
+    padded[:len(voice)] = np.abs(voice).mean(axis=1) if voice.ndim == 2 else np.abs(voice)
+    rms = np.sqrt(np.mean(padded.reshape(frames, hop) ** 2, axis=1))
+
+    curve = np.where(rms > threshold, gain * duck, gain).astype(np.float32)
+    taps = max(1, int(smoothing / window))
+    if taps > 1:
+        kernel = np.ones(taps, dtype=np.float32) / taps
+        curve = np.convolve(np.pad(curve, (taps // 2, taps - 1 - taps // 2), mode='edge'), kernel, mode='valid')
+    return np.repeat(curve, hop)[:len(voice)]
+
+
+def mix_background(narration, bgm_path, offset=0.0, gain=BGM_GAIN, duck="env", sample_rate=MIX_RATE,
+                   channels=MIX_CHANNELS) -> np.ndarray:
+    """
+    把背景音乐从 offset 秒处截取到与旁白相同的长度（不够长时循环），乘以增益后与旁白相加。
+    narration 可写时直接在其缓冲区上混音，不再复制一份。
+
+    参数:
+    duck : float
+        不为 None 时启用闪避：有人声的部分背景音乐增益再乘以 duck（见 ducking_gain）。
+        默认的 "env" 表示读取环境变量 BGM_DUCK，见 bgm_duck。
+    """
+    if duck == "env":
+        duck = bgm_duck()
+    duration = len(narration) / sample_rate
+    with TRACER.span("audio.mix", "audio", audio_s=duration, ducking=duck is not None):
+        bgm = decode(bgm_path, sample_rate, channels, offset=offset, duration=duration, loop=True)
+        out = narration if narration.flags.writeable else narration.copy()
+        length = min(len(out), len(bgm))
+        if duck is None:
+            out[:length] += bgm[:length] * gain
+        else:
+            out[:length] += bgm[:length] * ducking_gain(narration, sample_rate, gain, duck)[:length, None]
+        np.clip(out, -1.0, 1.0, out=out)
+    return out
+
+
+def write_wav(path, pcm, sample_rate=MIX_RATE) -> str:
+    """
+    把 float32 PCM 写成 16 位 WAV，交给编码器使用。pcm 也可以是多段 PCM 的列表，按顺序写入，不必先拼接。
+    """
+    parts = pcm if isinstance(pcm, (list, tuple)) else [pcm]
+    channels = parts[0].shape[1] if parts and parts[0].ndim == 2 else 1
+    samples = sum(len(part) for part in parts)
+    with TRACER.span("audio.write_wav", "audio", audio_s=samples / sample_rate, bytes=samples * channels * 2):
+        with wave.open(path, 'wb') as file:
+            file.setnchannels(channels)
+            file.setsampwidth(2)
+            file.setframerate(sample_rate)
+            for part in parts:
+                file.writeframes((np.clip(part, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+    return path
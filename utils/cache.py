@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+# 缓存根目录，可通过环境变量 VIDEO_CACHE_DIR 修改，默认放在项目根目录下的 cache 文件夹
+CACHE_ROOT = os.getenv("VIDEO_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache'))
+
+
+def link_or_copy(src, dest):
+    """
+    把缓存文件放到目标位置：优先使用硬链接（不占额外空间），跨文件系统等情况下退回到复制。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+class DiskCache:
+    """
+    基于内容哈希的磁盘缓存。
+
+    每个条目以参数的 sha256 作为键存成一个文件，命中时刷新文件的修改时间，
+    写入后若总大小超过 max_bytes，则按修改时间从旧到新淘汰（LRU）。
+
+    总大小在首次写入时扫描一次目录得到，之后随写入和删除累加；只有超过 max_bytes 时才重新扫描、
+    按修改时间排序，淘汰到 max_bytes 的 EVICT_TO（90%）以下，同时校正累计值（其他进程写入同一目录造成的偏差
+    在这时消除）。缓存写满后平均每写入 10% 的容量才扫描一次目录，而不是每次写入都扫描。
+    """
+
+    EVICT_TO = 0.9
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3, suffix: str = ""):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        # 缓存目录的累计大小，None 表示尚未扫描
+        self._total = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(**params) -> str:
+        """
+        根据参数生成缓存键，参数顺序不影响结果。
+        """
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        # 按键的前两位分目录，避免单个目录下文件过多
+        return os.path.join(self.cache_dir, key[:2], key + self.suffix)
+
+    def get(self, key: str):
+        """
+        查询缓存，命中时返回缓存文件路径并刷新其 LRU 时间，未命中返回 None。
+        """
+        path = self.path_for(key)
+        with self._lock:
+            if os.path.exists(path):
+                self.hits += 1
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+            self.misses += 1
+            return None
+
+    def fetch(self, key: str, dest: str) -> bool:
+        """
+        命中时把缓存文件链接或复制到 dest 并返回 True，否则返回 False。
+        """
+        path = self.get(key)
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, dest)
+        except OSError as e:
+            # 条目可能刚被其他进程淘汰，按未命中处理
+            print(f"cache fetch failed for {key}: {e}")
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return False
+        return True
+
+    def put(self, src: str, key: str) -> str:
+        """
+        把 src 文件存入缓存并返回缓存路径。先写临时文件再原子重命名，随后按需淘汰旧条目。
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src, tmp_path)
+        self._commit(tmp_path, path)
+        return path
+
+    def put_bytes(self, data: bytes, key: str) -> str:
+        """
+        把内存中的数据存入缓存并返回缓存路径，写入方式与 put 相同。
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        self._commit(tmp_path, path)
+        return path
+
+    def read_json(self, key: str, ttl: float = None):
+        """
+        读取 JSON 条目，条目不存在或写入时间超过 ttl 秒时返回 None（过期条目会被删除）。
+        """
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or (ttl is not None and time.time() - entry.get("created_at", 0) > ttl):
+            self.invalidate(key)
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return entry["value"]
+
+    def write_json(self, key: str, value) -> str:
+        """
+        以 JSON 形式写入条目并记录写入时间，用于判断 TTL。
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"created_at": time.time(), "value": value}, file, ensure_ascii=False)
+        self._commit(tmp_path, path)
+        return path
+
+    def _commit(self, tmp_path: str, path: str) -> None:
+        # 把临时文件原子重命名为条目，累加大小的变化，超过上限时才扫描目录淘汰
+        size = os.path.getsize(tmp_path)
+        try:
+            size -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._entries())
+            else:
+                self._total += size
+            over = self._total > self.max_bytes
+        if over:
+            self.evict(int(self.max_bytes * self.EVICT_TO))
+
+    def invalidate(self, key: str) -> bool:
+        """
+        删除指定条目，存在并删除成功时返回 True。
+        """
+        path = self.path_for(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if self._total is not None:
+                self._total -= size
+        return True
+
+    def clear(self) -> None:
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        with self._lock:
+            self._total = None
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self, target: int = None) -> int:
+        """
+        淘汰最久未使用的条目，直到总大小不超过 target（默认为 max_bytes），返回淘汰的条目数。
+        """
+        target = self.max_bytes if target is None else target
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self._total = total
+            return removed
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+
+# 生成图片的缓存，在不同的运行和输出目录之间共享
+IMAGE_CACHE = DiskCache(
+    os.path.join(CACHE_ROOT, 'images'),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", 2 * 1024 ** 3)),
+    suffix=".png",
+)
+
+# 语音合成结果的缓存，键包含文本和全部音色参数
+AUDIO_CACHE = DiskCache(
+    os.path.join(CACHE_ROOT, 'audio'),
+    max_bytes=int(os.getenv("AUDIO_CACHE_MAX_BYTES", 1024 ** 3)),
+)
+
+# 大模型回复的缓存，默认 7 天过期
+LLM_CACHE = DiskCache(
+    os.path.join(CACHE_ROOT, 'llm'),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 ** 2)),
+    suffix=".json",
+)
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
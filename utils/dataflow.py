@@ -0,0 +1,113 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .tracing import TRACER
+
+# 队列结束标记
+_DONE = object()
+
+
+class DataflowStage:
+    """
+    数据流中的一个处理阶段。
+
+    参数:
+    name : str
+        阶段名称，trace 中记录为 dataflow.<name>。
+    fn : callable
+        fn(key, item) -> item，在线程池中执行的阻塞函数，返回值交给下一个阶段。
+    workers : int
+        同时处理的条目数上限。
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+
+
+async def _run(produce, stages, queue_size):
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    executors = [ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=f"dataflow-{stage.name}")
+                 for stage in stages]
+    results = {}
+    errors = {}
+
+    async def worker(i, stage):
+        inbox = queues[i]
+        outbox = queues[i + 1] if i + 1 < len(stages) else None
+        while True:
+            entry = await inbox.get()
+            if entry is _DONE:
+                return
+            key, item, queued_at = entry
+            wait_s = time.perf_counter() - queued_at
+
+            def call():
+                with TRACER.span(f"dataflow.{stage.name}", "dataflow", key=key, queue_wait_s=round(wait_s, 4)):
+                    return stage.fn(key, item)
+
+            try:
+                item = await loop.run_in_executor(executors[i], call)
+            except Exception as e:
+                print(f"dataflow stage {stage.name} failed for {key}: {e!r}")
+                errors[key] = (stage.name, e)
+                continue
+            if outbox is None:
+                results[key] = item
+            else:
+                # 下游队列已满时在这里等待，形成逐级背压
+                await outbox.put((key, item, time.perf_counter()))
+
+    async def run_stage(i, stage):
+        await asyncio.gather(*(worker(i, stage) for _ in range(stage.workers)))
+        # 本阶段的所有工作协程都已结束，通知下一阶段
+        if i + 1 < len(stages):
+            for _ in range(stages[i + 1].workers):
+                await queues[i + 1].put(_DONE)
+
+    def emit(key, item):
+        # 在生产者线程中调用：队列已满时阻塞生产者
+        asyncio.run_coroutine_threadsafe(queues[0].put((key, item, time.perf_counter())), loop).result()
+
+    async def run_source():
+        try:
+            await loop.run_in_executor(None, produce, emit)
+        finally:
+            for _ in range(stages[0].workers):
+                await queues[0].put(_DONE)
+
+    try:
+        outcome = await asyncio.gather(run_source(), *(run_stage(i, stage) for i, stage in enumerate(stages)),
+                                       return_exceptions=True)
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True)
+    if isinstance(outcome[0], BaseException):
+        raise outcome[0]
+    return results, errors
+
+
+def run_dataflow(produce, stages, queue_size: int = 2):
+    """
+    以 asyncio 驱动的按条目数据流：每个条目独立地依次经过各个阶段，阶段之间用有界队列连接。
+
+    一个条目在某个阶段变慢只会占用该阶段的一个并发位置，其他条目继续向后流动；
+    下游处理不过来时队列被填满，上游随之等待（背压），不会无限制地堆积中间结果。
+
+    参数:
+    produce : callable
+        produce(emit)，在后台线程中运行，每得到一个条目就调用 emit(key, item)，队列已满时 emit 会阻塞。
+    stages : list
+        DataflowStage 列表，按顺序处理。
+    queue_size : int
+        每个阶段输入队列的容量。
+
+    返回:
+    tuple
+        (results, errors)：results 为 {key: 最后一个阶段的返回值}，errors 为 {key: (阶段名称, 异常)}，
+        调用方按 key 排序后做最终的有序组装。
+    """
+    return asyncio.run(_run(produce, stages, queue_size))
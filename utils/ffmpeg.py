@@ -0,0 +1,271 @@
+import os
+import math
+import time
+import uuid
+import subprocess
+from functools import lru_cache
+
+from moviepy.config import get_setting
+
+from .tracing import TRACER
+
+# 所有成片使用相同的编码参数，保证各部分可以直接流复制拼接
+VIDEO_WRITE_KWARGS = dict(fps=24, codec='libx264', audio_codec='aac')
+
+
+class RenderProfile:
+    """
+    一组渲染参数：分辨率缩放、帧率和编码器设置。同一个故事的各部分必须使用同一个配置渲染，才能流复制拼接。
+
+    参数:
+    name : str
+        配置名称；除 final 以外的配置，输出文件名和 manifest 阶段名带上 _<name> 后缀，不覆盖正式成片。
+    scale : float
+        相对原图的缩放比例，宽高取偶数。
+    fps : int
+        输出帧率。
+    preset : str
+        x264 的 preset，越快压缩率越低。
+    crf : int
+        x264 的质量参数，为 None 时使用编码器默认值。
+    threads : int
+        编码线程数，0 表示由编码器按 CPU 核数决定，为 None 时不指定。
+    """
+
+    def __init__(self, name: str, scale: float = 1.0, fps: int = 24, preset: str = "medium", crf: int = None,
+                 threads: int = None, codec: str = 'libx264', audio_codec: str = 'aac'):
+        self.name = name
+        self.scale = scale
+        self.fps = fps
+        self.preset = preset
+        self.crf = crf
+        self.threads = threads
+        self.codec = codec
+        self.audio_codec = audio_codec
+
+    def __repr__(self):
+        return f"RenderProfile({self.name!r}, scale={self.scale}, fps={self.fps}, preset={self.preset!r})"
+
+    @property
+    def suffix(self) -> str:
+        return "" if self.name == "final" else f"_{self.name}"
+
+    def output_name(self, name: str) -> str:
+        """
+        在文件名的扩展名前加上配置后缀，例如 merged_video.mp4 -> merged_video_preview.mp4。
+        """
+        base, extension = os.path.splitext(name)
+        return f"{base}{self.suffix}{extension}"
+
+    def scale_filter(self):
+        # 缩放后宽高取偶数，yuv420p 要求
+        if self.scale == 1.0:
+            return None
+        return f"scale=trunc(iw*{self.scale}/2)*2:trunc(ih*{self.scale}/2)*2"
+
+    def encoder_args(self) -> list:
+        """
+        视频编码器参数（preset、crf、threads）。
+        """
+        args = ["-preset", self.preset]
+        if self.crf is not None:
+            args += ["-crf", str(self.crf)]
+        if self.threads is not None:
+            args += ["-threads", str(self.threads)]
+        return args
+
+    def write_kwargs(self) -> dict:
+        """
+        传给 moviepy write_videofile 的参数。
+        """
+        kwargs = dict(fps=self.fps, codec=self.codec, audio_codec=self.audio_codec, preset=self.preset)
+        if self.threads is not None:
+            kwargs["threads"] = self.threads
+        return kwargs
+
+
+RENDER_PROFILES = {
+    # 正式成片：原图分辨率，与 VIDEO_WRITE_KWARGS 一致
+    "final": RenderProfile("final", **VIDEO_WRITE_KWARGS),
+    # 预览：半分辨率、12 帧，最快的 preset，用于检查节奏和字幕
+    "preview": RenderProfile("preview", scale=0.5, fps=12, preset="ultrafast", crf=30, threads=0),
+}
+
+
+def render_profile(profile=None) -> RenderProfile:
+    """
+    解析渲染配置：可以是 RenderProfile、RENDER_PROFILES 中的名称，为 None 时使用环境变量 RENDER_PROFILE（默认 final）。
+    """
+    if isinstance(profile, RenderProfile):
+        return profile
+    name = profile or os.getenv("RENDER_PROFILE", "final")
+    if name not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile {name!r}, expected one of {sorted(RENDER_PROFILES)}")
+    return RENDER_PROFILES[name]
+
+
+def ffmpeg_binary() -> str:
+    # 与 moviepy 使用同一个 ffmpeg 可执行文件
+    return get_setting("FFMPEG_BINARY")
+
+
+def run_ffmpeg(args) -> None:
+    """
+    运行 ffmpeg 命令，失败时抛出带有 stderr 输出的 RuntimeError。
+    """
+    cmd = [ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error"] + list(args)
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {proc.stderr.decode('utf-8', 'replace')}")
+
+
+@lru_cache(maxsize=None)
+def has_filter(name: str) -> bool:
+    """
+    检查 ffmpeg 是否编译了指定的滤镜（例如依赖 libass 的 subtitles）。
+    """
+    proc = subprocess.run([ffmpeg_binary(), "-hide_banner", "-filters"], stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL)
+    return any(line.split()[1:2] == [name] for line in proc.stdout.decode('utf-8', 'replace').splitlines())
+
+
+def _filter_value(value) -> str:
+    # 滤镜参数值和滤镜图各需要一层转义
+    value = value.replace("\\", "\\\\").replace("'", "\\'").replace(":", "\\:")
+    for char in "\\'[],;":
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def subtitle_filter(subtitles_path, fonts_dir=None) -> str:
+    """
+    返回把 ASS 字幕烧录到画面上的 -vf 参数。
+    """
+    value = f"subtitles=filename={_filter_value(os.path.abspath(subtitles_path))}"
+    if fonts_dir:
+        value += f":fontsdir={_filter_value(os.path.abspath(fonts_dir))}"
+    return value
+
+
+def _escape(path) -> str:
+    # concat 列表中的单引号需要转义
+    return os.path.abspath(path).replace("'", "'\\''")
+
+
+def concat_copy(input_paths, output_path) -> str:
+    """
+    使用 concat demuxer 以流复制方式拼接多个视频，不重新编码。
+
+    所有输入必须具有相同的编码参数（分辨率、帧率、像素格式、音频采样率等）。
+    """
+    list_path = f"{output_path}.{uuid.uuid4().hex[:8]}.txt"
+    with open(list_path, 'w', encoding='utf-8') as file:
+        for path in input_paths:
+            file.write(f"file '{_escape(path)}'\n")
+    try:
+        with TRACER.span("ffmpeg.concat_copy", "encode", inputs=len(input_paths)) as span:
+            run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path])
+            span["bytes"] = os.path.getsize(output_path)
+    finally:
+        os.remove(list_path)
+    return output_path
+
+
+def _still_inputs(frames, frame_size, fps):
+    """
+    每个原始帧文件作为一路 rawvideo 输入只读取一次，用 loop 滤镜重复成所需的帧数，再用 concat 滤镜首尾相接。
+    帧数按累计时长取整，多段拼接后总帧数不会漂移；最后一段向上取整，保证画面不短于音轨（-shortest 按音轨截断）。
+
+    返回:
+    tuple
+        (输入参数列表, 滤镜图)。
+    """
+    width, height = frame_size
+    args = []
+    chains = []
+    position = 0.0
+    for i, (path, duration) in enumerate(frames):
+        end = position + duration
+        count = (math.ceil(end * fps) if i == len(frames) - 1 else round(end * fps)) - round(position * fps)
+        position = end
+        args += ["-f", "rawvideo", "-pix_fmt", "rgb24", "-video_size", f"{width}x{height}", "-framerate", str(fps),
+                 "-i", path]
+        chains.append(f"[{i}:v]loop=loop={max(count, 1) - 1}:size=1:start=0,setpts=N/{fps}/TB[f{i}]")
+    graph = ";".join(chains) + ";" + "".join(f"[f{i}]" for i in range(len(frames)))
+    return args, graph + f"concat=n={len(frames)}:v=1:a=0"
+
+
+def encode_stills(frames, audio_path, output_path, profile=None, subtitles=None, fonts_dir=None,
+                  frame_size=None) -> str:
+    """
+    把一系列静帧按各自的时长编码成视频，并附加音轨。
+
+    参数:
+    frames : list
+        由 (图片路径, 持续秒数) 组成的列表。
+    audio_path : str
+        完整音轨文件，时长应与所有静帧的总时长一致。
+    profile : RenderProfile
+        渲染配置（分辨率、帧率和编码器设置），见 render_profile。
+    subtitles : str
+        ASS 字幕文件，在同一次编码中由 subtitles 滤镜烧录到画面上；
+        ffmpeg 没有编译 libass 时改为封装成 mov_text 软字幕轨。
+    fonts_dir : str
+        烧录字幕时额外加载字体的目录。
+    frame_size : tuple
+        不为 None 时 frames 中是 FrameStore 中已按 profile 缩放好的 (宽, 高) rgb24 原始帧，
+        ffmpeg 直接读取，不再解码 PNG，也不再缩放。
+    """
+    profile = render_profile(profile)
+    media_s = sum(duration for _, duration in frames)
+    list_path = None
+    if frame_size is not None:
+        inputs, graph = _still_inputs(frames, frame_size, profile.fps)
+        filters = [graph]
+    else:
+        list_path = f"{output_path}.{uuid.uuid4().hex[:8]}.txt"
+        with open(list_path, 'w', encoding='utf-8') as file:
+            for path, duration in frames:
+                file.write(f"file '{_escape(path)}'\nduration {duration:.6f}\n")
+            # concat demuxer 会忽略最后一项的 duration，需要再写一次最后一帧
+            if frames:
+                file.write(f"file '{_escape(frames[-1][0])}'\n")
+        inputs = ["-f", "concat", "-safe", "0", "-i", list_path]
+        # 先缩放再烧录字幕，libass 按字幕轨的 PlayRes 等比缩放字号和位置；
+        # concat demuxer 每个静帧只输出一帧，烧录字幕前先补成恒定帧率，否则一个静帧内的字幕不会切换
+        filters = [profile.scale_filter(), f"fps={profile.fps}" if subtitles is not None else None]
+    video_inputs = len(frames) if frame_size is not None else 1
+    inputs += ["-i", audio_path]
+    outputs = []
+    burn = subtitles is not None and has_filter("subtitles")
+    if burn:
+        filters.append(subtitle_filter(subtitles, fonts_dir))
+    elif subtitles is not None:
+        inputs += ["-i", subtitles]
+        outputs = ["-map", f"{video_inputs + 1}:s", "-c:s", "mov_text"]
+    filters = [value for value in filters if value]
+    if frame_size is not None:
+        video = ["-filter_complex", ",".join(filters) + "[v]", "-map", "[v]"]
+    else:
+        video = (["-vf", ",".join(filters)] if filters else []) + ["-map", "0:v"]
+    try:
+        with TRACER.span("ffmpeg.encode_stills", "encode", output=os.path.basename(output_path), stills=len(frames),
+                         media_s=media_s, subtitles="burn" if burn else ("soft" if subtitles else None),
+                         profile=profile.name, raw_frames=frame_size is not None) as span:
+            start = time.perf_counter()
+            run_ffmpeg(inputs + video + [
+                "-map", f"{video_inputs}:a",
+                # 输出恒定帧率，静止画面由编码器以极小的代价重复
+                "-r", str(profile.fps),
+                "-c:v", profile.codec, "-tune", "stillimage", "-pix_fmt", "yuv420p",
+            ] + profile.encoder_args() + [
+                "-c:a", profile.audio_codec,
+            ] + outputs + [
+                "-shortest",
+                output_path,
+            ])
+            span["encode_fps"] = media_s * profile.fps / (time.perf_counter() - start)
+    finally:
+        if list_path is not None:
+            os.remove(list_path)
+    return output_path
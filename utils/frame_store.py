@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from .tracing import TRACER
+
+FRAME_STORE_DIR = "frame_store"
+
+
+def scaled_size(width: int, height: int, scale: float = 1.0):
+    # 与 RenderProfile.scale_filter 相同的取整方式：缩放后宽高取偶数
+    if scale == 1.0:
+        return width, height
+    return int(width * scale) // 2 * 2, int(height * scale) // 2 * 2
+
+
+class FrameStore:
+    """
+    预先缩放好的原始 RGB 帧：每张配图只解码一次 PNG，按每个目标分辨率缩放后写成没有文件头的 rgb24 文件，
+    放在 data_folder/frame_store 下。
+
+    文件内容就是 (高, 宽, 3) 的 uint8 数组，既可以用 np.memmap 只读映射（各渲染进程共享同一份页缓存，
+    不再各自解码、复制图片），也可以直接作为 ffmpeg 的 rawvideo 输入。配图重新生成（修改时间更新）后自动重建。
+    """
+
+    def __init__(self, data_folder: str):
+        self.folder = os.path.join(data_folder, FRAME_STORE_DIR)
+
+    def path(self, image_path: str, size) -> str:
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.folder, f"{name}.{size[0]}x{size[1]}.rgb")
+
+    def size(self, image_path: str, scale: float = 1.0):
+        """
+        返回配图按 scale 缩放后的 (宽, 高)，只读取 PNG 文件头。
+        """
+        with Image.open(image_path) as image:
+            return scaled_size(*image.size, scale)
+
+    def _fresh(self, image_path, size) -> bool:
+        path = self.path(image_path, size)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return stat.st_size == size[0] * size[1] * 3 and stat.st_mtime >= os.path.getmtime(image_path)
+
+    def ensure(self, image_paths, scales=(1.0,)) -> int:
+        """
+        为每张配图准备 scales 中各缩放比例的帧，已有且未过期的跳过；每张配图最多解码一次。返回新写入的帧数。
+        """
+        written = 0
+        with TRACER.span("frames.build", "render", images=0, frames=0, bytes=0) as span:
+            for image_path in dict.fromkeys(image_paths):
+                sizes = list(dict.fromkeys(self.size(image_path, scale) for scale in scales))
+                missing = [size for size in sizes if not self._fresh(image_path, size)]
+                if not missing:
+                    continue
+                os.makedirs(self.folder, exist_ok=True)
+                with Image.open(image_path) as image:
+                    image = image.convert("RGB")
+                    span["images"] += 1
+                    for size in missing:
+                        frame = image if image.size == tuple(size) else image.resize(size, Image.LANCZOS)
+                        self._write(self.path(image_path, size), np.asarray(frame))
+                        span["frames"] += 1
+                        span["bytes"] += size[0] * size[1] * 3
+                        written += 1
+        return written
+
+    def _write(self, path, pixels) -> None:
+        # 先写临时文件再重命名，多个渲染进程同时准备同一张图时不会读到写了一半的帧
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        frame = np.memmap(tmp_path, dtype=np.uint8, mode='w+', shape=pixels.shape)
+        frame[:] = pixels
+        frame.flush()
+        del frame
+        os.replace(tmp_path, path)
+
+    def frame(self, image_path: str, scale: float = 1.0):
+        """
+        返回配图按 scale 缩放后的帧文件路径和 (宽, 高)，缺少时先生成。
+        """
+        self.ensure([image_path], (scale,))
+        size = self.size(image_path, scale)
+        return self.path(image_path, size), size
+
+    def load(self, image_path: str, scale: float = 1.0) -> np.ndarray:
+        """
+        以只读内存映射的方式打开帧，返回形状为 (高, 宽, 3) 的 uint8 数组，不复制像素数据。
+        """
+        path, (width, height) = self.frame(image_path, scale)
+        return np.memmap(path, dtype=np.uint8, mode='r', shape=(height, width, 3))
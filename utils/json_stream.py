@@ -0,0 +1,37 @@
+import re
+import json
+
+
+class JsonEntryStream:
+    """
+    从流式到达的 LLM 回复中增量解析 "sentence_N": "..." 这类 JSON 字符串条目。
+
+    回复是 ```json 代码块中的对象，整体要等最后一个 token 才是合法 JSON；这里每收到一段文本就查找
+    已经完整（出现了结束引号）的条目，让下游在回复生成的同时开始处理。
+
+    参数:
+    prefix : str
+        条目键名的前缀，如 "sentence_" 或 "picture_prompt_"。
+    """
+
+    def __init__(self, prefix: str):
+        self.pattern = re.compile(r'"(%s\d+)"\s*:\s*"((?:[^"\\]|\\.)*)"' % re.escape(prefix))
+        self.text = ""
+        self.position = 0
+        self.entries = {}
+
+    def feed(self, chunk: str) -> list:
+        """
+        追加一段文本，返回其中新出现的完整条目 [(键, 值), ...]，按出现顺序排列。
+        """
+        self.text += chunk
+        found = []
+        for match in self.pattern.finditer(self.text, self.position):
+            try:
+                value = json.loads(f'"{match.group(2)}"')
+            except ValueError:
+                value = match.group(2)
+            self.entries[match.group(1)] = value
+            found.append((match.group(1), value))
+            self.position = match.end()
+        return found
@@ -0,0 +1,192 @@
+import json
+import uuid
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+from nls import util as nls_util
+from nls import websocket
+
+from .tracing import TRACER
+
+NAMESPACE = "SpeechSynthesizer"
+
+
+class NlsSession:
+    """
+    一条保持打开的阿里云语音合成 websocket 连接，在同一连接上依次发送多个 StartSynthesis 请求。
+
+    nls.NlsSpeechSynthesizer 每次合成都会新建连接并在 SynthesisCompleted 后关闭，长故事里每行字幕都要握手一次；
+    这里直接使用 SDK 自带的 websocket 客户端，连接只在首次使用或被服务端关闭后才建立。
+    建立连接和单个请求分别记录为 nls.connect 和 nls.request 两种 span。
+
+    参数:
+    connect_timeout : float
+        建立连接（含握手）的超时秒数。
+    request_timeout : float
+        等待服务端下一帧数据的超时秒数。
+    """
+
+    def __init__(self, url: str, token: str, appkey: str, connect_timeout: float = 10.0,
+                 request_timeout: float = 60.0):
+        self.url = url
+        self.token = token
+        self.appkey = appkey
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.ws = None
+        self.connects = 0
+        self.requests = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None and self.ws.connected
+
+    def connect(self) -> None:
+        self.close()
+        with TRACER.span("nls.connect", "tts", reconnect=self.connects > 0):
+            self.ws = websocket.create_connection(self.url, timeout=self.connect_timeout,
+                                                  header=[f"X-NLS-Token: {self.token}"])
+            self.ws.settimeout(self.request_timeout)
+        self.connects += 1
+
+    def close(self) -> None:
+        if self.ws is not None:
+            try:
+                self.ws.close(timeout=1)
+            except Exception:
+                pass
+            self.ws = None
+
+    def _start_message(self, text, voice, aformat, sample_rate, volume, speech_rate, pitch_rate, ex):
+        payload = {
+            "text": text,
+            "voice": voice,
+            "format": aformat,
+            "sample_rate": sample_rate,
+            "volume": volume,
+            "speech_rate": speech_rate,
+            "pitch_rate": pitch_rate,
+        }
+        if ex:
+            payload.update(ex)
+        return json.dumps({
+            "header": {
+                "message_id": uuid.uuid4().hex,
+                "task_id": uuid.uuid4().hex,
+                "namespace": NAMESPACE,
+                "name": "StartSynthesis",
+                "appkey": self.appkey,
+            },
+            "payload": payload,
+            "context": nls_util.GetDefaultContext(),
+        })
+
+    def synthesize(self, text, voice="xiaoyun", aformat="pcm", sample_rate=16000, volume=50, speech_rate=0,
+                   pitch_rate=0, ex: dict = None, on_data=None, on_metainfo=None, callback_args=()) -> dict:
+        """
+        合成一段文本，音频数据按到达顺序交给 on_data(data, *callback_args)，MetaInfo 消息交给 on_metainfo。
+
+        连接已被服务端关闭（空闲超时等）且还没有收到任何数据时，自动重连并重发一次请求。
+
+        返回:
+        dict
+            SynthesisCompleted 消息。服务端返回 TaskFailed 或连接中断时抛出 RuntimeError。
+        """
+        message = self._start_message(text, voice, aformat, sample_rate, volume, speech_rate, pitch_rate, ex)
+        for attempt in range(2):
+            if not self.connected:
+                self.connect()
+            received = [0]
+            try:
+                return self._request(message, on_data, on_metainfo, callback_args, received)
+            except (websocket.WebSocketConnectionClosedException, ConnectionError, OSError) as e:
+                self.close()
+                if received[0] or attempt:
+                    raise RuntimeError(f"NLS connection lost: {e!r}") from e
+                print(f"NLS connection closed by server, reconnecting: {e!r}")
+            except Exception:
+                # 超时或协议错误后连接状态未知，丢弃这条连接
+                self.close()
+                raise
+
+    def _request(self, message, on_data, on_metainfo, callback_args, received) -> dict:
+        with TRACER.span("nls.request", "tts", bytes=0, first_byte_s=None) as span:
+            start = time.perf_counter()
+            self.ws.send(message)
+            self.requests += 1
+            while True:
+                opcode, data = self.ws.recv_data()
+                # 只有数据帧才算收到了响应；空闲连接被服务端正常关闭时收到的 CLOSE 帧仍可重连重发
+                if opcode in (websocket.ABNF.OPCODE_BINARY, websocket.ABNF.OPCODE_TEXT):
+                    received[0] += 1
+                if opcode == websocket.ABNF.OPCODE_BINARY:
+                    if span["first_byte_s"] is None:
+                        span["first_byte_s"] = round(time.perf_counter() - start, 4)
+                    span["bytes"] += len(data)
+                    if on_data:
+                        on_data(data, *callback_args)
+                elif opcode == websocket.ABNF.OPCODE_TEXT:
+                    reply = json.loads(data)
+                    name = reply["header"]["name"]
+                    if name == "SynthesisCompleted":
+                        return reply
+                    if name == "TaskFailed":
+                        span["failed"] = True
+                        raise RuntimeError(reply["header"].get("status_message", "TaskFailed"))
+                    if name == "MetaInfo" and on_metainfo:
+                        on_metainfo(data, *callback_args)
+                elif opcode == websocket.ABNF.OPCODE_CLOSE:
+                    raise websocket.WebSocketConnectionClosedException("server closed the connection")
+
+
+class NlsSessionPool:
+    """
+    NlsSession 连接池，最多同时保持 size 条连接。连接按需创建，用完放回池中供后续请求复用；
+    请求失败的连接在放回前已被关闭，下次取出时自动重连。
+    """
+
+    def __init__(self, url: str, token: str, appkey: str, size: int = 4, **session_kwargs):
+        self.url = url
+        self.token = token
+        self.appkey = appkey
+        self.size = max(1, size)
+        self.session_kwargs = session_kwargs
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._sessions = []
+
+    @contextmanager
+    def session(self):
+        """
+        取出一条连接，with 语句结束后放回。池中连接都在使用时阻塞等待。
+        """
+        self._slots.acquire()
+        try:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                session = NlsSession(self.url, self.token, self.appkey, **self.session_kwargs)
+                with self._lock:
+                    self._sessions.append(session)
+            try:
+                yield session
+            finally:
+                self._idle.put(session)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "connects": sum(session.connects for session in self._sessions),
+                "requests": sum(session.requests for session in self._sessions),
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            for session in self._sessions:
+                session.close()
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from .tracing import TRACER
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_inputs(values=None, files=()) -> str:
+    """
+    计算阶段输入的哈希：values 为任意可 JSON 序列化的参数，files 为输入文件列表（按内容计算）。
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(values, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    for path in sorted(files):
+        digest.update(os.path.basename(path).encode('utf-8'))
+        digest.update(hash_file(path).encode('utf-8') if os.path.exists(path) else b'<missing>')
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """
+    记录流水线每个阶段的输入哈希、输出文件哈希和状态，保存在 save_folder/manifest.json 中。
+
+    重新运行时，输入哈希未变且输出文件完好的阶段会被跳过，从第一个过期或失败的阶段继续。
+    """
+
+    def __init__(self, save_folder: str, filename: str = "manifest.json"):
+        self.save_folder = save_folder
+        self.path = os.path.join(save_folder, filename)
+        self._lock = threading.Lock()
+        self.stages = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    self.stages = json.load(file).get("stages", {})
+            except (OSError, ValueError):
+                print(f"manifest {self.path} is unreadable, starting from scratch")
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"stages": self.stages}, file, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _relpath(self, path: str) -> str:
+        return os.path.relpath(path, self.save_folder)
+
+    def is_fresh(self, name: str, input_hash: str) -> bool:
+        """
+        阶段已成功完成、输入未变化且所有输出文件仍与记录的哈希一致时返回 True。
+        """
+        entry = self.stages.get(name)
+        if not entry or entry.get("status") != "done" or entry.get("inputs") != input_hash:
+            return False
+        for rel_path, digest in entry.get("outputs", {}).items():
+            path = os.path.join(self.save_folder, rel_path)
+            if not os.path.exists(path) or hash_file(path) != digest:
+                return False
+        return True
+
+    def record(self, name: str, input_hash: str, status: str, outputs=(), elapsed: float = 0.0,
+               error: str = None) -> None:
+        with self._lock:
+            self.stages[name] = {
+                "status": status,
+                "inputs": input_hash,
+                "outputs": {self._relpath(path): hash_file(path) for path in outputs if os.path.exists(path)},
+                "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "elapsed_s": round(elapsed, 3),
+            }
+            if error is not None:
+                self.stages[name]["error"] = error
+            self.save()
+
+    def outputs(self, name: str):
+        entry = self.stages.get(name, {})
+        return [os.path.join(self.save_folder, rel_path) for rel_path in entry.get("outputs", {})]
+
+    def run_stage(self, name: str, fn, values=None, files=(), force: bool = False):
+        """
+        运行一个阶段。
+
+        参数:
+        name : str
+            阶段名称。
+        fn : callable
+            无参数的阶段函数，返回该阶段产出的文件路径列表。
+        values, files :
+            阶段的输入参数和输入文件，见 hash_inputs。
+        force : bool
+            为 True 时即使输入未变化也重新运行。
+
+        返回:
+        list
+            阶段的输出文件路径；阶段被跳过时返回上次记录的输出。
+        """
+        with TRACER.span(f"stage.{name}", "stage", story=self.save_folder, skipped=False) as span:
+            input_hash = hash_inputs(values, files)
+            if not force and self.is_fresh(name, input_hash):
+                print(f"[{name}] up to date, skipped")
+                span["skipped"] = True
+                return self.outputs(name)
+
+            print(f"[{name}] running")
+            start = time.perf_counter()
+            try:
+                outputs = [path for path in fn() or [] if path]
+            except Exception as e:
+                self.record(name, input_hash, "failed", elapsed=time.perf_counter() - start, error=repr(e))
+                raise
+            self.record(name, input_hash, "done", outputs=outputs, elapsed=time.perf_counter() - start)
+            print(f"[{name}] done in {time.perf_counter() - start:.2f}s")
+            span["outputs"] = len(outputs)
+            return outputs
@@ -0,0 +1,156 @@
+import os
+import struct
+
+# MPEG 音频帧头中的比特率（kbps）和采样率表，下标为帧头中的编号
+_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+_VERSIONS = {0b00: 2.5, 0b10: 2, 0b11: 1}
+_LAYERS = {0b01: 3, 0b10: 2, 0b11: 1}
+# 带有无缝播放信息（编码器延迟和尾部填充）的扩展头，LAME 和 ffmpeg（Lavf/Lavc）写入的格式相同
+_GAPLESS_TAGS = (b"LAME", b"Lavf", b"Lavc")
+# probe_duration 读取的文件头长度，足以容纳 WAV 的 fmt/data 块头和 MP3 开头的若干帧
+_HEADER_BYTES = 64 * 1024
+
+
+def wav_duration(data: bytes, file_size: int = None) -> float:
+    """
+    从 RIFF 头中的 fmt 和 data 块计算 WAV 的时长，不限于 16 位 PCM。无法解析时返回 None。
+
+    参数:
+    data : bytes
+        文件开头的数据，至少包含到 data 块头为止。
+    file_size : int
+        文件的实际大小，默认为 len(data)（data 是整个文件）。
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    byte_rate = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, size = struct.unpack_from("<4sI", data, position)
+        if chunk_id == b"fmt " and size >= 16:
+            byte_rate = struct.unpack_from("<I", data, position + 16)[0]
+        elif chunk_id == b"data" and byte_rate:
+            # 流式写出的 WAV 可能没有回填 data 块长度，以文件实际长度为准
+            file_size = len(data) if file_size is None else file_size
+            return min(size, file_size - position - 8) / byte_rate
+        position += 8 + size + (size & 1)
+    return None
+
+
+def _frame_header(data: bytes, position: int):
+    # 解析 position 处的 MPEG 音频帧头，返回 (帧长度, 每帧采样数, 采样率, 版本, 声道模式)，不是合法帧头时返回 None
+    if position + 4 > len(data) or data[position] != 0xFF or data[position + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[position + 1], data[position + 2], data[position + 3]
+    version = _VERSIONS.get((b1 >> 3) & 0b11)
+    layer = _LAYERS.get((b1 >> 1) & 0b11)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 0b11
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, version, b3 >> 6
+    samples = 1152 if layer == 2 or version == 1 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate, version, b3 >> 6
+
+
+def _skip_id3(data: bytes) -> int:
+    # ID3v2 标签的长度是 4 个 7 位字节，可能带 10 字节的尾部
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        return 10 + size + (10 if data[5] & 0x10 else 0)
+    return 0
+
+
+def _gapless_samples(data: bytes, xing: int, flags: int) -> int:
+    # Xing/Info 头之后的 LAME 扩展头第 21~23 字节是编码器延迟和尾部填充（各 12 位），解码时会被去掉
+    tag = xing + 8 + 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+    if data[tag:tag + 4] not in _GAPLESS_TAGS or len(data) < tag + 24:
+        return 0
+    b0, b1, b2 = data[tag + 21], data[tag + 22], data[tag + 23]
+    return ((b0 << 4) | (b1 >> 4)) + (((b1 & 0x0F) << 8) | b2)
+
+
+def mp3_duration(data: bytes, complete: bool = True) -> float:
+    """
+    计算 MP3 的时长：跳过 ID3v2 标签，优先读取第一帧中的 Xing/Info 或 VBRI 头记录的总帧数，
+    并减去 LAME 扩展头中的编码器延迟和尾部填充，与 ffmpeg 解码得到的采样数一致；
+    没有这些头时逐帧累加帧头中的采样数（只读帧头，不解码）。无法解析时返回 None。
+
+    参数:
+    complete : bool
+        为 False 时 data 只是文件开头的一部分：没有 Xing/Info 或 VBRI 头时返回 None，由调用方读取整个文件后再计算。
+    """
+    position = _skip_id3(data)
+    # 找到第一个后面紧跟另一个合法帧头的同步字，避免把标签或封面中的 0xFF 当成帧头
+    while position + 4 <= len(data):
+        header = _frame_header(data, position)
+        if header and (position + header[0] >= len(data) or _frame_header(data, position + header[0])):
+            break
+        position += 1
+    else:
+        return None
+
+    length, samples, sample_rate, version, mode = header
+    side_info = (32 if mode != 3 else 17) if version == 1 else (17 if mode != 3 else 9)
+    xing = position + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info") and struct.unpack_from(">I", data, xing + 4)[0] & 1:
+        flags = struct.unpack_from(">I", data, xing + 4)[0]
+        total = struct.unpack_from(">I", data, xing + 8)[0] * samples - _gapless_samples(data, xing, flags)
+        return max(total, 0) / sample_rate
+    if data[position + 36:position + 40] == b"VBRI":
+        return struct.unpack_from(">I", data, position + 50)[0] * samples / sample_rate
+    if not complete:
+        return None
+
+    total = 0
+    while True:
+        header = _frame_header(data, position)
+        if header is None:
+            break
+        total += header[1]
+        position += header[0]
+    return total / sample_rate if total else None
+
+
+def probe_duration(audio_path: str) -> float:
+    """
+    读取音频文件的时长（秒）。WAV 和 MP3 直接解析文件头和帧头，不启动 ffmpeg；
+    其他格式或无法解析的文件才交给 moviepy 打开。
+
+    WAV 只读取文件开头，data 块的长度以块头和文件大小为准；MP3 跳过 ID3v2 标签后只读取开头的若干帧，
+    没有 Xing/Info 或 VBRI 头时才读取整个文件逐帧累加。
+    """
+    extension = os.path.splitext(audio_path)[1].lower()
+    duration = None
+    if extension == ".wav":
+        with open(audio_path, 'rb') as file:
+            duration = wav_duration(file.read(_HEADER_BYTES), os.fstat(file.fileno()).st_size)
+    elif extension == ".mp3":
+        with open(audio_path, 'rb') as file:
+            # 封面等大的 ID3 标签直接跳过，不读入内存
+            file.seek(_skip_id3(file.read(10)))
+            data = file.read(_HEADER_BYTES)
+            duration = mp3_duration(data, complete=len(data) < _HEADER_BYTES)
+            if duration is None and len(data) == _HEADER_BYTES:
+                duration = mp3_duration(data + file.read())
+    if duration is not None:
+        return duration
+
+    from moviepy.editor import AudioFileClip
+    audio = AudioFileClip(audio_path)
+    try:
+        return audio.duration
+    finally:
+        audio.close()
@@ -0,0 +1,63 @@
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+
+def _maxrss_mb(who) -> float:
+    # ru_maxrss 在 Linux 上以 KiB 为单位，在 macOS 上以字节为单位
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def peak_rss_mb() -> float:
+    """
+    当前进程的峰值常驻内存（MiB），读不到时返回 None。
+    """
+    return _maxrss_mb(resource.RUSAGE_SELF) if resource is not None else None
+
+
+def children_peak_rss_mb() -> float:
+    """
+    已结束的子进程（ffmpeg 等）中最大的峰值常驻内存（MiB），读不到时返回 None。
+    """
+    return _maxrss_mb(resource.RUSAGE_CHILDREN) if resource is not None else None
+
+
+def rss_mb() -> float:
+    """
+    当前进程此刻的常驻内存（MiB），从 /proc/self/statm 读取；没有 /proc 时返回峰值。
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def open_fds() -> int:
+    """
+    当前进程打开的文件描述符数量（文件、管道、套接字），没有 /proc/self/fd 或 /dev/fd 时返回 None。
+    """
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            # listdir 本身会临时打开一个描述符，不计入
+            return len(os.listdir(fd_dir)) - 1
+        except OSError:
+            continue
+    return None
+
+
+def resource_usage() -> dict:
+    """
+    返回当前的资源占用，可以直接写入 trace 事件：
+    rss_mb、peak_rss_mb、children_peak_rss_mb 和 open_fds。
+    """
+    usage = {"rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb(), "children_peak_rss_mb": children_peak_rss_mb(),
+             "open_fds": open_fds()}
+    return {key: round(value, 1) if isinstance(value, float) else value for key, value in usage.items()}
@@ -0,0 +1,282 @@
+import os
+import re
+import json
+
+from .probe import probe_duration
+
+SEGMENTS_FILE = "segments.json"
+# 时长的读取方式变化时递增，旧索引中记录的 MP3 时长（包含编码器延迟和填充）在加载时丢弃并重新读取
+DURATION_VERSION = 2
+
+_SUBTITLE_RE = re.compile(r"^(\d+)_subtitle_(\d+)\.txt$")
+
+
+def subtitle_name(paragraph: int, line: int) -> str:
+    # 与 create_text_files 的命名一致
+    return f"0{paragraph:02d}_subtitle_{line:03d}.txt"
+
+
+def picture_name(paragraph: int) -> str:
+    # 与 create_picture_prompt_text_files 的命名一致
+    return f"0{paragraph:02d}_picture_prompt.png"
+
+
+def _existing_format(base_path: str) -> str:
+    # 旧目录中的配音是 mp3
+    return "mp3" if os.path.exists(f"{base_path}.mp3") and not os.path.exists(f"{base_path}.wav") else "wav"
+
+
+class Segment:
+    """
+    正文中的一行字幕：所属段落、行号、文本、配图、配音和配音时长（秒，未知时为 None）。
+    """
+    __slots__ = ("paragraph", "line", "text", "image_path", "audio_path", "duration")
+
+    def __init__(self, paragraph: int, line: int, text: str, image_path: str, audio_path: str,
+                 duration: float = None):
+        self.paragraph = paragraph
+        self.line = line
+        self.text = text
+        self.image_path = image_path
+        self.audio_path = audio_path
+        self.duration = duration
+
+    def __repr__(self):
+        return f"Segment({self.paragraph}, {self.line}, {self.text!r}, duration={self.duration})"
+
+
+class SegmentIndex:
+    """
+    故事所有字幕行的索引，按段落和行号排序，保存在 save_folder/segments.json 中。
+
+    由切分阶段创建，语音合成阶段补充配音时长，渲染阶段直接读取，不再反复扫描目录、按文件名前缀匹配。
+    """
+
+    def __init__(self, save_folder: str, segments=(), texts=None):
+        self.save_folder = save_folder
+        self.path = os.path.join(save_folder, SEGMENTS_FILE)
+        self.segments = sorted(segments, key=lambda seg: (seg.paragraph, seg.line))
+        # 段落编号到完整段落文本（含标点）的映射，按段落合成语音时使用
+        self.texts = dict(texts or {})
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return len(self.segments)
+
+    @classmethod
+    def from_lines(cls, save_folder: str, paragraphs, audio_format: str = "wav", texts=None) -> "SegmentIndex":
+        """
+        根据切分结果创建索引。
+
+        参数:
+        paragraphs : dict
+            段落编号到 [(行号, 字幕文本), ...] 的映射，空行会被跳过。
+        audio_format : str
+            配音文件的扩展名；为 None 时使用目录中已存在的 wav 或 mp3 文件。
+        texts : dict
+            段落编号到完整段落文本的映射，字幕行是其中依次出现的片段。
+        """
+        segments = []
+        for paragraph, lines in paragraphs.items():
+            for line, text in lines:
+                if not text.strip():
+                    continue
+                audio_path = os.path.join(save_folder, subtitle_name(paragraph, line)[:-4])
+                audio_path += "." + (audio_format or _existing_format(audio_path))
+                segments.append(Segment(paragraph, line, text.strip(),
+                                        os.path.join(save_folder, picture_name(paragraph)), audio_path))
+        return cls(save_folder, segments, texts)
+
+    def set_audio_format(self, audio_format: str) -> None:
+        """
+        把所有配音路径改为 audio_format 扩展名，并清除已记录的时长。
+        """
+        for seg in self.segments:
+            seg.audio_path = f"{os.path.splitext(seg.audio_path)[0]}.{audio_format}"
+            seg.duration = None
+
+    @classmethod
+    def scan(cls, save_folder: str) -> "SegmentIndex":
+        """
+        从已有的字幕文件重建索引（没有 segments.json 的旧目录），只列一次目录。
+        """
+        paragraphs = {}
+        for name in os.listdir(save_folder):
+            match = _SUBTITLE_RE.match(name)
+            if not match:
+                continue
+            with open(os.path.join(save_folder, name), 'r', encoding='utf-8') as file:
+                paragraphs.setdefault(int(match.group(1)), []).append((int(match.group(2)), file.read()))
+        return cls.from_lines(save_folder, paragraphs, audio_format=None)
+
+    @classmethod
+    def load(cls, save_folder: str) -> "SegmentIndex":
+        """
+        读取 segments.json；文件不存在或损坏时扫描字幕文件重建并保存。
+        """
+        path = os.path.join(save_folder, SEGMENTS_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            index = cls.scan(save_folder)
+            index.save()
+            return index
+
+        current = data.get("duration_version") == DURATION_VERSION
+        segments = [Segment(item["paragraph"], item["line"], item["text"],
+                            os.path.join(save_folder, item["image"]), os.path.join(save_folder, item["audio"]),
+                            item.get("duration") if current or not item["audio"].endswith(".mp3") else None)
+                    for item in data["segments"]]
+        texts = {int(paragraph): text for paragraph, text in data.get("paragraphs", {}).items()}
+        return cls(save_folder, segments, texts)
+
+    def save(self) -> str:
+        data = {"segments": [{
+            "paragraph": seg.paragraph,
+            "line": seg.line,
+            "text": seg.text,
+            "image": os.path.relpath(seg.image_path, self.save_folder),
+            "audio": os.path.relpath(seg.audio_path, self.save_folder),
+            "duration": seg.duration,
+        } for seg in self.segments], "paragraphs": {str(p): text for p, text in sorted(self.texts.items())},
+            "duration_version": DURATION_VERSION}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        return self.path
+
+    def paragraphs(self) -> dict:
+        """
+        按段落分组，返回 {段落编号: [Segment, ...]}，保持顺序。
+        """
+        groups = {}
+        for seg in self.segments:
+            groups.setdefault(seg.paragraph, []).append(seg)
+        return groups
+
+    def paragraph_text(self, paragraph: int) -> str:
+        """
+        返回段落的完整文本；旧目录中没有记录时用逗号把字幕行重新连接起来。
+        """
+        if paragraph in self.texts:
+            return self.texts[paragraph]
+        return "，".join(seg.text for seg in self.segments if seg.paragraph == paragraph) + "。"
+
+    def images(self) -> list:
+        return list(dict.fromkeys(seg.image_path for seg in self.segments))
+
+    def audio_files(self) -> list:
+        return [seg.audio_path for seg in self.segments]
+
+    def ensure_durations(self, probe=probe_duration) -> int:
+        """
+        为缺少时长的片段读取配音时长并保存索引，返回补充的数量。
+        """
+        missing = [seg for seg in self.segments if seg.duration is None]
+        for seg in missing:
+            seg.duration = probe(seg.audio_path)
+        if missing:
+            self.save()
+        return len(missing)
+
+    def plan(self, title_duration: float = 0.0) -> "Timeline":
+        """
+        在解码任何音频之前，根据索引中记录的配音时长（缺少时只读文件头补充）规划整条时间线。
+
+        参数:
+        title_duration : float
+            片头的时长，没有片头时为 0。
+        """
+        self.ensure_durations()
+        return Timeline(self.segments, title_duration)
+
+
+class Timeline:
+    """
+    成片的时间线：片头区间、每行字幕的区间、每个段落的区间和总时长，时间均为相对成片开头的秒数。
+
+    背景音乐从正文开头开始播放，段落的背景音乐截取位置见 bgm_offset。
+    """
+
+    def __init__(self, segments, title_duration: float = 0.0):
+        self.title = (0.0, title_duration)
+        # [(Segment, 开始秒数, 结束秒数), ...]
+        self.intervals = []
+        # 段落编号到 (开始秒数, 结束秒数) 的映射
+        self.paragraphs = {}
+        position = title_duration
+        for seg in segments:
+            self.intervals.append((seg, position, position + seg.duration))
+            start = self.paragraphs.get(seg.paragraph, (position, None))[0]
+            position += seg.duration
+            self.paragraphs[seg.paragraph] = (start, position)
+        self.total = position
+
+    @property
+    def body_duration(self) -> float:
+        return self.total - self.title[1]
+
+    def bgm_offset(self, paragraph: int) -> float:
+        """
+        段落在正文中的起始时间，即该段落截取背景音乐的位置。
+        """
+        return self.paragraphs[paragraph][0] - self.title[1]
+
+
+def line_intervals(text: str, lines, subtitles, duration: float) -> list:
+    """
+    根据整段合成返回的字级时间戳，计算每行字幕在整段配音中的起止时间（秒）。
+
+    相邻两行在前一行最后一个字结束和后一行第一个字开始之间的停顿中点切开，所有区间首尾相接、覆盖整段配音，
+    按区间切开的音频拼回去与原音频完全一致。找不到字幕行或缺少时间戳时按字数比例分配。
+
+    参数:
+    text : str
+        合成时提交的段落文本。
+    lines : list
+        依次出现在 text 中的字幕行文本。
+    subtitles : list
+        MetaInfo 中的 subtitles 条目，包含 begin_index、end_index、begin_time 和 end_time（毫秒）。
+    duration : float
+        整段配音的时长（秒）。
+
+    返回:
+    list
+        与 lines 顺序一致的 (开始秒数, 结束秒数) 列表。
+    """
+    spans = []
+    cursor = 0
+    for line in lines:
+        position = text.find(line, cursor)
+        if position < 0:
+            spans = None
+            break
+        spans.append((position, position + len(line)))
+        cursor = position + len(line)
+
+    words = [word for word in subtitles if not word.get("sentence") and "begin_index" in word]
+    times = []
+    for begin, end in spans or []:
+        inside = [word for word in words if begin <= word["begin_index"] < end]
+        if not inside:
+            break
+        times.append((min(word["begin_time"] for word in inside) / 1000,
+                      max(word["end_time"] for word in inside) / 1000))
+
+    if spans is None or len(times) != len(lines):
+        total = sum(len(line) for line in lines) or 1
+        bounds = [0.0]
+        for line in lines:
+            bounds.append(bounds[-1] + duration * len(line) / total)
+    else:
+        bounds = [0.0] + [(times[i][1] + times[i + 1][0]) / 2 for i in range(len(times) - 1)] + [duration]
+    # 时间戳可能超出实际音频长度或不单调，裁剪到 [0, duration] 内并保证递增
+    bounds = [min(max(bound, 0.0), duration) for bound in bounds]
+    bounds[-1] = duration
+    for i in range(1, len(bounds)):
+        bounds[i] = max(bounds[i], bounds[i - 1])
+    return list(zip(bounds[:-1], bounds[1:]))
@@ -1,18 +1,39 @@
+import gc
+import io
 import re
 import json
 import os
+import time
+import uuid
+import hashlib
+import threading
+import multiprocessing
 import requests
-import nls
-import nls.speech_synthesizer
+import numpy as np
 
 from moviepy.editor import (ImageClip, AudioFileClip, TextClip, concatenate_audioclips, CompositeVideoClip,
-                            CompositeAudioClip, concatenate_videoclips, VideoFileClip, vfx)
+                            concatenate_videoclips, VideoFileClip, vfx)
 from moviepy.config import change_settings
 
 from typing import List
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from pathlib import Path
 from openai import OpenAI
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from PIL import Image
+
+from .ffmpeg import concat_copy, encode_stills, has_filter, subtitle_filter, render_profile, RENDER_PROFILES
+from .tracing import TRACER
+from .cache import DiskCache, IMAGE_CACHE, AUDIO_CACHE, LLM_CACHE, LLM_CACHE_TTL
+from .segments import SegmentIndex, line_intervals
+from .probe import probe_duration
+from .audio import PcmAudio, MIX_RATE, decode_many, concat_pcm, mix_background, write_wav
+from .nls_session import NlsSessionPool
+from .json_stream import JsonEntryStream
+from .subtitles import SubtitleTrack, subtitle_font, subtitle_fonts_dir
+from .frame_store import FrameStore
+from .resources import resource_usage
 
 _ = load_dotenv("../.env")
 # 指定 ImageMagick 的路径
@@ -36,6 +57,112 @@ def parse_json_from_response(rsp: str):
         raise ("Json Decode Error: {error}".format(error=e))
 
 
+def _agent_llm_settings(agent):
+    """
+    返回 agent 的 llm_config 中的 (model, api_key, base_url)；autogen 允许直接给出，也允许放在 config_list 中，
+    后者取第一项。没有配置的 api_key 和 base_url 为 None，由 get_openai_client 读取环境变量。
+    """
+    llm_config = agent.llm_config or {}
+    config = llm_config if llm_config.get("model") else (llm_config.get("config_list") or [{}])[0]
+    return config.get("model"), config.get("api_key"), config.get("base_url")
+
+
+def _llm_cache_key(agent, messages):
+    # autogen 的 llm_config 可能直接给出 model，也可能放在 config_list 中
+    llm_config = agent.llm_config or {}
+    model = llm_config.get("model") or [c.get("model") for c in llm_config.get("config_list", [])]
+    system_prompt_hash = hashlib.sha256(agent.system_message.encode('utf-8')).hexdigest()
+    return DiskCache.make_key(kind="llm", model=model, system_prompt=system_prompt_hash, messages=messages)
+
+
+def cached_generate_reply(agent, messages, cache: DiskCache = LLM_CACHE, ttl: float = LLM_CACHE_TTL,
+                          refresh: bool = False):
+    """
+    带磁盘缓存的 agent.generate_reply。
+
+    缓存键由模型、system prompt 的哈希和消息内容组成，相同输入在 ttl 秒内直接返回缓存的回复。
+
+    参数:
+    agent : autogen.ConversableAgent
+        用于生成回复的 agent。
+    messages : list
+        传给 generate_reply 的消息列表。
+    refresh : bool
+        为 True 时忽略已有缓存，重新请求模型并覆盖缓存。
+    """
+    key = _llm_cache_key(agent, messages)
+    with TRACER.span(f"llm.{agent.name}", "llm", cache_hit=False) as span:
+        if cache is not None and not refresh:
+            reply = cache.read_json(key, ttl=ttl)
+            if reply is not None:
+                print(f"llm cache hit for {agent.name}")
+                span["cache_hit"] = True
+                span["reply_chars"] = len(reply)
+                return reply
+
+        reply = agent.generate_reply(messages=messages)
+        span["reply_chars"] = len(reply) if isinstance(reply, str) else 0
+    # 只缓存正常的字符串回复，避免把失败结果固定下来
+    if cache is not None and isinstance(reply, str) and reply:
+        cache.write_json(key, reply)
+    return reply
+
+
+def stream_generate_reply(agent, messages, on_entry, prefix: str, cache: DiskCache = LLM_CACHE,
+                          ttl: float = LLM_CACHE_TTL, refresh: bool = False):
+    """
+    流式版本的 cached_generate_reply：直接以 stream=True 请求模型，边接收边解析，
+    每当回复中出现一个完整的 "<prefix>N": "..." 条目就调用 on_entry(序号, 键, 值)，序号从 1 开始按出现顺序递增。
+
+    缓存与 cached_generate_reply 共用；命中缓存时把缓存的回复交给解析器，回调同样会被依次调用。
+
+    返回:
+    str
+        完整的回复文本，调用方仍应以 parse_json_from_response 的解析结果为准。
+    """
+    key = _llm_cache_key(agent, messages)
+    parser = JsonEntryStream(prefix)
+
+    def feed(text):
+        for name, value in parser.feed(text):
+            on_entry(len(parser.entries), name, value)
+
+    with TRACER.span(f"llm.{agent.name}", "llm", cache_hit=False, stream=True) as span:
+        reply = cache.read_json(key, ttl=ttl) if cache is not None and not refresh else None
+        if reply is not None:
+            print(f"llm cache hit for {agent.name}")
+            span["cache_hit"] = True
+            feed(reply)
+        else:
+            # 与非流式的 agent.generate_reply 使用同一份 llm_config 中的模型、密钥和地址
+            model, api_key, base_url = _agent_llm_settings(agent)
+            start = time.perf_counter()
+            stream = get_openai_client(api_key, base_url).chat.completions.create(
+                model=model, messages=[{"role": "system", "content": agent.system_message}] + messages, stream=True)
+            parts = []
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not parts:
+                    span["first_token_s"] = round(time.perf_counter() - start, 4)
+                parts.append(delta)
+                feed(delta)
+            reply = "".join(parts)
+        span["reply_chars"] = len(reply)
+        span["entries"] = len(parser.entries)
+    if cache is not None and reply and not span["cache_hit"]:
+        cache.write_json(key, reply)
+    return reply
+
+
+def invalidate_cached_reply(agent, messages, cache: DiskCache = LLM_CACHE) -> bool:
+    """
+    删除指定 agent 和消息对应的缓存回复。
+    """
+    return cache.invalidate(_llm_cache_key(agent, messages))
+
+
 def create_picture_prompt_text_files(sentences, save_folder):
     """
     创建一系列文本文件，文件名为递增数字，一位数前面加0，并命名为 picture_prompt 形式的文件名。
@@ -71,76 +198,435 @@ def create_picture_prompt_text_files(sentences, save_folder):
     print("所有 picture prompt 文件已创建并写入内容。")
 
 
+class _TTSJob:
+    """
+    单个语音合成任务的状态。
+
+    每个任务持有自己的文件句柄和完成标记，并通过 callback_args 传给回调函数，
+    这样并发执行的多个任务不会互相写入对方的文件。file 为 None 时音频收集在内存缓冲区中。
+    """
+
+    def __init__(self, text, file=None):
+        self.text = text
+        self.file = file
+        # 先写入临时文件，合成成功后再重命名，避免失败时留下不完整的音频
+        self.tmp_file = f"{file}.{uuid.uuid4().hex[:8]}.part" if file is not None else None
+        self.handle = None
+        self.bytes = 0
+        self.completed = False
+        self.error = None
+        # enable_subtitle 时服务端在 MetaInfo 中返回的字级时间戳
+        self.subtitles = []
+
+    def open(self):
+        self.handle = open(self.tmp_file, "wb") if self.file is not None else io.BytesIO()
+
+    def close(self):
+        # 内存缓冲区关闭后数据会丢失，只关闭文件
+        if self.file is not None and self.handle is not None and not self.handle.closed:
+            self.handle.close()
+
+
 # 定义一个自定义的 TTS 类，用于处理语音合成过程中的各种回调
 class MyTTS:
 
-    def __init__(self, url: str, token: str, appkey: str):
+    def __init__(self, url: str, token: str, appkey: str, cache: DiskCache = AUDIO_CACHE, pool_size: int = 4):
         self.URL = url
         self.TOKEN = token
         self.APPKEY = appkey
+        # 语音缓存，传入 None 时每次都重新合成
+        self.cache = cache
+        # 复用的 websocket 连接池，避免每行字幕都重新建立连接和握手
+        self.pool = NlsSessionPool(url, token, appkey, size=pool_size)
 
     def on_metainfo(self, message, *args):
-        print("on_metainfo message=>{}".format(message))
-
-    def on_error(self, message, *args):
-        print("on_error args=>{}".format(args))
-
-    def on_close(self, *args):
-        print("on_close: args=>{}".format(args))
+        job = args[0]
         try:
-            # 关闭文件
-            self.__file.close()
-        except Exception as e:
-            print("close failed:", e)
+            job.subtitles.extend(json.loads(message)["payload"].get("subtitles", []))
+        except (ValueError, KeyError) as e:
+            print("parse metainfo failed:", e)
 
     def on_data(self, data, *args):
+        job = args[0]
         try:
             # 将数据写入文件
-            self.__file.write(data)
+            job.handle.write(data)
+            job.bytes += len(data)
         except Exception as e:
             print("write data failed:", e)
 
-    def on_completed(self, message, *args):
-        print("on_completed:args=>{} message=>{}".format(args, message))
+    def close(self):
+        """
+        关闭连接池中的所有连接，并输出连接复用情况。
+        """
+        print(f"nls connection stats: {self.pool.stats()}")
+        self.pool.close()
+
+    def _synthesize(self, job, voice, speech_rate, pitch_rate, volume, aformat, sample_rate, ex=None):
+        with TRACER.span("nls.synthesize", "tts", chars=len(job.text)) as span:
+            result = self._synthesize_job(job, voice, speech_rate, pitch_rate, volume, aformat, sample_rate, ex)
+            span["bytes"] = job.bytes
+        return result
+
+    def _synthesize_job(self, job, voice, speech_rate, pitch_rate, volume, aformat, sample_rate, ex=None):
+        # 打开文件以二进制写模式，内存模式下使用缓冲区
+        job.open()
+        try:
+            # 从连接池取出一条连接，通过 callback_args 把任务状态传给回调函数
+            with self.pool.session() as session:
+                session.synthesize(
+                    job.text,
+                    voice=voice,
+                    aformat=aformat,
+                    sample_rate=sample_rate,
+                    speech_rate=speech_rate,
+                    pitch_rate=pitch_rate,
+                    volume=volume,
+                    ex=ex,
+                    on_data=self.on_data,
+                    on_metainfo=self.on_metainfo,
+                    callback_args=[job]
+                )
+            job.completed = True
+        except Exception as e:
+            job.error = e
+        finally:
+            job.close()
+
+        if job.error is not None or not job.completed:
+            if job.tmp_file is not None and os.path.exists(job.tmp_file):
+                os.remove(job.tmp_file)
+            raise RuntimeError(f"TTS failed for '{job.text}': {job.error or 'synthesis not completed'}")
+
+        if job.file is None:
+            return PcmAudio(job.handle.getvalue(), sample_rate)
+        os.replace(job.tmp_file, job.file)
+        return job.file
+
+    def _from_cache(self, text, file, params):
+        """
+        查询语音缓存，命中时把缓存音频链接或复制到 file 并返回 file，未命中返回 None。
+        """
+        if self.cache is None:
+            return None
+        key = DiskCache.make_key(kind="tts", text=text, **params)
+        if self.cache.fetch(key, file):
+            print(f"tts cache hit for '{file}'")
+            return file
+        return None
+
+    def _to_cache(self, text, file, params):
+        if self.cache is not None:
+            self.cache.put(file, DiskCache.make_key(kind="tts", text=text, **params))
+
+    def _cached_pcm(self, text, params):
+        if self.cache is None:
+            return None
+        path = self.cache.get(DiskCache.make_key(kind="tts", text=text, **params))
+        if path is None:
+            return None
+        with open(path, 'rb') as file:
+            return PcmAudio(file.read(), params["sample_rate"])
+
+    def _synthesize_pcm(self, text, params):
+        audio = self._synthesize(_TTSJob(text), **params)
+        if self.cache is not None:
+            self.cache.put_bytes(audio.data, DiskCache.make_key(kind="tts", text=text, **params))
+        return audio
+
+    def synthesize_pcm(self, text, voice="zhiyuan", speech_rate=-456, pitch_rate=0, volume=50, sample_rate=16000):
+        """
+        以 PCM 格式合成单条文本，音频收集在内存中，不经过 mp3 编码和解码。
+
+        返回:
+        PcmAudio
+            16 位单声道 PCM，duration 由采样数精确计算。失败时抛出 RuntimeError。
+        """
+        params = dict(voice=voice, speech_rate=speech_rate, pitch_rate=pitch_rate, volume=volume,
+                      aformat="pcm", sample_rate=sample_rate)
+        audio = self._cached_pcm(text, params)
+        if audio is None:
+            audio = self._synthesize_pcm(text, params)
+        return audio
 
     def run(self, text, file, voice="zhiyuan", speech_rate=-456, pitch_rate=0, volume=50, aformat="mp3",
             sample_rate=16000):
-        # 打开文件以二进制写模式
-        self.__file = open(file, "wb")
-        # 创建 NlsSpeechSynthesizer 实例
-        tts = nls.NlsSpeechSynthesizer(
-            url=self.URL,
-            token=self.TOKEN,
-            appkey=self.APPKEY,
-            # 注册回调函数
-            on_metainfo=self.on_metainfo,
-            on_data=self.on_data,
-            on_completed=self.on_completed,
-            on_error=self.on_error,
-            on_close=self.on_close
-        )
-
-        # 开始语音合成，使用指定的参数
-        result = tts.start(
-            text,
-            voice=voice,
-            aformat=aformat,
-            sample_rate=sample_rate,
-            speech_rate=speech_rate,
-            pitch_rate=pitch_rate,
-            volume=volume
-        )
+        """
+        合成单条文本并写入 file，成功时返回 file，失败时抛出 RuntimeError。
+        aformat 为 "wav" 时在内存中以 PCM 合成后写成 WAV（见 synthesize_pcm）。
+        """
+        params = dict(voice=voice, speech_rate=speech_rate, pitch_rate=pitch_rate, volume=volume,
+                      aformat=aformat, sample_rate=sample_rate)
+        if aformat == "wav":
+            result = self.synthesize_pcm(text, voice, speech_rate, pitch_rate, volume, sample_rate).save_wav(file)
+        else:
+            result = self._from_cache(text, file, params)
+            if result is None:
+                result = self._synthesize(_TTSJob(text, file), **params)
+                self._to_cache(text, file, params)
         # 输出合成结果的状态
         print("tts done with result:{}".format(result))
+        return result
+
+    @staticmethod
+    def _with_retries(span, label, fn, retries, retry_delay):
+        """
+        调用 fn，失败后按指数退避重试，全部失败时在 span 中标记 failed 并返回 None。
+        """
+        for attempt in range(retries + 1):
+            span["retries"] = attempt
+            try:
+                return fn()
+            except Exception as e:
+                print(f"TTS attempt {attempt + 1}/{retries + 1} failed for '{label}': {e}")
+                if attempt < retries:
+                    time.sleep(retry_delay * (2 ** attempt))
+        span["failed"] = True
+        return None
+
+    @staticmethod
+    def _map_jobs(worker, jobs, max_workers):
+        # 有界线程池执行，结果顺序与 jobs 一致
+        results = [None] * len(jobs)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(worker, *job): i for i, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        return results
+
+    def _report(self, kind, results, jobs):
+        done = sum(1 for r in results if r is not None)
+        print(f"tts {kind} done: {done}/{len(jobs)} succeeded")
+        if self.cache is not None:
+            print(f"tts cache stats: {self.cache.stats()}")
+
+    def run_batch(self, jobs, max_workers=4, retries=2, retry_delay=1.0, voice="zhiyuan", speech_rate=-456,
+                  pitch_rate=0, volume=50, aformat="mp3", sample_rate=16000):
+        """
+        使用有界线程池并发合成一批文本。
+
+        参数:
+        jobs : list
+            由 (text, file) 元组组成的列表。
+        max_workers : int
+            同时进行的合成任务数上限。
+        retries : int
+            每个任务失败后的最大重试次数。
+        retry_delay : float
+            第一次重试前的等待秒数，之后每次重试翻倍。
+        aformat : str
+            "mp3" 等格式直接写入服务端编码的音频；"wav" 在内存中以 PCM 合成后写成无损 WAV。
+
+        返回:
+        list
+            与 jobs 顺序一致的结果列表，成功的任务为输出文件路径，失败的任务为 None。
+        """
+        params = dict(voice=voice, speech_rate=speech_rate, pitch_rate=pitch_rate, volume=volume,
+                      aformat=aformat, sample_rate=sample_rate)
+        # wav 模式在内存中以 PCM 合成，缓存的也是 PCM
+        pcm_params = {**params, "aformat": "pcm"}
+
+        def synthesize(text, file, span):
+            if aformat == "wav":
+                audio = self._synthesize_pcm(text, pcm_params)
+                span["audio_s"] = audio.duration
+                return audio.save_wav(file)
+            result = self._synthesize(_TTSJob(text, file), **params)
+            self._to_cache(text, file, params)
+            # 服务端编码的音频只读帧头得到时长
+            span["audio_s"] = probe_duration(file)
+            return result
+
+        def worker(text, file):
+            with TRACER.span("tts.job", "tts", file=os.path.basename(file), cache_hit=False, retries=0) as span:
+                if aformat == "wav":
+                    audio = self._cached_pcm(text, pcm_params)
+                    cached = audio.save_wav(file) if audio is not None else None
+                    if audio is not None:
+                        span["audio_s"] = audio.duration
+                else:
+                    cached = self._from_cache(text, file, params)
+                    if cached is not None:
+                        span["audio_s"] = probe_duration(cached)
+                if cached is not None:
+                    span["cache_hit"] = True
+                    return cached
+                return self._with_retries(span, file, lambda: synthesize(text, file, span), retries, retry_delay)
+
+        results = self._map_jobs(worker, jobs, max_workers)
+        self._report("batch", results, jobs)
+        return results
+
+    def synthesize_paragraph(self, text, voice="zhiyuan", speech_rate=-456, pitch_rate=0, volume=50,
+                             sample_rate=16000):
+        """
+        以 PCM 格式一次合成整段文本，并请求字级时间戳（enable_subtitle）。
+
+        返回:
+        tuple
+            (PcmAudio, subtitles)，subtitles 为 MetaInfo 中的时间戳条目列表。
+        """
+        params = dict(voice=voice, speech_rate=speech_rate, pitch_rate=pitch_rate, volume=volume,
+                      aformat="pcm", sample_rate=sample_rate)
+        audio_key = DiskCache.make_key(kind="tts", text=text, subtitle=True, **params)
+        subtitles_key = DiskCache.make_key(kind="tts_subtitles", text=text, **params)
+        if self.cache is not None:
+            path = self.cache.get(audio_key)
+            subtitles = self.cache.read_json(subtitles_key)
+            if path is not None and subtitles is not None:
+                with open(path, 'rb') as file:
+                    return PcmAudio(file.read(), sample_rate), subtitles
+
+        job = _TTSJob(text)
+        audio = self._synthesize(job, **params, ex={"enable_subtitle": True})
+        if self.cache is not None:
+            self.cache.put_bytes(audio.data, audio_key)
+            self.cache.write_json(subtitles_key, job.subtitles)
+        return audio, job.subtitles
+
+    def run_paragraphs(self, jobs, max_workers=4, retries=2, retry_delay=1.0, voice="zhiyuan", speech_rate=-456,
+                       pitch_rate=0, volume=50, aformat="wav", sample_rate=16000):
+        """
+        按段落合成：每段只请求一次，再根据字级时间戳把整段配音切成每行字幕各自的 WAV 文件。
+
+        切点落在相邻两行之间的停顿中，各行配音首尾相接，拼起来就是原来的整段配音，
+        因此下游渲染仍然按行处理，字幕与配音保持同步，而合成请求数减少为段落数。
+
+        参数:
+        jobs : list
+            由 (段落文本, [(字幕行文本, 输出文件), ...]) 组成的列表，字幕行须依次出现在段落文本中。
+        aformat : str
+            只支持 "wav"，整段音频需要以 PCM 切分。
+        其余参数同 run_batch。
+
+        返回:
+        list
+            与 jobs 顺序一致的结果列表，成功的段落为各行输出文件的列表，失败的段落为 None。
+        """
+        if aformat != "wav":
+            raise ValueError(f"paragraph synthesis writes WAV files, got aformat={aformat!r}")
+        params = dict(voice=voice, speech_rate=speech_rate, pitch_rate=pitch_rate, volume=volume,
+                      sample_rate=sample_rate)
+
+        def write_lines(text, lines, audio, subtitles):
+            pcm = np.frombuffer(audio.data[:audio.samples * 2], dtype="<i2")
+            outputs = []
+            for (line_text, file), (begin, end) in zip(lines, line_intervals(
+                    text, [line_text for line_text, _ in lines], subtitles, audio.duration)):
+                chunk = pcm[int(round(begin * sample_rate)):int(round(end * sample_rate))]
+                outputs.append(PcmAudio(chunk.tobytes(), sample_rate).save_wav(file))
+            return outputs
+
+        def synthesize(text, lines, span):
+            audio, subtitles = self.synthesize_paragraph(text, **params)
+            span["audio_s"] = audio.duration
+            span["timestamps"] = len(subtitles)
+            return write_lines(text, lines, audio, subtitles)
+
+        def worker(text, lines):
+            with TRACER.span("tts.paragraph", "tts", lines=len(lines), chars=len(text), retries=0) as span:
+                return self._with_retries(span, text[:20], lambda: synthesize(text, lines, span), retries,
+                                          retry_delay)
+
+        results = self._map_jobs(worker, jobs, max_workers)
+        self._report("paragraphs", results, jobs)
+        return results
+
+
+# 整个运行过程中共享的 OpenAI 客户端和 HTTP 会话，复用连接池，避免每张图片重新建立 TLS 连接
+_openai_clients = {}
+_http_session = None
+_client_lock = threading.Lock()
+
+
+def get_openai_client(api_key: str = None, base_url: str = None) -> OpenAI:
+    """
+    返回共享的 OpenAI 客户端，首次调用时创建；api_key 和 base_url 相同的调用共用同一个客户端。
+    未指定时读取环境变量 OPENAI_API_KEY 和 OPENAI_API_BASE。
+    """
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    base_url = base_url or os.getenv('OPENAI_API_BASE')
+    with _client_lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            client = _openai_clients[(api_key, base_url)] = OpenAI(api_key=api_key, base_url=base_url, timeout=60)
+        return client
+
 
+def get_http_session(pool_size: int = 16) -> requests.Session:
+    """
+    返回共享的 requests 会话，连接池大小为 pool_size，首次调用时创建。
+    """
+    global _http_session
+    with _client_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+        return _http_session
+
+
+def download_file(url: str, file_path: str, chunk_size: int = 64 * 1024):
+    """
+    以流式分块的方式下载 url 到 file_path。
 
-def generate_and_save_image(query: str, filename: str, image_size: str = "1024x1024", save_folder: str = "") -> None:
+    数据先写入同目录下的临时文件，下载完整后再原子重命名，中途失败不会留下半个文件。
+
+    返回:
+    dict
+        下载成功时返回字节数、首字节延迟、总耗时和吞吐量；HTTP 状态码不是 200 时返回 None。
+    """
+    with TRACER.span("http.download", "http") as span:
+        result = _download_file(url, file_path, chunk_size)
+        if result is not None:
+            span.update(result)
+    return result
+
+
+def _download_file(url, file_path, chunk_size):
+    start = time.perf_counter()
+    with get_http_session().get(url, stream=True, timeout=60) as response:
+        first_byte = time.perf_counter() - start
+        if response.status_code != 200:
+            print(f"Failed to download {url}: HTTP {response.status_code}")
+            return None
+
+        tmp_path = f"{file_path}.{uuid.uuid4().hex[:8]}.part"
+        size = 0
+        try:
+            with open(tmp_path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    file.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "bytes": size,
+        "first_byte_s": first_byte,
+        "elapsed_s": elapsed,
+        "throughput_kib_s": size / 1024 / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def generate_and_save_image(query: str, filename: str, image_size: str = "1024x1024", save_folder: str = "",
+                            model: str = "dall-e-3", use_cache: bool = True) -> None:
     """
     Generates an image based on the user's query or request using OpenAI's DALL-E model and saves it to disk.
 
+    Images are looked up in the shared content-addressed cache (keyed on prompt, model and size) first,
+    and newly generated images are stored there for later runs.
+
     :param query: A natural language description of the image to be generated.
     :param filename: The name of the file to save the image as.
     :param image_size: The size of the image to be generated. (default is "1024x1024")
+    :param model: The image model to use. (default is "dall-e-3")
+    :param use_cache: Whether to read from and write to the image cache. (default is True)
     :return: The filename of the saved image.
     """
     # 获取当前脚本所在目录
@@ -150,32 +636,44 @@ def generate_and_save_image(query: str, filename: str, image_size: str = "1024x1
     # 指定保存文件的目录
     dataset_dir = os.path.join(current_dir, '..', save_folder)
     # os.makedirs(dataset_dir, exist_ok=True)  # Create the directory if it doesn't exist
+    file_path = Path(os.path.join(dataset_dir, filename))
+
+    # 先查询图片缓存，命中时直接链接到目标位置
+    cache_key = DiskCache.make_key(kind="image", prompt=query, model=model, size=image_size)
+    if use_cache and IMAGE_CACHE.fetch(cache_key, str(file_path)):
+        print(f"Image cache hit for '{filename}'")
+        return str(file_path)
 
-    client = OpenAI(
-        api_key=os.getenv('OPENAI_API_KEY'),
-        base_url=os.getenv('OPENAI_API_BASE'),
-        timeout=60
-    )  # Initialize the OpenAI client
-    response = client.images.generate(model="dall-e-3", prompt=query, n=1, size=image_size)  # Generate images
+    start = time.perf_counter()
+    with TRACER.span("openai.images.generate", "openai", model=model, size=image_size):
+        response = get_openai_client().images.generate(model=model, prompt=query, n=1, size=image_size)  # Generate images
+    generate_latency = time.perf_counter() - start
 
     # Check if the response is successful
     if response.data:
         image_data = response.data[0]
-        file_path = Path(os.path.join(dataset_dir, filename))
 
         img_url = image_data.url
-        img_response = requests.get(img_url)
-        if img_response.status_code == 200:
-            # Write the binary content to a file
-            with open(file_path, "wb") as img_file:
-                img_file.write(img_response.content)
-                return str(file_path)
+        # Stream the image to disk and rename it into place once complete
+        download = download_file(img_url, str(file_path))
+        if download is not None:
+            print(f"Image '{filename}': generate {generate_latency:.2f}s, download {download['bytes'] / 1024:.0f} KiB "
+                  f"in {download['elapsed_s']:.2f}s (first byte {download['first_byte_s']:.2f}s, "
+                  f"{download['throughput_kib_s']:.0f} KiB/s)")
+            if use_cache:
+                IMAGE_CACHE.put(str(file_path), cache_key)
+            return str(file_path)
         else:
             print(f"Failed to download the image from {img_url}")
     else:
         print("No image data found in the response!")
 
 
+def clean_subtitle_text(text):
+    # 去掉所有引号，字幕行和按段落合成的文本都以去掉引号后的文本为准
+    return text.replace('"', '').replace("'", "").replace('”', '').replace("“", "").replace('’', '').replace("‘", "")
+
+
 def process_and_write_text(file, text, base_file_name, output_dir):
     """
     处理文本并将其写入一系列新文件中。
@@ -189,9 +687,13 @@ def process_and_write_text(file, text, base_file_name, output_dir):
         原始文件的基本名称。
     output_dir : str
         输出文件的目录。
+
+    返回:
+    list
+        由 (行号, 字幕文本) 组成的列表。
     """
     # 去掉所有引号
-    text = text.replace('"', '').replace("'", "").replace('”', '').replace("“", "").replace('’', '').replace("‘", "")
+    text = clean_subtitle_text(text)
 
     # 使用正则表达式匹配所有标点符号
     punctuation_pattern = r'[，。！？,.;!?]'
@@ -200,6 +702,7 @@ def process_and_write_text(file, text, base_file_name, output_dir):
     # 分割文本
     start = 0
     line_number = 1
+    lines = []
     while start < len(text):
         end = min(start + 21, len(text))
         line = text[start:end]
@@ -226,7 +729,9 @@ def process_and_write_text(file, text, base_file_name, output_dir):
         with open(new_file_path, 'w', encoding='utf-8') as new_file:
             new_file.write(line + '\n')
 
+        lines.append((line_number, line))
         line_number += 1
+    return lines
 
 
 def create_text_files(sentences, save_folder):
@@ -237,6 +742,10 @@ def create_text_files(sentences, save_folder):
     参数:
     sentences : dict
         一个字典，键为描述性文本（如'sentence_1'），值为要写入文件的内容。
+
+    返回:
+    dict
+        段落编号到 [(行号, 字幕文本), ...] 的映射，用于创建 SegmentIndex。
     """
     current_file_path = os.path.abspath(__file__)
     current_dir = os.path.dirname(current_file_path)
@@ -246,162 +755,407 @@ def create_text_files(sentences, save_folder):
     os.makedirs(file_path, exist_ok=True)
 
     # 创建文件并将内容写入
+    paragraphs = {}
     for i, (key, value) in enumerate(sentences.items(), start=1):
         # 格式化文件名
         base_file_name = f"0{i:02d}_subtitle"
 
         # 处理文本并写入新文件
         with open(os.devnull, 'w', encoding='utf-8') as dummy_file:
-            process_and_write_text(dummy_file, value, base_file_name, file_path)
+            paragraphs[i] = process_and_write_text(dummy_file, value, base_file_name, file_path)
 
     print("所有 subtitles 文件已创建并写入内容。")
+    return paragraphs
 
 
-def create_video_for_title(data_folder):
-    # 加载第一个图像、字幕和音频文件
-    first_image_path = os.path.join(data_folder, "001_picture_prompt.png")
-    first_subtitle_path = os.path.join(data_folder, "title.txt")
-    first_audio_path = os.path.join(data_folder, "title.mp3")
-    bling_audio_path = os.path.join(data_folder, "../../music/bling.mp3")
+def write_videofile(clip, output_file, profile=None, subtitles=None, rescale=True, **kwargs):
+    """
+    带计时的 clip.write_videofile，记录媒体时长和编码帧率。
+
+    参数:
+    profile : RenderProfile
+        渲染配置（分辨率、帧率和编码器设置），见 render_profile。
+    subtitles : str
+        ASS 字幕文件，由 ffmpeg 在编码时烧录到画面上。
+    rescale : bool
+        为 False 时不按配置缩放画面（输入已经是该配置渲染的视频）。
+    """
+    profile = render_profile(profile)
+    kwargs = {**profile.write_kwargs(), **kwargs}
+    filters = [profile.scale_filter() if rescale else None]
+    if subtitles is not None:
+        filters.append(subtitle_filter(subtitles, subtitle_fonts_dir()))
+    filters = [value for value in filters if value]
+    if filters:
+        kwargs["ffmpeg_params"] = ["-vf", ",".join(filters)] + list(kwargs.get("ffmpeg_params") or [])
+    with TRACER.span("moviepy.write_videofile", "encode", output=os.path.basename(output_file),
+                     media_s=clip.duration, profile=profile.name) as span:
+        start = time.perf_counter()
+        clip.write_videofile(output_file, **kwargs)
+        span["encode_fps"] = clip.duration * kwargs.get("fps", getattr(clip, "fps", None) or 24) / (time.perf_counter() - start)
+    return output_file
+
+
+def close_clip(clip):
+    """
+    关闭 clip 以及它引用的音频、遮罩和子片段中打开的读取器（ffmpeg 子进程和管道）。
 
-    # 加载第一个图像
-    first_image = ImageClip(first_image_path)
+    moviepy 的 close 不会递归：CompositeVideoClip 不关闭其中的片段，CompositeAudioClip 不关闭其中的音频，
+    写完视频后不调用这里，AudioFileClip 的读取进程要等垃圾回收才会结束。
+    """
+    pending = [clip]
+    seen = set()
+    while pending:
+        item = pending.pop()
+        if item is None or id(item) in seen:
+            continue
+        seen.add(id(item))
+        # 先收集引用，CompositeVideoClip.close 会把 audio 置为 None
+        pending.extend(getattr(item, "clips", None) or [])
+        pending.append(getattr(item, "audio", None))
+        pending.append(getattr(item, "mask", None))
+        item.close()
+
+
+def title_audio_path(data_folder):
+    # 标题配音优先使用无损的 title.wav，旧目录中只有 title.mp3
+    wav_path = os.path.join(data_folder, "title.wav")
+    return wav_path if os.path.exists(wav_path) else os.path.join(data_folder, "title.mp3")
+
+
+def title_audio(data_folder):
+    """
+    用音频引擎解码片头音频（标题配音加 bling.mp3），返回 PCM。
+    """
+    return concat_pcm(decode_many([title_audio_path(data_folder),
+                                   os.path.join(data_folder, "../../music/bling.mp3")]))
 
-    # 加载第一个音频文件并获取其时长
-    first_audio = AudioFileClip(first_audio_path)
-    first_audio_duration = first_audio.duration
 
-    # 加载 bling 音频文件并获取其时长
-    bling_audio = AudioFileClip(bling_audio_path)
-    bling_audio_duration = bling_audio.duration
+def title_duration(data_folder):
+    """
+    只读文件头得到片头时长（标题配音加 bling.mp3），不解码音频。
+    """
+    return probe_duration(title_audio_path(data_folder)) + probe_duration(
+        os.path.join(data_folder, "../../music/bling.mp3"))
 
-    # 拼接音频文件
-    combined_audio = concatenate_audioclips([first_audio, bling_audio])
 
-    # 加载第一个字幕文件并创建TextClip
+def read_title_text(data_folder):
+    """
+    读取 title.txt 中的标题，文件不存在时返回 None。
+    """
+    title_path = os.path.join(data_folder, "title.txt")
     try:
-        with open(first_subtitle_path, 'r', encoding='utf-8') as file:
-            first_subtitle_text = file.read().strip()  # 去除空白字符
-            if not first_subtitle_text:  # 如果文件为空
-                raise ValueError(f"No text found in subtitle file {first_subtitle_path}")
-
-            # 设置字幕样式
-            # 使用默认字体
-            font_path = "C:/Windows/Fonts/HGY4_CNKI.TTF"
-            first_subtitle = TextClip(first_subtitle_text, fontsize=100, color='black', bg_color='white', font=font_path, stroke_color='white', stroke_width=2)  # 改变颜色和字体
-
-            # 设置字幕位置为屏幕中心
-            video_width, video_height = first_image.size
-            first_subtitle = first_subtitle.set_position(('center', 'center'))
-
-            # 设置字幕持续时间
-            # 注意：这里我们将字幕持续时间设置为两个音频文件的总和
-            total_audio_duration = first_audio_duration + bling_audio_duration
-            first_subtitle = first_subtitle.set_duration(total_audio_duration)
-
-            # 设置第一个图像的持续时间与音频相同
-            first_image = first_image.set_duration(total_audio_duration)
-
-            # 合并图像片段和字幕
-            first_clip = CompositeVideoClip([first_image, first_subtitle])
-
-            # 设置第一个片段的音频
-            first_clip = first_clip.set_audio(combined_audio)
-
-            # 导出最终的视频，并在这里指定 fps
-            output_file = f"./{data_folder}/title_video.mp4"
-            first_clip.write_videofile(output_file, fps=24, codec='libx264', audio_codec='aac')
-            print("title_video.mp4 has been generated!\n")
+        with open(title_path, 'r', encoding='utf-8') as file:
+            title_text = file.read().strip()  # 去除空白字符
     except FileNotFoundError:
-        print(f"Subtitle file {first_subtitle_path} or audio file {first_audio_path} not found.")
+        print(f"Subtitle file {title_path} not found.")
+        return None
+    if not title_text:  # 如果文件为空
+        raise ValueError(f"No text found in subtitle file {title_path}")
+    return title_text
 
 
-def create_video_from_images_audio(data_folder):
-    # 获取所有图片文件名
-    image_files = sorted([f for f in os.listdir(data_folder) if f.endswith("_picture_prompt.png")])
+def image_size(image_path):
+    # 只读取图片头部得到分辨率，不解码像素
+    with Image.open(image_path) as image:
+        return image.size
 
-    # 创建一个列表来保存所有的图像片段
-    clips = []
-    # 创建一个列表来保存所有的音频片段
-    audios = []
 
-    for img_file in image_files:
-        # 获取图片的基本名称(如: 001)
-        base_name = img_file.split('_')[0]
-        image_path = os.path.join(data_folder, img_file)
+def subtitle_track(data_folder):
+    """
+    创建与正文图片分辨率一致的 ASS 字幕轨；ffmpeg 不支持 subtitles 滤镜时返回 None，退回 TextClip 合成。
+    """
+    if not has_filter("subtitles"):
+        return None
+    return SubtitleTrack(*image_size(os.path.join(data_folder, "001_picture_prompt.png")))
 
-        # 获取所有与该图片对应的字幕和配音
-        subtitle_files = sorted([f for f in os.listdir(data_folder) if f.startswith(base_name) and '_subtitle_' in f and f.endswith(".txt")])
-        audio_files = sorted([f for f in os.listdir(data_folder) if f.startswith(base_name) and f.endswith(".mp3")])
 
-        # 加载图片并初始化视频片段
-        img_clip = ImageClip(image_path)
-        img_clips = []
+def build_title_clip(data_folder, duration=None, subtitles=None, scale=1.0):
+    """
+    构建片头片段：第一张图片、居中的标题字幕、标题配音加 bling.mp3 的音频。
+    找不到 title.txt 时返回 None。
 
-        for subtitle_file, audio_file in zip(subtitle_files, audio_files):
-            # 加载音频
-            audio_path = os.path.join(data_folder, audio_file)
-            audio = AudioFileClip(audio_path)
-            duration = audio.duration
+    参数:
+    duration : float
+        已知片头时长时（音频由音频引擎单独处理）不再加载音频，返回不带音频的片段。
+    subtitles : SubtitleTrack
+        不为 None 时标题写入该字幕轨、由 ffmpeg 烧录，不再用 TextClip 合成到画面上。
+    scale : float
+        从 FrameStore 读取按该比例缩放好的画面。
+    """
+    # 加载第一个图像、字幕和音频文件
+    first_image_path = os.path.join(data_folder, "001_picture_prompt.png")
+    first_audio_path = title_audio_path(data_folder)
+    bling_audio_path = os.path.join(data_folder, "../../music/bling.mp3")
 
-            # 创建图像片段并设置其持续时间为音频的时长
-            clip = img_clip.set_duration(duration)
+    # 先读取标题，没有标题时不打开任何图像和音频读取器
+    first_subtitle_text = read_title_text(data_folder)
+    if first_subtitle_text is None:
+        return None
 
-            # 加载字幕文件并创建TextClip
-            subtitle_path = os.path.join(data_folder, subtitle_file)
-            try:
-                with open(subtitle_path, 'r', encoding='utf-8') as file:
-                    subtitle_text = file.read().strip()
-                    if not subtitle_text:
-                        raise ValueError(f"No text found in subtitle file {subtitle_file}")
+    # 加载第一个图像：内存映射帧存储中已解码的画面，不再解码 PNG
+    first_image = ImageClip(FrameStore(data_folder).load(first_image_path, scale))
 
-                    # 设置字幕样式
-                    font_path = "C:/Windows/Fonts/HGY4_CNKI.TTF"
-                    subtitle = TextClip(subtitle_text, fontsize=50, color='yellow', font=font_path,
-                                        stroke_color='black', stroke_width=2)
-                    subtitle = subtitle.set_duration(duration)
+    combined_audio = None
+    if duration is None:
+        # 加载第一个音频文件并获取其时长
+        first_audio = AudioFileClip(first_audio_path)
+        first_audio_duration = first_audio.duration
 
-                    # 设置字幕位置为距离顶部20%
-                    video_height = clip.size[1]
-                    subtitle = subtitle.set_position(('center', video_height * 0.9))
+        # 加载 bling 音频文件并获取其时长
+        bling_audio = AudioFileClip(bling_audio_path)
+        bling_audio_duration = bling_audio.duration
 
-                    # 合并图像片段和字幕
-                    clip = CompositeVideoClip([clip, subtitle])
+        # 拼接音频文件
+        combined_audio = concatenate_audioclips([first_audio, bling_audio])
+        duration = first_audio_duration + bling_audio_duration
 
-                    img_clips.append(clip)
-                    audios.append(audio)
-            except FileNotFoundError:
-                print(f"Subtitle file {subtitle_file} not found.")
-                continue
+    # 设置第一个图像的持续时间与音频相同
+    first_image = first_image.set_duration(duration)
+    if subtitles is not None:
+        subtitles.add_title(first_subtitle_text, duration)
+        return first_image.set_audio(combined_audio) if combined_audio is not None else first_image
 
-        # 合并当前图片的所有字幕片段
-        if img_clips:
-            final_img_clip = concatenate_videoclips(img_clips)
-            clips.append(final_img_clip)
+    # 设置字幕样式
+    # 使用默认字体
+    font_path = subtitle_font()
+    with TRACER.span("imagemagick.text", "render", chars=len(first_subtitle_text)):
+        first_subtitle = TextClip(first_subtitle_text, fontsize=100, color='black', bg_color='white', font=font_path, stroke_color='white', stroke_width=2)  # 改变颜色和字体
 
-    # 合并所有音频片段
-    final_audio = concatenate_audioclips(audios)
+    # 设置字幕位置为屏幕中心
+    first_subtitle = first_subtitle.set_position(('center', 'center'))
 
-    # 加载背景音乐
-    bgm_path = os.path.join(data_folder, '../../music/background_music.mp3')
-    bgm = AudioFileClip(bgm_path)
+    # 设置字幕持续时间
+    # 注意：这里我们将字幕持续时间设置为两个音频文件的总和
+    first_subtitle = first_subtitle.set_duration(duration)
 
-    # 调整背景音乐的长度以匹配视频长度
-    bgm = bgm.subclip(0, final_audio.duration)
+    # 合并图像片段和字幕
+    first_clip = CompositeVideoClip([first_image, first_subtitle])
 
-    # 将背景音乐与音频混合
-    final_audio_with_bgm = CompositeAudioClip([final_audio, bgm.volumex(0.5)])  # 减小背景音乐音量
+    # 设置第一个片段的音频
+    return first_clip.set_audio(combined_audio) if combined_audio is not None else first_clip
+
+
+def create_video_for_title(data_folder, still_frames=False, profile=None):
+    """
+    生成片头视频 title_video.mp4。still_frames 为 True 时把第一张图片和标题字幕轨直接交给 ffmpeg 编码。
+    profile 为 preview 等非正式配置时输出 title_video_<配置名>.mp4，见 render_profile。
+    """
+    profile = render_profile(profile)
+    output_file = f"./{data_folder}/{profile.output_name('title_video.mp4')}"
+    if still_frames:
+        _render_title_segment(data_folder, output_file, profile)
+        print(f"{os.path.basename(output_file)} has been generated!\n")
+        return output_file
+
+    # 烧录字幕时直接使用按配置缩放好的画面；TextClip 合成的字幕按原图尺寸设计，只能先合成再缩放
+    track = subtitle_track(data_folder)
+    scale = profile.scale if track is not None else 1.0
+    first_clip = build_title_clip(data_folder, subtitles=track, scale=scale)
+    if first_clip is None:
+        return
+
+    # 导出最终的视频，并在这里指定 fps
+    subtitles = track.save(f"{output_file}.ass") if track is not None else None
+    try:
+        write_videofile(first_clip, output_file, profile, subtitles=subtitles, rescale=scale == 1.0)
+    finally:
+        close_clip(first_clip)
+    print(f"{os.path.basename(output_file)} has been generated!\n")
+    return output_file
+
+
+def make_subtitle_clip(subtitle_text, duration, video_height):
+    # 设置字幕样式
+    font_path = subtitle_font()
+    with TRACER.span("imagemagick.text", "render", chars=len(subtitle_text)):
+        subtitle = TextClip(subtitle_text, fontsize=50, color='yellow', font=font_path,
+                            stroke_color='black', stroke_width=2)
+    subtitle = subtitle.set_duration(duration)
+
+    # 设置字幕位置为距离顶部90%
+    return subtitle.set_position(('center', video_height * 0.9))
+
+
+def background_music_path(data_folder):
+    return os.path.join(data_folder, '../../music/background_music.mp3')
+
+
+def build_main_clip(data_folder, subtitles=None, scale=1.0, segments=None, bgm_offset=0.0, audio_path=None):
+    """
+    构建正文片段：每张图片配合其字幕行和配音，并混入背景音乐。
+
+    参数:
+    subtitles : SubtitleTrack
+        不为 None 时字幕行依次写入该字幕轨、由 ffmpeg 烧录，画面中只有图片。
+    scale : float
+        从 FrameStore 读取按该比例缩放好的画面。
+    segments : list
+        只构建这些字幕行（如一个段落），默认为 segments.json 中的全部字幕行。
+    bgm_offset : float
+        这些字幕行在正文中的起始时间，用于截取对应位置的背景音乐。
+    audio_path : str
+        混音后的 WAV 写到这里，默认为 frames/main_audio.wav。
+    """
+    # 创建一个列表来保存所有的图像片段
+    clips = []
+    # 同一张图片只加载一次，画面来自内存映射的帧存储
+    image_clips = {}
+    store = FrameStore(data_folder)
+
+    # 每个配音只解码一次，时长由采样数精确得到
+    segments = list(segments if segments is not None else SegmentIndex.load(data_folder))
+    narration = decode_many([seg.audio_path for seg in segments])
+
+    for seg, pcm in zip(segments, narration):
+        duration = len(pcm) / MIX_RATE
+
+        # 创建图像片段并设置其持续时间为音频的时长
+        if seg.image_path not in image_clips:
+            image_clips[seg.image_path] = ImageClip(store.load(seg.image_path, scale))
+        clip = image_clips[seg.image_path].set_duration(duration)
+
+        if subtitles is not None:
+            subtitles.add(seg.text, duration)
+            clips.append(clip)
+            continue
+
+        # 合并图像片段和字幕
+        subtitle = make_subtitle_clip(seg.text, duration, clip.size[1])
+        clips.append(CompositeVideoClip([clip, subtitle]))
+
+    # 合并所有音频片段，混入背景音乐后写成一个 WAV，moviepy 只需打开一个音频读取器
+    if audio_path is None:
+        frames_dir = os.path.join(data_folder, "frames")
+        os.makedirs(frames_dir, exist_ok=True)
+        audio_path = os.path.join(frames_dir, "main_audio.wav")
+    write_wav(audio_path, mix_background(concat_pcm(narration), background_music_path(data_folder), offset=bgm_offset))
 
     # 合并所有图像片段到一个视频中
     final_clip = concatenate_videoclips(clips, method="compose")
-    final_clip = final_clip.set_audio(final_audio_with_bgm)  # 设置音频
+    return final_clip.set_audio(AudioFileClip(audio_path))  # 设置音频
+
+
+def prepare_frames(data_folder, scales=None):
+    """
+    帧存储阶段：把所有配图按各渲染配置的分辨率各解码、缩放一次，写入 FrameStore，返回帧文件路径列表。
+    之后的片头、正文和各段落渲染直接读取这些原始帧，不再解码 PNG。
+
+    参数:
+    scales : list
+        缩放比例，默认为 RENDER_PROFILES 中出现的所有比例。
+    """
+    scales = scales or sorted({profile.scale for profile in RENDER_PROFILES.values()})
+    store = FrameStore(data_folder)
+    images = SegmentIndex.load(data_folder).images()
+    store.ensure(images, scales)
+    return list(dict.fromkeys(store.path(image_path, store.size(image_path, scale))
+                              for image_path in images for scale in scales))
+
+
+def _add_still(frames, image_path, duration):
+    # 连续使用同一张图片的字幕行合并为一个静帧，字幕由字幕轨负责切换
+    if frames and frames[-1][0] == image_path:
+        frames[-1] = (image_path, frames[-1][1] + duration)
+    else:
+        frames.append((image_path, duration))
+
+
+def render_video_from_stills(data_folder, output_path, include_title=True, profile=None):
+    """
+    静态画面快速渲染：FrameStore 中按配置缩放好的画面直接作为静帧，字幕按配音时长生成 ASS 字幕轨，
+    静帧、字幕轨和完整音轨交给 ffmpeg 一次编码，字幕在同一次编码中烧录，不再在 Python 中合成画面。
+    include_title 为 False 时只渲染正文；profile 见 render_profile。
+    """
+    profile = render_profile(profile)
+    frames_dir = os.path.join(data_folder, "frames")
+    os.makedirs(frames_dir, exist_ok=True)
+
+    frames = []
+    audio_parts = []
+    track = SubtitleTrack(*image_size(os.path.join(data_folder, "001_picture_prompt.png")))
+
+    # 先根据文件头中的时长规划整条时间线，静帧和字幕轨不依赖解码结果
+    title_text = read_title_text(data_folder) if include_title else None
+    index = SegmentIndex.load(data_folder)
+    timeline = index.plan(title_duration(data_folder) if title_text is not None else 0.0)
+
+    # 片头：第一张图片加居中的标题
+    if title_text is not None:
+        track.add_title(title_text, timeline.title[1])
+        frames.append((os.path.join(data_folder, "001_picture_prompt.png"), timeline.title[1]))
+        audio_parts.append(title_audio(data_folder))
+
+    # 正文：每行字幕一个区间，连续使用同一张图片的行合并为一个静帧
+    for seg, start, end in timeline.intervals:
+        track.add(seg.text, end - start)
+        _add_still(frames, seg.image_path, end - start)
+
+    # 完整音轨：片头音频 + 混入背景音乐的正文旁白，按顺序写入一个 WAV；每个配音只解码一次
+    narration = decode_many(index.audio_files())
+    audio_parts.append(mix_background(concat_pcm(narration), background_music_path(data_folder)))
+    audio_path = write_wav(os.path.join(frames_dir, "audio.wav"), audio_parts)
+
+    # 每张配图只解码、缩放一次，静帧使用帧存储中的原始帧
+    store = FrameStore(data_folder)
+    store.ensure([image_path for image_path, _ in frames], (profile.scale,))
+    frame_size = store.size(frames[0][0], profile.scale)
+    frames = [(store.path(image_path, frame_size), duration) for image_path, duration in frames]
+
+    subtitles = track.save(os.path.join(frames_dir, "subtitles.ass"))
+    encode_stills(frames, audio_path, output_path, profile, subtitles=subtitles, fonts_dir=subtitle_fonts_dir(),
+                  frame_size=frame_size)
+    return output_path
+
+
+def create_video_from_images_audio(data_folder, still_frames=False, workers=1, profile=None, streaming=False):
+    """
+    生成正文视频 main_video.mp4。
+
+    参数:
+    still_frames : bool
+        为 True 时使用静态画面快速渲染，需与片头使用相同的设置才能流复制拼接。
+    workers : int
+        使用静态画面渲染时，大于 1 则按段落在进程池中并行编码。
+    profile : RenderProfile
+        渲染配置，非正式配置输出 main_video_<配置名>.mp4，见 render_profile。
+    streaming : bool
+        不使用静态画面渲染时，为 True 则逐段落构建、写出并释放 clips（见 render_video_streaming），
+        内存占用不随段落数增长。
+    """
+    profile = render_profile(profile)
+    output_file = f"./{data_folder}/{profile.output_name('main_video.mp4')}"
+    if still_frames and workers > 1:
+        render_video_parallel(data_folder, output_file, max_workers=workers, include_title=False, profile=profile)
+        return output_file
+    if still_frames:
+        render_video_from_stills(data_folder, output_file, include_title=False, profile=profile)
+        return output_file
+    if streaming:
+        render_video_streaming(data_folder, output_file, include_title=False, profile=profile)
+        return output_file
+
+    track = subtitle_track(data_folder)
+    scale = profile.scale if track is not None else 1.0
+    final_clip = build_main_clip(data_folder, subtitles=track, scale=scale)
 
     # 导出最终的视频，并在这里指定 fps
-    output_file = f"./{data_folder}/main_video.mp4"
-    final_clip.write_videofile(output_file, fps=24, codec='libx264', audio_codec='aac')
+    subtitles = track.save(f"{output_file}.ass") if track is not None else None
+    try:
+        write_videofile(final_clip, output_file, profile, subtitles=subtitles, rescale=scale == 1.0)
+    finally:
+        close_clip(final_clip)
+    return output_file
 
 
-def merge_videos(video1_path, video2_path, output_path):
+def merge_videos(video1_path, video2_path, output_path, stream_copy=True, profile=None):
+    """
+    合并两个视频。默认以流复制方式拼接，不重新编码；两个视频必须使用相同的编码参数（同一个渲染配置）。
+    stream_copy 为 False 时退回到 moviepy 解码后按 profile 的编码器设置重新编码，不再缩放。
+    """
+    if stream_copy:
+        return concat_copy([video1_path, video2_path], output_path)
+
     # 加载第一个视频
     video1 = VideoFileClip(video1_path)
 
@@ -412,7 +1166,309 @@ def merge_videos(video1_path, video2_path, output_path):
     final_video = concatenate_videoclips([video1, video2])
 
     # 导出最终的视频
-    final_video.write_videofile(output_path, codec='libx264', audio_codec='aac')
+    try:
+        write_videofile(final_video, output_path, profile, rescale=False, fps=final_video.fps)
+    finally:
+        close_clip(final_video)
+    return output_path
+
+
+def _render_title_segment(data_folder, output_path, profile=None):
+    """
+    在工作进程中把片头渲染为独立的视频片段，返回编码耗时（秒）。
+    """
+    start = time.perf_counter()
+    with TRACER.span("render.segment", "render", segment="title") as span:
+        _write_title_segment(data_folder, output_path, span, profile)
+    return time.perf_counter() - start
+
+
+def _write_title_segment(data_folder, output_path, span, profile):
+    profile = render_profile(profile)
+    title_pcm = title_audio(data_folder)
+    duration = len(title_pcm) / MIX_RATE
+    span["media_s"] = duration
+    image_path = os.path.join(data_folder, "001_picture_prompt.png")
+    # 中间文件放在 frames 目录下，不与成片混在一起
+    frames_dir = os.path.join(data_folder, "frames")
+    os.makedirs(frames_dir, exist_ok=True)
+    audio_path = os.path.join(frames_dir, "title.wav")
+    track = SubtitleTrack(*image_size(image_path))
+    track.add_title(read_title_text(data_folder), duration)
+    subtitles = track.save(os.path.join(frames_dir, "title.ass"))
+    write_wav(audio_path, title_pcm)
+    frame_path, frame_size = FrameStore(data_folder).frame(image_path, profile.scale)
+    encode_stills([(frame_path, duration)], audio_path, output_path, profile, subtitles=subtitles,
+                  fonts_dir=subtitle_fonts_dir(), frame_size=frame_size)
+
+
+def _render_paragraph_segment(data_folder, image_path, lines, bgm_offset, output_path, profile=None):
+    """
+    在工作进程中把一个段落（一张图片及其所有字幕行和配音）渲染为独立的视频片段，返回编码耗时（秒）。
+
+    参数:
+    lines : list
+        由 (字幕文本, 配音路径) 组成的列表。
+    bgm_offset : float
+        该段落在正文中的起始时间，用于截取对应位置的背景音乐。
+    profile : RenderProfile
+        渲染配置，见 render_profile。
+    """
+    start = time.perf_counter()
+    with TRACER.span("render.segment", "render", segment=os.path.basename(image_path), lines=len(lines)) as span:
+        _write_paragraph_segment(data_folder, image_path, lines, bgm_offset, output_path, span, profile)
+    return time.perf_counter() - start
+
+
+def _write_paragraph_segment(data_folder, image_path, lines, bgm_offset, output_path, span, profile):
+    profile = render_profile(profile)
+    # 整个段落只有一张图片，作为一个静帧；各行字幕按配音时长写入字幕轨
+    track = SubtitleTrack(*image_size(image_path))
+    narration = decode_many([audio_path for _, audio_path in lines])
+    for (subtitle_text, _), pcm in zip(lines, narration):
+        track.add(subtitle_text, len(pcm) / MIX_RATE)
+
+    span["audio_s"] = track.position
+    audio_path = f"{output_path}.wav"
+    write_wav(audio_path, mix_background(concat_pcm(narration), background_music_path(data_folder), offset=bgm_offset))
+    subtitles = track.save(f"{output_path}.ass")
+    frame_path, frame_size = FrameStore(data_folder).frame(image_path, profile.scale)
+    encode_stills([(frame_path, track.position)], audio_path, output_path, profile, subtitles=subtitles,
+                  fonts_dir=subtitle_fonts_dir(), frame_size=frame_size)
+
+
+def process_pool(max_workers=None):
+    """
+    创建渲染用的进程池。调用方此时通常已有线程在运行（语音合成、下载图片、TRACER 等），
+    fork 出的子进程可能继承被其他线程持有的锁而死锁，因此使用 forkserver 启动工作进程，
+    不支持 forkserver 的平台（Windows）使用 spawn。
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                               mp_context=multiprocessing.get_context(method))
+
+
+def _traced_call(fn, *args):
+    """
+    在工作进程中调用 fn，并把期间记录的 trace 事件一起返回给主进程。
+    """
+    mark = TRACER.mark()
+    result = fn(*args)
+    return result, TRACER.events_since(mark)
+
+
+def render_segment(executor, data_folder, output_path, image_path=None, lines=None, bgm_offset=0.0, profile=None):
+    """
+    在进程池 executor 中渲染片头（image_path 为 None）或一个段落的视频片段，
+    等待完成并把工作进程记录的 trace 事件合并到主进程，返回编码耗时（秒）。
+    参数含义见 _render_paragraph_segment。
+    """
+    profile = render_profile(profile)
+    if image_path is None:
+        future = executor.submit(_traced_call, _render_title_segment, data_folder, output_path, profile)
+    else:
+        future = executor.submit(_traced_call, _render_paragraph_segment, data_folder, image_path, lines, bgm_offset,
+                                 output_path, profile)
+    elapsed, events = future.result()
+    TRACER.extend(events)
+    return elapsed
+
+
+def render_video_parallel(data_folder, output_path, max_workers=None, include_title=True, profile=None):
+    """
+    按段落并行渲染：片头和每个段落分别在进程池中编码为独立片段，最后流复制拼接。
+
+    参数:
+    max_workers : int
+        进程池大小，默认为 CPU 核数。
+    include_title : bool
+        为 False 时只渲染正文。
+    profile : RenderProfile
+        渲染配置，非正式配置的片段放在 segments_<配置名> 目录下，见 render_profile。
+    """
+    profile = render_profile(profile)
+    segments_dir = os.path.join(data_folder, f"segments{profile.suffix}")
+    os.makedirs(segments_dir, exist_ok=True)
+
+    # 按段落分组，并根据索引中的配音时长规划时间线，得到每个段落截取背景音乐的位置
+    index = SegmentIndex.load(data_folder)
+    timeline = index.plan()
+
+    tasks = []
+    for i, (paragraph, segments) in enumerate(index.paragraphs().items(), start=1):
+        image_path = segments[0].image_path
+        start, end = timeline.paragraphs[paragraph]
+        lines = [(seg.text, seg.audio_path) for seg in segments]
+        tasks.append((os.path.basename(image_path), end - start, image_path, lines, timeline.bgm_offset(paragraph),
+                      os.path.join(segments_dir, f"{i:03d}.mp4")))
+
+    title_path = os.path.join(segments_dir, "000_title.mp4")
+    timings = {}
+    with process_pool(max_workers) as executor:
+        futures = {}
+        if include_title:
+            futures[executor.submit(_traced_call, _render_title_segment, data_folder, title_path,
+                                    profile)] = ("title", None)
+        for name, duration, image_path, lines, offset, segment_path in tasks:
+            future = executor.submit(_traced_call, _render_paragraph_segment, data_folder, image_path, lines, offset,
+                                     segment_path, profile)
+            futures[future] = (name, duration)
+        for future in as_completed(futures):
+            elapsed, events = future.result()
+            TRACER.extend(events)
+            timings[futures[future][0]] = (futures[future][1], elapsed)
+
+    segment_paths = [task[-1] for task in tasks]
+    concat_copy([title_path] + segment_paths if include_title else segment_paths, output_path)
+
+    # 输出每个片段的耗时报告
+    print("segment render timings:")
+    for name, (duration, elapsed) in sorted(timings.items(), key=lambda item: item[0] != "title"):
+        media = f"{duration:7.2f}s media" if duration is not None else " " * 13
+        print(f"  {name:<28} {media} {elapsed:7.2f}s wall")
+    return output_path
+
+
+def _write_streaming_segment(clip, output_path, profile, track, scale, span):
+    # 写出一个片段后立即关闭其中所有读取器，并记录写完后的资源占用
+    try:
+        span["media_s"] = clip.duration
+        subtitles = track.save(f"{output_path}.ass") if track is not None else None
+        write_videofile(clip, output_path, profile, subtitles=subtitles, rescale=scale == 1.0)
+    finally:
+        close_clip(clip)
+        # moviepy 的 clip 之间有循环引用，内存映射的画面（mmap 持有一个文件描述符）要等循环回收才释放
+        del clip
+        gc.collect()
+    span.update(resource_usage())
+    return output_path
+
+
+def render_video_streaming(data_folder, output_path, include_title=True, profile=None):
+    """
+    内存有界的逐段渲染：片头和每个段落依次用 moviepy 构建为一个小片段、写出后立即关闭其中的图像、
+    音频读取器和 ffmpeg 进程，再构建下一段，最后流复制拼接。
+
+    整条时间线的 clips 不会同时存在，峰值内存和打开的文件描述符数只取决于最大的一个段落，
+    与故事的段落数无关。每个片段的 render.segment 事件记录写完后的 rss_mb、peak_rss_mb 和 open_fds，
+    结束时打印每段的资源报告。
+
+    参数:
+    include_title : bool
+        为 False 时只渲染正文。
+    profile : RenderProfile
+        渲染配置，片段放在 stream_segments 目录下（非正式配置带配置名后缀），见 render_profile。
+    """
+    profile = render_profile(profile)
+    segments_dir = os.path.join(data_folder, f"stream_segments{profile.suffix}")
+    os.makedirs(segments_dir, exist_ok=True)
+
+    index = SegmentIndex.load(data_folder)
+    timeline = index.plan()
+    # 烧录字幕时直接使用按配置缩放好的画面；TextClip 合成的字幕按原图尺寸设计，只能先合成再缩放
+    scale = profile.scale if has_filter("subtitles") else 1.0
+
+    segment_paths = []
+    report = []
+    with TRACER.span("render.streaming", "render", segments=0, **resource_usage()) as total:
+        if include_title:
+            title_path = os.path.join(segments_dir, "000_title.mp4")
+            with TRACER.span("render.segment", "render", segment="title", mode="streaming") as span:
+                track = subtitle_track(data_folder)
+                clip = build_title_clip(data_folder, subtitles=track, scale=scale)
+                if clip is not None:
+                    segment_paths.append(_write_streaming_segment(clip, title_path, profile, track, scale, span))
+                    report.append(("title", dict(span)))
+
+        for i, (paragraph, segments) in enumerate(index.paragraphs().items(), start=1):
+            segment_path = os.path.join(segments_dir, f"{i:03d}.mp4")
+            name = os.path.basename(segments[0].image_path)
+            with TRACER.span("render.segment", "render", segment=name, lines=len(segments),
+                             mode="streaming") as span:
+                track = subtitle_track(data_folder)
+                clip = build_main_clip(data_folder, subtitles=track, scale=scale, segments=segments,
+                                       bgm_offset=timeline.bgm_offset(paragraph), audio_path=f"{segment_path}.wav")
+                segment_paths.append(_write_streaming_segment(clip, segment_path, profile, track, scale, span))
+            report.append((name, dict(span)))
+
+        concat_copy(segment_paths, output_path)
+        total["segments"] = len(segment_paths)
+        total.update(resource_usage())
+
+    # 输出每个片段写完后的资源占用，各段的 rss 和 fds 应当保持平稳；平台上读不到的指标显示为 n/a
+    def show(value, width, precision=None):
+        if value is None:
+            return f"{'n/a':>{width}}"
+        return f"{value:>{width}.{precision}f}" if precision is not None else f"{value:>{width}}"
+
+    print("streaming segment resources:")
+    for name, usage in report:
+        print(f"  {name:<28} {usage['media_s']:7.2f}s media {show(usage['rss_mb'], 8, 1)} MiB rss "
+              f"{show(usage['peak_rss_mb'], 8, 1)} MiB peak {show(usage['open_fds'], 5)} fds")
+    return output_path
+
+
+def render_video(data_folder, single_encode=True, still_frames=True, workers=1, profile=None, streaming=False):
+    """
+    渲染最终的 merged_video.mp4。
+
+    参数:
+    data_folder : str
+        包含图片、字幕和配音的目录。
+    single_encode : bool
+        为 True 时把片头和正文放在同一条时间线上，只编码一次；
+        为 False 时分别编码 title_video.mp4 和 main_video.mp4，再流复制拼接。
+    still_frames : bool
+        为 True 时使用静态画面快速渲染（见 render_video_from_stills），每个画面只合成一次。
+    workers : int
+        使用静态画面渲染时，大于 1 则按段落在进程池中并行编码（见 render_video_parallel）。
+    profile : RenderProfile
+        渲染配置。preview 以低分辨率、低帧率和最快的编码器设置渲染 merged_video_preview.mp4，
+        复用已生成的图片和配音，用于快速检查节奏和字幕；见 render_profile。
+    streaming : bool
+        不使用静态画面渲染时，为 True 则逐段落构建、写出并释放 clips，见 render_video_streaming。
+    """
+    profile = render_profile(profile)
+    name = profile.output_name("merged_video.mp4")
+    output_path = f"./{data_folder}/{name}"
+    if not single_encode:
+        title_path = create_video_for_title(data_folder, still_frames=still_frames, profile=profile)
+        main_path = create_video_from_images_audio(data_folder, still_frames=still_frames, workers=workers,
+                                                   profile=profile, streaming=streaming)
+        merge_videos(title_path, main_path, output_path)
+        return output_path
+
+    if still_frames and workers > 1:
+        render_video_parallel(data_folder, output_path, max_workers=workers, profile=profile)
+        print(f"{name} has been generated!\n")
+        return output_path
+
+    if still_frames:
+        render_video_from_stills(data_folder, output_path, profile=profile)
+        print(f"{name} has been generated!\n")
+        return output_path
+
+    if streaming:
+        render_video_streaming(data_folder, output_path, profile=profile)
+        print(f"{name} has been generated!\n")
+        return output_path
+
+    # 片头和正文的字幕写入同一条字幕轨，时间线与 clips 一致
+    track = subtitle_track(data_folder)
+    scale = profile.scale if track is not None else 1.0
+    title_clip = build_title_clip(data_folder, subtitles=track, scale=scale)
+    main_clip = build_main_clip(data_folder, subtitles=track, scale=scale)
+    clips = [title_clip, main_clip] if title_clip is not None else [main_clip]
+
+    # 片头和正文在同一条时间线上，整段只编码一次
+    final_clip = concatenate_videoclips(clips)
+    subtitles = track.save(f"{output_path}.ass") if track is not None else None
+    try:
+        write_videofile(final_clip, output_path, profile, subtitles=subtitles, rescale=scale == 1.0)
+    finally:
+        close_clip(final_clip)
+    print(f"{name} has been generated!\n")
+    return output_path
 
 
 if __name__ == '__main__':
@@ -0,0 +1,113 @@
+import os
+
+# 默认的字幕字体，与原先 TextClip 使用的字体相同
+DEFAULT_SUBTITLE_FONT = "C:/Windows/Fonts/HGY4_CNKI.TTF"
+
+# 正文字幕：50 号黄色字、2 像素黑色描边，顶部位于画面高度的 90% 处
+BODY_STYLE = "Body"
+# 片头标题：100 号黑色字、白色底框，居中
+TITLE_STYLE = "Title"
+
+_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+WrapStyle: 2
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: {body},{font},50,&H0000FFFF,&H0000FFFF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,0,8,0,0,0,1
+Style: {title},{font},100,&H00000000,&H00000000,&H00FFFFFF,&H00FFFFFF,0,0,0,0,100,100,0,0,3,2,0,5,0,0,0,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def subtitle_font() -> str:
+    """
+    字幕字体文件的路径，读取环境变量 SUBTITLE_FONT，不设置时使用 DEFAULT_SUBTITLE_FONT。
+    每次调用时读取，.env 在导入本模块之后才加载也能生效。
+    """
+    return os.getenv("SUBTITLE_FONT", DEFAULT_SUBTITLE_FONT)
+
+
+def subtitle_font_name(font_path: str = None) -> str:
+    """
+    返回字体文件中记录的字体族名称（ASS 按名称而不是路径选择字体）；读不到时使用文件名。
+    font_path 为 None 时使用 subtitle_font()。
+    """
+    font_path = font_path or subtitle_font()
+    try:
+        from PIL import ImageFont
+        return ImageFont.truetype(font_path, 10).getname()[0]
+    except (ImportError, OSError):
+        return os.path.splitext(os.path.basename(font_path))[0]
+
+
+def subtitle_fonts_dir(font_path: str = None):
+    # 字体所在目录交给 libass 加载；字体不存在时由 fontconfig 选择替代字体
+    font_path = font_path or subtitle_font()
+    return os.path.dirname(font_path) if os.path.exists(font_path) else None
+
+
+def _timestamp(seconds: float) -> str:
+    centiseconds = int(round(max(seconds, 0.0) * 100))
+    hours, rest = divmod(centiseconds, 360000)
+    minutes, rest = divmod(rest, 6000)
+    return f"{hours}:{minutes:02d}:{rest // 100:02d}.{rest % 100:02d}"
+
+
+def _event_text(text: str) -> str:
+    # 花括号在 ASS 中表示样式覆盖，换成全角字符；换行使用 \N
+    text = text.strip().replace("{", "｛").replace("}", "｝")
+    return text.replace("\r\n", "\n").replace("\n", "\\N")
+
+
+class SubtitleTrack:
+    """
+    按时间排列的 ASS 字幕轨，由已知的配音时长生成，交给 ffmpeg 的 subtitles 滤镜在编码时烧录到画面上。
+
+    参数:
+    width, height : int
+        视频的分辨率，字幕的字号和位置都以此为坐标系，与原先在图片上合成 TextClip 的效果一致。
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = int(width)
+        self.height = int(height)
+        self.events = []
+        self.position = 0.0
+
+    def add(self, text: str, duration: float, style: str = BODY_STYLE) -> None:
+        """
+        在当前时间点追加一条持续 duration 秒的字幕，时间点随之后移。text 为空时只推进时间。
+        """
+        start = self.position
+        self.position += duration
+        if text and text.strip():
+            self.events.append((start, self.position, style, text))
+
+    def add_title(self, text: str, duration: float) -> None:
+        self.add(text, duration, style=TITLE_STYLE)
+
+    def render(self) -> str:
+        lines = [_HEADER.format(width=self.width, height=self.height, body=BODY_STYLE, title=TITLE_STYLE,
+                                font=subtitle_font_name())]
+        for start, end, style, text in self.events:
+            # 正文字幕以顶部中点定位，与 TextClip 的 ('center', 高度 * 0.9) 相同
+            position = "" if style == TITLE_STYLE else f"{{\\pos({self.width / 2:.0f},{self.height * 0.9:.0f})}}"
+            lines.append(f"Dialogue: 0,{_timestamp(start)},{_timestamp(end)},{style},,0,0,0,,{position}"
+                         f"{_event_text(text)}\n")
+        return "".join(lines)
+
+    def save(self, path: str) -> str:
+        """
+        写成 UTF-8 编码的 .ass 文件（先写临时文件再重命名），返回 path。
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(self.render())
+        os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    记录各阶段和外部调用的耗时及指标（重试次数、传输字节数、音频秒数、编码帧率等），
+    可导出为结构化 JSON 和 Chrome/Perfetto 可以打开的 trace 文件。
+
+    每个事件为一个字典：name、cat、ts（开始时间，Unix 秒）、dur（秒）、pid、tid 和 args。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.events = []
+
+    @contextmanager
+    def span(self, name, cat="stage", **args):
+        """
+        记录一段代码的耗时。with 语句得到的字典可以在执行过程中补充指标，例如 span["bytes"] = n。
+        代码块抛出异常时记录 error 并继续抛出。
+        """
+        start = time.time()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = repr(e)
+            raise
+        finally:
+            self.add(name, cat, start, time.time() - start, args)
+
+    def add(self, name, cat, ts, dur, args=None, pid=None, tid=None):
+        event = {
+            "name": name,
+            "cat": cat,
+            "ts": ts,
+            "dur": dur,
+            "pid": pid if pid is not None else os.getpid(),
+            "tid": tid if tid is not None else threading.get_ident(),
+            "args": dict(args or {}),
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def mark(self) -> int:
+        with self._lock:
+            return len(self.events)
+
+    def events_since(self, mark: int):
+        """
+        返回 mark 之后记录的事件，用于把工作进程中的事件带回主进程。
+        """
+        with self._lock:
+            return list(self.events[mark:])
+
+    def extend(self, events) -> None:
+        with self._lock:
+            self.events.extend(events)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.events = []
+
+    def summary(self) -> dict:
+        """
+        按事件名称汇总次数、总耗时和最大耗时，以及数值型指标的累计值。
+        """
+        summary = {}
+        for event in self.events:
+            item = summary.setdefault(event["name"], {"cat": event["cat"], "count": 0, "total_s": 0.0, "max_s": 0.0})
+            item["count"] += 1
+            item["total_s"] += event["dur"]
+            item["max_s"] = max(item["max_s"], event["dur"])
+            for key, value in event["args"].items():
+                # 速率类指标（帧率、吞吐量）累加没有意义，不计入汇总
+                if key.endswith("_fps") or key.endswith("_kib_s"):
+                    continue
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                # 内存和文件描述符是某一时刻的读数，汇总其最大值
+                if key.endswith("_mb") or key.endswith("_fds"):
+                    item[f"max_{key}"] = max(item.get(f"max_{key}", value), value)
+                else:
+                    item[f"sum_{key}"] = item.get(f"sum_{key}", 0) + value
+        return summary
+
+    def to_json(self, path) -> str:
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({"events": events, "summary": self.summary()}, file, ensure_ascii=False, indent=2)
+        return path
+
+    def to_chrome_trace(self, path) -> str:
+        """
+        导出 Chrome trace event 格式（可在 chrome://tracing 或 ui.perfetto.dev 中打开）。
+        """
+        with self._lock:
+            events = list(self.events)
+        origin = min((event["ts"] for event in events), default=0)
+        trace_events = [{
+            "name": event["name"],
+            "cat": event["cat"],
+            "ph": "X",
+            "ts": round((event["ts"] - origin) * 1e6),
+            "dur": round(event["dur"] * 1e6),
+            "pid": event["pid"],
+            "tid": event["tid"],
+            "args": event["args"],
+        } for event in events]
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file, ensure_ascii=False)
+        return path
+
+    def export(self, folder, prefix="trace") -> tuple:
+        """
+        把 JSON 和 Chrome trace 写入 folder，返回两个文件的路径。
+        """
+        os.makedirs(folder, exist_ok=True)
+        return (self.to_json(os.path.join(folder, f"{prefix}.json")),
+                self.to_chrome_trace(os.path.join(folder, f"{prefix}.chrome.json")))
+
+
+# 进程内共享的 tracer，工作进程中的事件通过 mark/events_since 带回主进程
+TRACER = Tracer()